@@ -0,0 +1,233 @@
+"""
+An asyncio front end for the kennel routes.
+
+Each connection is a coroutine rather than a thread, so thousands of idle
+keep-alive clients cost only a socket and a small buffer. The blocking
+sqlite views run on a bounded thread pool through `dispatch.handle`, the
+same entry point the stdlib HandleRequests server uses.
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import dispatch
+import servers
+import settings
+
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class BadRequest(Exception):
+    """
+    Raised when a request cannot be parsed.
+
+    """
+
+
+async def read_request(reader):
+    """
+    Read one request from the stream.
+
+    Returns (method, path, version, headers, body), or None when the client
+    closed the connection before sending another request.
+    """
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as ex:
+        if not ex.partial.strip():
+            return None
+        raise BadRequest("truncated request") from ex
+    except asyncio.LimitOverrunError as ex:
+        raise BadRequest("request header too large") from ex
+
+    lines = head.decode('latin-1').split("\r\n")
+    try:
+        (method, path, version) = lines[0].split()
+    except ValueError as ex:
+        raise BadRequest(f"bad request line {lines[0]!r}") from ex
+
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        (name, _, value) = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    try:
+        length = dispatch.content_length(headers.get('content-length'))
+    except ValueError as ex:
+        raise BadRequest(str(ex)) from ex
+    body = await reader.readexactly(length) if length else b""
+    return (method, path, version, headers, body)
+
+
+def wants_keep_alive(version, headers):
+    """
+    Decide whether the connection stays open after this request.
+
+    """
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.1':
+        return connection != 'close'
+    return connection == 'keep-alive'
+
+
+def encode_head(response, keep_alive, chunked=False):
+    """
+    Serialize the status line and headers of a dispatch.Response.
+
+    Streamed bodies are framed with chunked transfer encoding (or, for
+    HTTP/1.0 clients, by closing the connection), everything else with
+    Content-Length.
+    """
+    try:
+        reason = HTTPStatus(response.status).phrase
+    except ValueError:
+        reason = ""
+    lines = [f"HTTP/1.1 {response.status} {reason}"]
+    for (name, value) in response.headers:
+        lines.append(f"{name}: {value}")
+    if chunked:
+        lines.append("Transfer-Encoding: chunked")
+    elif not response.streaming and response.status != 304:
+        lines.append(f"Content-Length: {len(response.body)}")
+    lines.append("Connection: keep-alive" if keep_alive else "Connection: close")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin-1')
+
+
+def encode_response(response, keep_alive):
+    """
+    Serialize a dispatch.Response with a bytes body for the wire.
+
+    """
+    return encode_head(response, keep_alive) + response.body
+
+
+class AsyncServer():
+    """
+    Serve dispatch.handle over asyncio streams.
+
+    """
+    def __init__(self, host, port, threads, idle_timeout=settings.IDLE_TIMEOUT,
+                 max_requests=settings.MAX_KEEPALIVE_REQUESTS):
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self.max_requests = max_requests
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="kennel-async")
+
+    async def handle_connection(self, reader, writer):
+        """
+        Serve requests on one connection until it closes or idles out.
+
+        """
+        loop = asyncio.get_running_loop()
+        served = 0
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(read_request(reader),
+                                                     self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                except BadRequest as ex:
+                    # The rest of the stream cannot be framed, so the
+                    # connection is closed after the 400
+                    response = dispatch.json_response(400, {'message': str(ex)})
+                    writer.write(encode_response(response, False))
+                    await writer.drain()
+                    break
+                if request is None:
+                    break
+
+                (method, path, version, headers, body) = request
+                served += 1
+                keep_alive = (wants_keep_alive(version, headers)
+                              and served < self.max_requests)
+                # dispatch.handle answers a failing handler with a 500 itself
+                response = await loop.run_in_executor(
+                    self.executor, dispatch.handle, method, path, body, headers)
+
+                if response.streaming:
+                    chunked = version != 'HTTP/1.0'
+                    keep_alive = keep_alive and chunked
+                    await self.write_stream(writer, response, keep_alive, chunked)
+                else:
+                    writer.write(encode_response(response, keep_alive))
+                    await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def write_stream(self, writer, response, keep_alive, chunked):
+        """
+        Send a streamed body as chunks, pulling each chunk on the executor.
+
+        """
+        loop = asyncio.get_running_loop()
+        next_chunk = functools.partial(next, response.body, None)
+        try:
+            writer.write(encode_head(response, keep_alive, chunked))
+            while True:
+                chunk = await loop.run_in_executor(self.executor, next_chunk)
+                if chunk is None:
+                    break
+                if chunk and chunked:
+                    writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                elif chunk:
+                    writer.write(chunk)
+                await writer.drain()
+            if chunked:
+                writer.write(b"0\r\n\r\n")
+                await writer.drain()
+        finally:
+            await loop.run_in_executor(self.executor, response.close)
+
+    async def serve(self):
+        """
+        Accept connections until cancelled.
+
+        """
+        server = await asyncio.start_server(self.handle_connection,
+                                            self.host or None, self.port,
+                                            limit=MAX_HEADER_BYTES, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        """
+        Run the event loop until interrupted.
+
+        """
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.shutdown(wait=True)
+
+
+def serve_forever(args):
+    """
+    Run the asyncio front end with the shared server settings.
+
+    """
+    AsyncServer(args.host, args.port, args.threads,
+                args.idle_timeout, args.max_keepalive_requests).run()
+
+
+def main(argv=None):
+    """
+    Start the asyncio server; accepts the same options as request_handler.py.
+
+    """
+    args = settings.parse_args(argv)
+    servers.prepare(args)
+    serve_forever(args)
+
+
+if __name__ == "__main__":
+    main()
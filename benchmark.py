@@ -0,0 +1,530 @@
+"""
+Micro-benchmarks for the kennel server.
+
+Run `python benchmark.py <name>` from the repository root. Every benchmark
+works against a scratch copy of the database so kennel.sqlite3 is never
+modified.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import compression
+import dispatch
+import metrics
+import migrate
+import router
+import views
+from views import cache, database
+
+
+def scratch_database(source="./kennel.sqlite3"):
+    """
+    Copy the database into a temporary directory and return the new path.
+
+    """
+    directory = tempfile.mkdtemp(prefix="kennel-bench-")
+    path = os.path.join(directory, "kennel.sqlite3")
+    shutil.copyfile(source, path)
+    return path
+
+
+def rate(func, requests, threads):
+    """
+    Call `func` `requests` times across `threads` threads, returning calls/sec.
+
+    """
+    def work(count):
+        for _ in range(count):
+            func()
+
+    share = [requests // threads] * threads
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(work, share))
+    return sum(share) / (time.perf_counter() - start)
+
+
+def bench_pool(args):
+    """
+    Requests/sec for the animal views with and without connection pooling.
+
+    """
+    path = scratch_database()
+    # Measure the database path, not the entity cache in front of it
+    cache.configure(max_size=0)
+    calls = {
+        'get_all_animals': views.get_all_animals,
+        'get_single_animal': lambda: views.get_single_animal(2),
+    }
+
+    print(f"{'view':<20}{'threads':>8}{'no pool':>12}{'pooled':>12}{'speedup':>10}")
+    for name, func in calls.items():
+        for threads in args.threads:
+            database.configure(path=path, size=0)
+            before = rate(func, args.requests, threads)
+            database.configure(path=path, size=args.pool_size)
+            after = rate(func, args.requests, threads)
+            print(f"{name:<20}{threads:>8}{before:>12.0f}{after:>12.0f}"
+                  f"{after / before:>9.2f}x")
+
+
+def free_port():
+    """
+    Ask the OS for an unused TCP port.
+
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, port, db_path, *extra):
+    """
+    Start request_handler.py in a subprocess and wait until it accepts.
+
+    The server runs in its own session, so its prefork workers can be
+    killed together with it.
+    """
+    process = subprocess.Popen(
+        [sys.executable, 'request_handler.py', '--mode', mode, '--port', str(port),
+         '--db-path', db_path, *extra],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError(f"{mode} server did not start on port {port}")
+
+
+async def http_get(port, path, conn=None):
+    """
+    Send a GET over `conn` (or a new connection) and read the full response.
+
+    Returns (status, body, conn) where conn is None if the server closed it.
+    """
+    return await http_request(port, 'GET', path, conn=conn)
+
+
+async def http_request(port, method, path, body=b"", conn=None):
+    """
+    Send any request over `conn` (or a new connection), like http_get.
+
+    """
+    if conn is None:
+        conn = await asyncio.open_connection('127.0.0.1', port)
+    (reader, writer) = conn
+    length = f"Content-Length: {len(body)}\r\n" if body else ""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n{length}\r\n".encode()
+                 + body)
+    await writer.drain()
+
+    head = (await reader.readuntil(b"\r\n\r\n")).decode('latin-1').split("\r\n")
+    status = int(head[0].split()[1])
+    headers = {}
+    for line in head[1:]:
+        (name, _, value) = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    keep_alive = (head[0].startswith("HTTP/1.1")
+                  and headers.get('connection', '').lower() != 'close')
+    if 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        body = await read_chunked(reader)
+    else:
+        body = await reader.read()
+        keep_alive = False
+
+    if not keep_alive:
+        writer.close()
+        conn = None
+    return (status, body, conn)
+
+
+async def read_chunked(reader):
+    """
+    Read a body sent with chunked transfer encoding.
+
+    """
+    chunks = []
+    while True:
+        size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+        if size == 0:
+            # The server sends no trailers, only the final blank line
+            await reader.readuntil(b"\r\n")
+            return b"".join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readexactly(2)
+
+
+def percentile(samples, pct):
+    """
+    Return the pct-th percentile of a sorted list.
+
+    """
+    if not samples:
+        return float('nan')
+    index = min(len(samples) - 1, int(round(pct / 100 * (len(samples) - 1))))
+    return samples[index]
+
+
+async def run_clients(port, path, clients, requests):
+    """
+    Run `clients` concurrent clients sending `requests` GETs each.
+
+    """
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        conn = None
+        for _ in range(requests):
+            start = time.perf_counter()
+            try:
+                (status, _, conn) = await asyncio.wait_for(http_get(port, path, conn), 30)
+                if status >= 400:
+                    errors += 1
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                errors += 1
+                conn = None
+                continue
+            latencies.append(time.perf_counter() - start)
+        if conn is not None:
+            conn[1].close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000
+    }
+
+
+def bench_frontends(args):
+    """
+    Latency of the stdlib and asyncio front ends under many concurrent clients.
+
+    """
+    path = scratch_database()
+    print(f"{args.clients} clients x {args.per_client} requests of {args.path}")
+    print(f"{'mode':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for mode in args.modes:
+        port = free_port()
+        server = start_server(mode, port, path, '--threads', str(args.server_threads))
+        try:
+            result = asyncio.run(run_clients(port, args.path, args.clients, args.per_client))
+        finally:
+            server.terminate()
+            server.wait()
+        print(f"{mode:<10}{result['rps']:>10.0f}{result['p50_ms']:>10.1f}"
+              f"{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['errors']:>8}")
+
+
+def add_animals(path, count):
+    """
+    Pad the scratch database with `count` synthetic animals.
+
+    """
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.executemany(
+            "INSERT INTO Animal (name, status, breed, customer_id, location_id) "
+            "VALUES (?, ?, ?, ?, ?)",
+            ((f"Animal {i}", ('Kennel', 'Treatment', 'Recreation')[i % 3],
+              ('Poodle', 'Beagle', 'Boxer', 'Siamese')[i % 4], 1 + i % 4, 1 + i % 2)
+             for i in range(count)))
+    conn.close()
+
+
+def bench_compression(args):
+    """
+    Bytes on the wire and CPU time per request for each content coding.
+
+    """
+    path = scratch_database()
+    add_animals(path, args.rows)
+    database.configure(path=path)
+    cache.configure(max_size=0)
+
+    print(f"GET {args.path} with {args.rows} extra animals, min size "
+          f"{compression.MIN_SIZE} bytes")
+    print(f"{'encoding':<10}{'level':>6}{'bytes':>12}{'ratio':>8}{'cpu ms/req':>12}")
+    cases = [(None, 0)] + [(encoding, level) for encoding in ('gzip', 'deflate')
+                           for level in args.levels]
+    identity = None
+    for (encoding, level) in cases:
+        compression.configure(level=level or compression.LEVEL)
+        headers = {'accept-encoding': encoding} if encoding else {}
+        start = time.process_time()
+        for _ in range(args.repeat):
+            response = dispatch.handle('GET', args.path, headers=headers)
+            body = response.body if not response.streaming else b"".join(response.body)
+        cpu = (time.process_time() - start) / args.repeat * 1000
+        identity = identity or len(body)
+        print(f"{encoding or 'identity':<10}{level or '-':>6}{len(body):>12}"
+              f"{identity / len(body):>7.1f}x{cpu:>12.2f}")
+
+
+def bench_router(args):
+    """
+    Per-request dispatch overhead (URL parsing plus route lookup).
+
+    Extra dummy resources are registered to show that the lookup cost of
+    existing routes does not grow with the size of the route table.
+    """
+    paths = ['/animals', '/animals/2', '/customers?email=mo@silvera.com',
+             '/locations/3?limit=10']
+    print(f"{'routes':>8}" + "".join(f"{path:>34}" for path in paths))
+    for extra in args.extra_resources:
+        resources = dict(dispatch.RESOURCES)
+        for index in range(extra):
+            resources[f"dummy{index}"] = resources['animals']
+        table = dispatch.build_router(resources)
+
+        timings = []
+        for path in paths:
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                table.resolve(router.Request('GET', path))
+            timings.append((time.perf_counter() - start) / args.requests * 1e9)
+        print(f"{len(table.routes):>8}" + "".join(f"{ns:>31.0f} ns" for ns in timings))
+
+
+def bench_writes(args):
+    """
+    POST throughput with and without the group-commit write queue.
+
+    Every client keeps one connection open and creates animals one at a
+    time, so concurrent writers either commit one by one or share commits.
+    The asyncio front end is used so every client is served at once.
+    """
+    body = json.dumps({'name': "Rex", 'breed': "Pug", 'status': "Kennel",
+                       'location_id': 1, 'customer_id': 1}).encode()
+
+    async def writers(port):
+        latencies = []
+        errors = 0
+
+        async def client():
+            nonlocal errors
+            conn = None
+            for _ in range(args.per_client):
+                start = time.perf_counter()
+                try:
+                    (status, _, conn) = await http_request(port, 'POST', '/animals', body, conn)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    (errors, conn) = (errors + 1, None)
+                    continue
+                if status != 201:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(args.clients)))
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return (len(latencies) / elapsed, percentile(latencies, 50) * 1000,
+                percentile(latencies, 99) * 1000, errors)
+
+    print(f"{args.clients} clients x {args.per_client} POST /animals, "
+          f"{args.server_threads} server threads")
+    print(f"{'queue':<8}{'synchronous':<13}{'writes/s':>10}{'p50 ms':>10}"
+          f"{'p99 ms':>10}{'errors':>8}")
+    for synchronous in args.synchronous:
+        for queued in (False, True):
+            path = scratch_database()
+            port = free_port()
+            server = start_server('asyncio', port, path,
+                                  '--threads', str(args.server_threads),
+                                  '--synchronous', synchronous,
+                                  '--write-queue' if queued else '--no-write-queue')
+            try:
+                (throughput, p50, p99, errors) = asyncio.run(writers(port))
+            finally:
+                server.terminate()
+                server.wait()
+            print(f"{'on' if queued else 'off':<8}{synchronous:<13}{throughput:>10.0f}"
+                  f"{p50:>10.1f}{p99:>10.1f}{errors:>8}")
+
+
+class DictAnimal():
+    """
+    The Animal model as it was before __slots__, for comparison.
+
+    """
+    def __init__(self, id, name, breed, status, location_id, customer_id, customer=None):
+        self.id = id
+        self.name = name
+        self.breed = breed
+        self.status = status
+        self.location_id = location_id
+        self.customer_id = customer_id
+        self.location = None
+        self.customer = customer
+
+
+def iter_dict_animals(conn):
+    """
+    Map animal rows the way the views did before: Row, then model, then __dict__.
+
+    """
+    conn.row_factory = sqlite3.Row
+    cursor = conn.execute("""
+        SELECT a.id, a.name, a.breed, a.status, a.location_id, a.customer_id,
+            l.name AS location_name, l.address AS location_address,
+            c.name AS customer_name, c.email AS customer_email
+        FROM Animal a
+        JOIN Location l ON l.id = a.location_id
+        JOIN Customer c ON c.id = a.customer_id
+        ORDER BY a.id""")
+    for row in cursor:
+        animal = DictAnimal(row['id'], row['name'], row['breed'], row['status'],
+                            row['location_id'], row['customer_id'],
+                            {'name': row['customer_name'], 'email': row['customer_email']})
+        animal.location = {'name': row['location_name'], 'address': row['location_address']}
+        yield animal.__dict__
+
+
+def bench_models(args):
+    """
+    Rows/sec and bytes/row of the animal row mapping, before and after __slots__.
+
+    Run with `--rows 1000000` for the 1M-row table. Rates are the best of
+    `--repeat` passes; bytes/row is the memory held per mapped row when a
+    page of `--requests` rows is kept in a list.
+    """
+    path = scratch_database()
+    add_animals(path, args.rows)
+    database.configure(path=path)
+
+    def dict_rows():
+        conn = sqlite3.connect(path)
+        try:
+            yield from iter_dict_animals(conn)
+        finally:
+            conn.close()
+
+    paths = {
+        'Row + __dict__': (dict_rows, json.dumps),
+        '__slots__ + from_row': (views.iter_animals, lambda animal: animal.to_json())
+    }
+
+    print(f"{args.rows} extra animals, bytes/row measured over {args.requests} rows")
+    print(f"{'mapping':<22}{'map rows/s':>12}{'json rows/s':>13}{'bytes/row':>11}")
+    def best_rate(work):
+        best = 0
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            count = work()
+            best = max(best, count / (time.perf_counter() - start))
+        return best
+
+    for (name, (rows, encode)) in paths.items():
+        mapped = best_rate(lambda: sum(1 for _ in rows()))
+        encoded = best_rate(lambda: sum(1 for row in rows() if encode(row)))
+
+        source = rows()
+        tracemalloc.start()
+        page = [row for (_, row) in zip(range(args.requests), source)]
+        per_row = tracemalloc.get_traced_memory()[0] / len(page)
+        tracemalloc.stop()
+        source.close()
+        # Keeping the page alive would slow the garbage collector for the next mapping
+        del page
+        print(f"{name:<22}{mapped:>12.0f}{encoded:>13.0f}{per_row:>11.0f}")
+
+
+def bench_metrics(args):
+    """
+    Microseconds per dispatched request with metrics recording off and on.
+
+    """
+    path = scratch_database()
+    migrate.migrate(path)
+    add_animals(path, args.rows)
+    database.configure(path=path)
+    cache.configure(max_size=0)
+
+    paths = ['/animals/2', '/animals?limit=100', '/locations/stats', '/animals']
+    print(f"{args.rows} extra animals, best of {args.repeat} passes")
+    print(f"{'path':<22}{'off us/req':>12}{'on us/req':>12}{'overhead':>10}")
+    for request_path in paths:
+        requests = max(1, args.requests // 100) if request_path == '/animals' else args.requests
+        timings = []
+        for enabled in (False, True):
+            metrics.configure(enabled=enabled)
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                for _ in range(requests):
+                    response = dispatch.handle('GET', request_path)
+                    if response.streaming:
+                        for _ in response.body:
+                            pass
+                        response.close()
+                elapsed = (time.perf_counter() - start) / requests * 1e6
+                best = elapsed if best is None else min(best, elapsed)
+            timings.append(best)
+        (off, on) = timings
+        print(f"{request_path:<22}{off:>12.1f}{on:>12.1f}{(on - off) / off:>9.1%}")
+
+
+BENCHMARKS = {
+    'pool': bench_pool,
+    'frontends': bench_frontends,
+    'compression': bench_compression,
+    'router': bench_router,
+    'writes': bench_writes,
+    'models': bench_models,
+    'metrics': bench_metrics,
+}
+
+
+def main(argv=None):
+    """
+    Parse the command line and run the selected benchmark.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--pool-size', type=int, default=database.POOL_SIZE)
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--per-client', type=int, default=20)
+    parser.add_argument('--path', default='/animals/2')
+    parser.add_argument('--modes', nargs='+', default=['single', 'threaded', 'asyncio'])
+    parser.add_argument('--server-threads', type=int, default=16)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 6, 9])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--extra-resources', type=int, nargs='+', default=[0, 100, 1000])
+    parser.add_argument('--synchronous', nargs='+', default=['FULL', 'NORMAL'])
+    args = parser.parse_args(argv)
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
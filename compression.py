@@ -0,0 +1,131 @@
+"""
+Accept-Encoding negotiated gzip/deflate compression of responses.
+
+Bodies smaller than MIN_SIZE are sent as they are, since compressing them
+costs more CPU than it saves on the wire. Streamed bodies are compressed
+chunk by chunk as they are produced.
+"""
+import os
+import zlib
+
+LEVEL = int(os.environ.get("KENNEL_COMPRESS_LEVEL", 6))
+MIN_SIZE = int(os.environ.get("KENNEL_COMPRESS_MIN_SIZE", 1024))
+
+# zlib window bits selecting the container format of each encoding
+WBITS = {
+    'gzip': 16 + zlib.MAX_WBITS,
+    'deflate': zlib.MAX_WBITS
+}
+
+# Preferred first when the client gives both the same weight
+PREFERENCE = ('gzip', 'deflate')
+
+
+def configure(level=None, min_size=None):
+    """
+    Set the compression level (0 disables compression) and size threshold.
+
+    """
+    global LEVEL, MIN_SIZE
+    if level is not None:
+        LEVEL = level
+    if min_size is not None:
+        MIN_SIZE = min_size
+
+
+def negotiate(accept_encoding):
+    """
+    Pick the content coding to use for an Accept-Encoding header, or None.
+
+    """
+    if not accept_encoding or LEVEL <= 0:
+        return None
+
+    weights = {}
+    for item in accept_encoding.split(','):
+        (coding, _, params) = item.strip().partition(';')
+        coding = coding.strip().lower()
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding] = weight
+
+    (best, best_weight) = (None, 0.0)
+    for coding in PREFERENCE:
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > best_weight:
+            (best, best_weight) = (coding, weight)
+    return best
+
+
+class CompressedStream():
+    """
+    Compress an iterator of chunks, closing the source when closed.
+
+    """
+    def __init__(self, chunks, encoding, level):
+        self.source = chunks
+        self.chunks = self._compress(chunks, zlib.compressobj(level, zlib.DEFLATED,
+                                                              WBITS[encoding]))
+
+    @staticmethod
+    def _compress(chunks, compressor):
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.chunks)
+
+    def close(self):
+        """
+        Stop compressing and close the source stream.
+
+        """
+        self.chunks.close()
+        close = getattr(self.source, 'close', None)
+        if close is not None:
+            close()
+
+
+def content_encoding(response):
+    """
+    The content coding `compress` applied to `response`, or None.
+
+    """
+    for (name, value) in response.headers:
+        if name == 'Content-Encoding':
+            return value
+    return None
+
+
+def compress(response, encoding):
+    """
+    Compress a successful response in place with `encoding`, if worthwhile.
+
+    """
+    if response.status in (200, 304):
+        response.headers.append(('Vary', 'Accept-Encoding'))
+
+    if encoding is None or response.status != 200:
+        return response
+
+    if response.streaming:
+        response.body = CompressedStream(response.body, encoding, LEVEL)
+    elif len(response.body) >= MIN_SIZE:
+        compressor = zlib.compressobj(LEVEL, zlib.DEFLATED, WBITS[encoding])
+        response.body = compressor.compress(response.body) + compressor.flush()
+    else:
+        return response
+
+    response.headers.append(('Content-Encoding', encoding))
+    return response
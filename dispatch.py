@@ -0,0 +1,920 @@
+"""
+Front-end independent request dispatch.
+
+`handle()` turns a method, path and body into a Response. Both the stdlib
+HandleRequests server and the asyncio server call it, so the two front ends
+always route and serialize requests the same way. Handlers are looked up in
+a route table built from `views.routes.RESOURCES`.
+
+A Response body is either bytes or, for whole collections, an iterator of
+byte chunks that the front ends send with chunked transfer encoding.
+"""
+import sys
+import traceback
+from functools import partial
+from urllib.parse import urlencode
+import compression
+import metrics
+import profiling
+import serializer
+from models import Customer, Location
+from router import Request, Router
+from views import database, versions, write_queue
+from views.bulk import BulkError
+from views.cache import CACHE
+from views.database import FETCH_SIZE, PoolExhausted
+from views.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from views.projection import PartialRow, project
+from views.relations import attach
+from views.search import match_expression
+from views.validation import Conflict
+from views.write_queue import WriteTimeout
+from views.routes import RESOURCES
+
+CORS_HEADERS = [
+    ('Access-Control-Allow-Origin', '*'),
+]
+
+# Query parameters read by dispatch itself rather than a resource's filter set
+RESERVED_PARAMS = ('limit', 'after', 'offset', 'fields', '_expand', '_embed', 'q')
+
+# Encoded rows are gathered into chunks of roughly this many bytes
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# Seconds an overloaded server asks clients to wait before retrying
+RETRY_AFTER = 1
+
+
+class Response():
+    """
+    The status, headers and encoded body of a response.
+
+    """
+    def __init__(self, status, body=b"", headers=None):
+        self.status = status
+        self.body = body
+        self.headers = headers if headers is not None else []
+
+    @property
+    def streaming(self):
+        """
+        True when the body is an iterator of chunks rather than bytes.
+
+        """
+        return not isinstance(self.body, bytes)
+
+    def close(self):
+        """
+        Release the database cursor behind a streamed body.
+
+        """
+        close = getattr(self.body, 'close', None)
+        if close is not None:
+            close()
+
+
+def json_response(status, data, headers=None):
+    """
+    Build a JSON response.
+
+    """
+    headers = [('Content-type', 'application/json')] + CORS_HEADERS + (headers or [])
+    start = metrics.clock()
+    body = serializer.dumps(data)
+    metrics.add_serialize(metrics.clock() - start)
+    return Response(status, body, headers)
+
+
+def json_array_chunks(rows, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Encode an iterable of models as a JSON array, yielding bytes chunks.
+
+    Only one chunk of encoded rows is held in memory at a time.
+    """
+    buffer = [b"["]
+    size = 1
+    separator = b""
+    for row in rows:
+        encoded = separator + row.to_json()
+        separator = b","
+        buffer.append(encoded)
+        size += len(encoded)
+        if size >= chunk_size:
+            yield b"".join(buffer)
+            buffer = []
+            size = 0
+    buffer.append(b"]")
+    yield b"".join(buffer)
+
+
+class ChunkStream():
+    """
+    An iterator of JSON chunks that closes its row source when closed.
+
+    """
+    def __init__(self, rows):
+        self.rows = rows
+        self.chunks = json_array_chunks(rows)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        timer = metrics.current()
+        if timer is None:
+            return next(self.chunks)
+        (start, db) = (metrics.clock(), timer.db)
+        try:
+            return next(self.chunks)
+        finally:
+            # Rows are read while a chunk is encoded; only the rest is encoding
+            timer.serialize += metrics.clock() - start - (timer.db - db)
+
+    def close(self):
+        """
+        Stop encoding and close the underlying cursor generator.
+
+        """
+        self.chunks.close()
+        self.rows.close()
+
+
+def stream_response(status, rows):
+    """
+    Build a JSON array response that is encoded while it is being sent.
+
+    """
+    headers = [('Content-type', 'application/json')] + CORS_HEADERS
+    return Response(status, ChunkStream(rows), headers)
+
+
+def empty_response(status):
+    """
+    Build a JSON response without a body.
+
+    """
+    return Response(status, b"", [('Content-type', 'application/json')] + CORS_HEADERS)
+
+
+def content_length(value):
+    """
+    The body size in bytes given by a Content-Length header value, or 0.
+
+    Raises ValueError unless it is a non-negative decimal integer, which
+    the front ends answer with a 400 before reading any body.
+    """
+    if value is None:
+        return 0
+    value = value.strip()
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError(f"bad Content-Length {value!r}")
+    return int(value)
+
+
+def read_json(request):
+    """
+    Decode the JSON body of a request.
+
+    Raises ValueError when the body is not valid JSON.
+    """
+    try:
+        return serializer.loads(request.body)
+    except ValueError as ex:
+        raise ValueError(f"request body is not valid JSON: {ex}") from ex
+
+
+def page_params(query):
+    """
+    Read the `limit` and `after` keyset cursor from a parsed query string.
+
+    Raises ValueError when either is missing a valid value.
+    """
+    try:
+        limit = int(query.get('limit', [DEFAULT_PAGE_SIZE])[0])
+        after = int(query['after'][0]) if 'after' in query else None
+    except ValueError as ex:
+        raise ValueError("limit and after must be integers") from ex
+
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    return (min(limit, MAX_PAGE_SIZE), after)
+
+
+def search_params(query):
+    """
+    Read the ?q= search string, `limit` and `offset` from a parsed query string.
+
+    Returns the FTS5 match expression, limit and offset. Raises ValueError
+    when any of them is invalid.
+    """
+    if 'after' in query:
+        raise ValueError("search results are paged with offset, not after")
+    try:
+        limit = int(query.get('limit', [DEFAULT_PAGE_SIZE])[0])
+        offset = int(query.get('offset', [0])[0])
+    except ValueError as ex:
+        raise ValueError("limit and offset must be integers") from ex
+
+    if limit < 1 or offset < 0:
+        raise ValueError("limit must be at least 1 and offset at least 0")
+    return (match_expression(query['q'][0]), min(limit, MAX_PAGE_SIZE), offset)
+
+
+def fields_param(query, model):
+    """
+    Read a sparse fieldset (?fields=id,name) from a parsed query string.
+
+    Returns None when the parameter is absent. Raises ValueError naming any
+    field that `model` does not have.
+    """
+    if 'fields' not in query:
+        return None
+
+    fields = []
+    for value in query['fields']:
+        for field in value.split(','):
+            field = field.strip()
+            if field and field not in fields:
+                fields.append(field)
+
+    unknown = [field for field in fields if field not in model.fields]
+    if unknown:
+        raise ValueError(f"unknown fields {', '.join(unknown)}; "
+                         f"{request_fields(model)}")
+    return fields
+
+
+def filter_param(query, views):
+    """
+    Compile the ?<field>= filters and ?_sort= of a parsed query string.
+
+    Returns None for resources without a filter set and for queries that
+    neither filter nor sort. Raises ValueError for anything else the
+    filter set does not accept.
+    """
+    filter_set = views.get('filter_set')
+    if filter_set is None:
+        return None
+    return filter_set.parse(query, RESERVED_PARAMS + tuple(views.get('lookups', ())))
+
+
+def relations_param(query, views):
+    """
+    Read the relations asked for with ?_expand= and ?_embed=.
+
+    Returns {name: Relation} in the order requested, empty when there are
+    none. Raises ValueError for a relation the resource does not have.
+    """
+    relations = {}
+    for param in ('_expand', '_embed'):
+        available = views.get(param[1:], {})
+        for value in query.get(param, ()):
+            for name in value.split(','):
+                name = name.strip()
+                if not name:
+                    continue
+                if name not in available:
+                    choices = ', '.join(available) or "nothing"
+                    raise ValueError(f"cannot {param[1:]} {name}; {param[1:]} {choices}")
+                relations[name] = available[name]
+    return relations
+
+
+def request_fields(model):
+    """
+    Describe the fields of `model` that may be requested.
+
+    """
+    return f"{model.__name__.lower()} fields are {', '.join(model.fields)}"
+
+
+def get_page(request, views, relations=None, **params):
+    """
+    Get one keyset page of a collection, linking to the next page if any.
+
+    `params` (fields, query) are passed on to the list view, and the next
+    link keeps every parameter of this request except the cursor.
+    """
+    try:
+        (limit, after) = page_params(request.query)
+    except ValueError as ex:
+        return json_response(400, {'message': str(ex)})
+
+    rows = views['list'](limit, after, **params)
+    if relations:
+        attach(rows, relations)
+
+    headers = []
+    if len(rows) == limit:
+        headers.append(next_link(request, limit=limit, after=rows[-1]['id']))
+    return json_response(200, rows, headers)
+
+
+def search_page(request, views, relations=None, fields=None, query=None):
+    """
+    Get one ranked page of the full-text matches for ?q=, best match first.
+
+    Filters narrow the matches, but the order is always by rank.
+    """
+    try:
+        (match, limit, offset) = search_params(request.query)
+    except ValueError as ex:
+        return json_response(400, {'message': str(ex)})
+    if query is not None and (query.sort is not None or query.descending):
+        return json_response(400, {'message': "search results are ordered by rank; "
+                                              "_sort and _order cannot be used with q"})
+
+    params = {'query': query} if query is not None else {}
+    rows = [project(row, fields) for row in views['search'](match, limit, offset, **params)]
+    if relations:
+        attach(rows, relations)
+
+    headers = []
+    if len(rows) == limit:
+        headers.append(next_link(request, limit=limit, offset=offset + limit))
+    return json_response(200, rows, headers)
+
+
+def search_all(request, resources):
+    """
+    Handle GET /search?q=, the best matches of every searchable resource.
+
+    """
+    try:
+        (match, limit, offset) = search_params(request.query)
+    except ValueError as ex:
+        return json_response(400, {'message': str(ex)})
+
+    return json_response(200, {resource: views['search'](match, limit, offset)
+                               for (resource, views) in resources.items()
+                               if 'search' in views})
+
+
+def next_link(request, **cursor):
+    """
+    Build the Link header to the next page of a collection.
+
+    The next page keeps every parameter of this request, with `cursor`
+    (limit and after or offset) replacing the current position.
+    """
+    params = {param: [value] for (param, value) in cursor.items()}
+    params.update((param, values) for (param, values) in request.query.items()
+                  if param not in params)
+    next_query = urlencode(params, doseq=True, safe=',')
+    return ('Link', f'</{request.resource}?{next_query}>; rel="next"')
+
+
+def etag_matches(if_none_match, etag):
+    """
+    True when an If-None-Match header value matches `etag`.
+
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def etag_resource(request):
+    """
+    The versions.DEPENDENCIES key of a request: its resource, or
+    '<resource>/<name>' for a nested route such as /locations/<id>/animals.
+
+    """
+    if request.shape in ('collection', 'item'):
+        return request.resource
+    return f"{request.resource}/{request.shape.rpartition('/')[2]}"
+
+
+def route_template(request):
+    """
+    The route a request matched, with its id left out, e.g. /animals/{id}.
+
+    """
+    (item, _, name) = request.shape.partition('/')
+    if item != 'item':
+        return f"/{request.resource}" + ("" if item == 'collection' else f"/{item}")
+    return f"/{request.resource}/{{id}}" + (f"/{name}" if name else "")
+
+
+def related_resources(request):
+    """
+    The resources ?_expand= and ?_embed= add to a response, for its ETag.
+
+    """
+    if request.shape not in ('collection', 'item'):
+        return ()
+    try:
+        relations = relations_param(request.query, RESOURCES.get(request.resource, {}))
+    except ValueError:
+        return ()
+    return tuple(relation.resource for relation in relations.values())
+
+
+def conditional_get(request, handler, encoding=None):
+    """
+    Handle a GET, answering 304 Not Modified when the client's copy is current.
+
+    The ETag comes from the per-table version counters, so a matching
+    request is answered without querying the database or encoding JSON.
+    The response is compressed with `encoding` when worthwhile, and only a
+    body that was actually encoded is tagged as its own representation.
+    """
+    resource = etag_resource(request)
+    if resource not in versions.DEPENDENCIES:
+        return compression.compress(handler(request), encoding)
+
+    # Taken before the query: a write that lands in between makes the body
+    # newer than its tag, which only costs the client one extra 200 later.
+    etag = versions.etag(resource, related_resources(request))
+
+    # The client may hold either coding of the current state, e.g. the
+    # plain body of a response too small to be compressed
+    if_none_match = request.headers.get('if-none-match')
+    for tag in ([etag] if encoding is None else [encoded_etag(etag, encoding), etag]):
+        if etag_matches(if_none_match, tag):
+            return compression.compress(Response(304, b"", CORS_HEADERS + validators(tag)),
+                                        encoding)
+
+    response = compression.compress(handler(request), encoding)
+    if response.status == 200:
+        applied = compression.content_encoding(response)
+        response.headers.extend(validators(etag if applied is None
+                                           else encoded_etag(etag, applied)))
+    return response
+
+
+def encoded_etag(etag, encoding):
+    """
+    The tag of the `encoding` coded representation of `etag`.
+
+    """
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def validators(etag):
+    """
+    The headers that let a client revalidate its copy tagged `etag`.
+
+    """
+    return [('ETag', etag), ('Cache-Control', 'no-cache')]
+
+
+def expanded_rows(views, relations, params, page_size=FETCH_SIZE):
+    """
+    Yield every row of a collection with `relations` attached.
+
+    The collection is read in keyset pages through the list view, so no
+    read connection is held while a page's related entities are loaded.
+    """
+    after = None
+    while True:
+        rows = views['list'](page_size, after, **params)
+        yield from map(PartialRow, attach(rows, relations))
+        if len(rows) < page_size:
+            return
+        after = rows[-1]['id']
+
+
+def get_collection(request, views):
+    """
+    Handle GET /<resource>.
+
+    A lookup parameter (e.g. ?email=) selects a filtered list, ?q= one
+    ranked page of full-text matches, a limit or cursor selects one page,
+    and otherwise the whole collection is streamed straight from the
+    cursor. ?fields= limits the fields of every row, ?_expand= and
+    ?_embed= attach related entities, and resources with a filter set also
+    take filters and ?_sort=.
+    """
+    try:
+        fields = fields_param(request.query, views['model'])
+        relations = relations_param(request.query, views)
+        query = filter_param(request.query, views)
+    except ValueError as ex:
+        return json_response(400, {'message': str(ex)})
+
+    if fields is not None:
+        # Relations are found through a field that must then be selected
+        fields += [relation.requires for relation in relations.values()
+                   if relation.requires not in fields]
+    params = {'fields': fields}
+    if query is not None:
+        params['query'] = query
+
+    for (param, lookup) in views.get('lookups', {}).items():
+        if request.query.get(param):
+            rows = [project(row, fields) for row in lookup(request.query[param][0])]
+            return json_response(200, attach(rows, relations))
+
+    if 'q' in request.query:
+        if 'search' not in views:
+            return json_response(400, {'message': f"{request.resource} cannot be searched"})
+        return search_page(request, views, relations, fields, query)
+
+    if 'limit' in request.query or 'after' in request.query:
+        return get_page(request, views, relations, **params)
+
+    if relations:
+        return stream_response(200, expanded_rows(views, relations, params))
+    return stream_response(200, views['stream'](**params))
+
+
+def get_item(request, views):
+    """
+    Handle GET /<resource>/<id>.
+
+    The entity comes whole from the cache or database and is then trimmed
+    to ?fields=, so every field selection shares one cache entry. Related
+    entities are attached to a copy, never to the cached dictionary.
+    """
+    try:
+        fields = fields_param(request.query, views['model'])
+        relations = relations_param(request.query, views)
+    except ValueError as ex:
+        return json_response(400, {'message': str(ex)})
+
+    data = views['get'](request.id)
+    if data is not None and relations:
+        data = dict(data)
+        attach([data], relations)
+        fields = fields if fields is None else fields + list(relations)
+    return json_response(200, project(data, fields))
+
+
+def get_related(request, view):
+    """
+    Handle GET /<resource>/<id>/<name>, e.g. the animals at a location.
+
+    """
+    return json_response(200, view(request.id))
+
+
+def get_stats(request, views):
+    """
+    Handle GET /<resource>/stats.
+
+    """
+    return json_response(200, views['stats']())
+
+
+def get_item_stats(request, views):
+    """
+    Handle GET /<resource>/<id>/stats.
+
+    """
+    stats = views['item_stats'](request.id)
+    if stats is None:
+        return json_response(404, {'message':
+                                   f"/{request.resource}/{request.id} does not exist"})
+    return json_response(200, stats)
+
+
+def create_item(request, views):
+    """
+    Handle POST /<resource>.
+
+    A JSON array creates every item in one transaction. By default the
+    batch is all-or-nothing; with ?mode=partial each item succeeds or fails
+    on its own and the response lists a result per item.
+    """
+    try:
+        post_body = read_json(request)
+    except ValueError as ex:
+        return json_response(400, {'message': str(ex)})
+
+    if isinstance(post_body, list):
+        return create_many(request, views, post_body)
+
+    # Encode the new object and send in response
+    try:
+        return json_response(201, views['create'](post_body))
+    except ValueError as ex:
+        return json_response(400, {'message': str(ex)})
+    except Conflict as ex:
+        return json_response(409, {'message': str(ex)})
+
+
+def create_many(request, views, items):
+    """
+    Create a batch of items, returning them with their ids in order.
+
+    """
+    mode = request.query.get('mode', ['atomic'])[0]
+    if mode not in ('atomic', 'partial'):
+        return json_response(400, {'message': "mode must be atomic or partial"})
+
+    try:
+        results = views['create_many'](items, atomic=(mode == 'atomic'))
+    except BulkError as ex:
+        return json_response(400, {'message': str(ex), 'errors': ex.errors})
+
+    if any('error' in result for result in results):
+        return json_response(207, results)
+    return json_response(201, results)
+
+
+def update_item(request, views):
+    """
+    Handle PUT /<resource>/<id>.
+
+    """
+    try:
+        post_body = read_json(request)
+    except ValueError as ex:
+        return json_response(400, {'message': str(ex)})
+
+    try:
+        updated = views['update'](request.id, post_body)
+    except ValueError as ex:
+        return json_response(400, {'message': str(ex)})
+    except Conflict as ex:
+        return json_response(409, {'message': str(ex)})
+    if updated:
+        return empty_response(204)
+    return empty_response(404)
+
+
+def update_many(request, views):
+    """
+    Handle PATCH /<resource> with a JSON array of {"id", "fields"} changes.
+
+    Every change runs in one transaction and the response lists a result
+    per id. By default the batch is all-or-nothing; with ?mode=partial
+    each change is applied or rejected on its own.
+    """
+    try:
+        changes = read_json(request)
+    except ValueError as ex:
+        return json_response(400, {'message': str(ex)})
+    if not isinstance(changes, list):
+        return json_response(400, {'message': "request body must be a JSON array"})
+
+    mode = request.query.get('mode', ['atomic'])[0]
+    if mode not in ('atomic', 'partial'):
+        return json_response(400, {'message': "mode must be atomic or partial"})
+
+    try:
+        results = views['update_many'](changes, atomic=(mode == 'atomic'))
+    except BulkError as ex:
+        return json_response(400, {'message': str(ex), 'errors': ex.errors})
+
+    if any(result['status'] != 'updated' for result in results):
+        return json_response(207, results)
+    return json_response(200, results)
+
+
+def delete_item(request, views):
+    """
+    Handle DELETE /<resource>/<id>.
+
+    """
+    views['delete'](request.id)
+    return empty_response(204)
+
+
+def delete_many(request, views):
+    """
+    Handle DELETE /<resource>?id=1,2,3 or DELETE /<resource>?<column>=<value>.
+
+    Ids and filter values may be repeated or comma separated; values of one
+    filter are alternatives and different filters must all match. Deletes
+    the matching rows in one transaction and lists a result per id.
+    """
+    values = {param: [value for item in items for value in item.split(',') if value]
+              for (param, items) in request.query.items()}
+
+    if 'id' in values:
+        try:
+            ids = [int(value) for value in values['id']]
+        except ValueError:
+            return json_response(400, {'message': "id must be a list of integers"})
+        if not ids:
+            return json_response(400, {'message': "id must be a list of integers"})
+        return json_response(200, views['delete_many'](ids=ids))
+
+    unknown = [param for param in values if param not in views['filters']]
+    if unknown:
+        return json_response(400, {'message': f"cannot filter on {', '.join(unknown)}"})
+    filters = {param: items for (param, items) in values.items() if items}
+    if not filters:
+        # Never let an empty query string delete the whole collection
+        return json_response(400, {'message': "give ids or at least one filter"})
+    return json_response(200, views['delete_many'](filters=filters))
+
+
+def component_stats():
+    """
+    The stats() of the caches, pools and write queue as metric families.
+
+    """
+    cache = CACHE.stats()
+    pools = [({'pool': name}, pool.stats())
+             for (name, pool) in (('read', database.READ_POOL), ('write', database.POOL))]
+    fragments = [({'cache': name}, model.embedded.stats())
+                 for (name, model) in (('location', Location), ('customer', Customer))]
+    families = [
+        ('kennel_cache_entries', 'gauge', "Entities held by the entity cache.",
+         [({}, cache['size'])]),
+        ('kennel_cache_hits_total', 'counter', "Entity cache lookups answered.",
+         [({}, cache['hits'])]),
+        ('kennel_cache_misses_total', 'counter', "Entity cache lookups that missed.",
+         [({}, cache['misses'])]),
+        ('kennel_cache_evictions_total', 'counter', "Entities evicted to stay under max_size.",
+         [({}, cache['evictions'])]),
+        ('kennel_cache_invalidations_total', 'counter', "Entities dropped after a write.",
+         [({}, cache['invalidations'])]),
+        ('kennel_pool_size', 'gauge', "Connections a pool may open.",
+         [(labels, stats['size']) for (labels, stats) in pools]),
+        ('kennel_pool_idle', 'gauge', "Open connections waiting in a pool.",
+         [(labels, stats['idle']) for (labels, stats) in pools]),
+        ('kennel_pool_created_total', 'counter', "Connections a pool has opened.",
+         [(labels, stats['created']) for (labels, stats) in pools]),
+        ('kennel_fragments_entries', 'gauge', "Encoded objects held by a fragment cache.",
+         [(labels, stats['size']) for (labels, stats) in fragments]),
+        ('kennel_fragments_hits_total', 'counter', "Fragment cache lookups answered.",
+         [(labels, stats['hits']) for (labels, stats) in fragments]),
+        ('kennel_fragments_misses_total', 'counter', "Fragment cache lookups that missed.",
+         [(labels, stats['misses']) for (labels, stats) in fragments])
+    ]
+    queue = write_queue.QUEUE
+    if queue is not None:
+        stats = queue.stats()
+        families += [
+            ('kennel_write_queue_commits_total', 'counter', "Transactions the queue committed.",
+             [({}, stats['commits'])]),
+            ('kennel_write_queue_writes_total', 'counter', "Writes the queue executed.",
+             [({}, stats['writes'])]),
+            ('kennel_write_queue_pending', 'gauge', "Writes waiting for the queue.",
+             [({}, stats['pending'])])
+        ]
+    return families
+
+
+def get_metrics(request):
+    """
+    Handle GET /metrics, the request and component metrics of this process.
+
+    """
+    body = metrics.render() + metrics.render_stats(component_stats())
+    return Response(200, body, [('Content-type', metrics.CONTENT_TYPE)])
+
+
+def admin_error(request):
+    """
+    A 403 response unless the request carries the admin token, else None.
+
+    """
+    if profiling.ADMIN_TOKEN is None:
+        return json_response(403, {'message': "no admin token is configured"})
+    if not profiling.authorized(request.headers):
+        return json_response(403, {'message': "X-Admin-Token is missing or wrong"})
+    return None
+
+
+def get_profiling(request):
+    """
+    Handle GET /profile, the current profiling session.
+
+    """
+    return admin_error(request) or json_response(200, profiling.session())
+
+
+def start_profiling(request):
+    """
+    Handle POST /profile, profiling the next requests.
+
+    The body gives the number of `requests`, and optionally the `sample`
+    fraction of requests to profile and the `route` to profile.
+    """
+    error = admin_error(request)
+    if error is not None:
+        return error
+    try:
+        body = read_json(request)
+        if not isinstance(body, dict):
+            raise ValueError("request body must be a JSON object")
+        session = profiling.start_session(body.get('requests'), body.get('sample', 1.0),
+                                          body.get('route'))
+    except ValueError as ex:
+        return json_response(400, {'message': str(ex)})
+    return json_response(200, session)
+
+
+def stop_profiling(request):
+    """
+    Handle DELETE /profile, ending the profiling session.
+
+    """
+    return admin_error(request) or json_response(200, profiling.stop_session())
+
+
+def options():
+    """
+    Handle OPTIONS (CORS preflight) requests.
+
+    """
+    return Response(200, b"", CORS_HEADERS + [
+        ('Access-Control-Allow-Methods', 'GET, POST, PUT, PATCH, DELETE'),
+        ('Access-Control-Allow-Headers', 'X-Requested-With, Content-Type, Accept')
+    ])
+
+
+def build_router(resources):
+    """
+    Compile the route table for every resource in `resources`.
+
+    """
+    router = Router()
+    router.add('GET', 'metrics', 'collection', get_metrics)
+    router.add('GET', 'profile', 'collection', get_profiling)
+    router.add('POST', 'profile', 'collection', start_profiling)
+    router.add('DELETE', 'profile', 'collection', stop_profiling)
+    router.add('GET', 'search', 'collection', partial(search_all, resources=resources))
+    for (resource, views) in resources.items():
+        router.add('GET', resource, 'collection', partial(get_collection, views=views))
+        router.add('GET', resource, 'item', partial(get_item, views=views))
+        router.add('POST', resource, 'collection', partial(create_item, views=views))
+        router.add('PUT', resource, 'item', partial(update_item, views=views))
+        router.add('PATCH', resource, 'collection', partial(update_many, views=views))
+        router.add('DELETE', resource, 'item', partial(delete_item, views=views))
+        router.add('DELETE', resource, 'collection', partial(delete_many, views=views))
+        if 'stats' in views:
+            router.add('GET', resource, 'stats', partial(get_stats, views=views))
+        if 'item_stats' in views:
+            router.add('GET', resource, 'item/stats', partial(get_item_stats, views=views))
+        for (name, view) in views.get('related', {}).items():
+            router.add('GET', resource, 'item/' + name, partial(get_related, view=view))
+    return router
+
+
+ROUTER = build_router(RESOURCES)
+
+
+def handle(method, path, body=b"", headers=None):
+    """
+    Dispatch one request and return its Response.
+
+    `headers` is any mapping with a case-insensitive or lower-cased `get`.
+    The request is recorded in `metrics` once its response has been sent.
+    A handler that raises is logged and answered with a 500 here, so every
+    front end reports the failure the same way. No free pooled connection or
+    a write not committed in time is overload rather than a bug, and is
+    answered with a 503.
+    """
+    timer = metrics.start(method, len(body))
+    try:
+        response = route_request(method, path, body, headers, timer)
+    except (PoolExhausted, WriteTimeout) as ex:
+        response = json_response(503, {'message': str(ex)},
+                                 [('Retry-After', str(RETRY_AFTER))])
+    except Exception:
+        print(f"error handling {method} {path}:", file=sys.stderr)
+        traceback.print_exc()
+        response = json_response(500, {'message': "internal server error"})
+    return metrics.record(timer, response)
+
+
+def route_request(method, path, body, headers, timer=None):
+    """
+    Route one request to its handler, naming its route on `timer`.
+
+    The handler runs under `profiling`, which profiles it when asked to.
+    """
+    if method == 'OPTIONS':
+        if timer is not None:
+            timer.route = '*'
+        return options()
+
+    request = Request(method, path, body, headers)
+    handler = ROUTER.resolve(request)
+
+    if handler is None:
+        allowed = ROUTER.methods(request.resource, request.shape)
+        if allowed:
+            return Response(405, b"", CORS_HEADERS + [('Allow', ', '.join(allowed))])
+        return json_response(404, {'message': f"no route for {method} {path}"})
+
+    route = route_template(request)
+    if timer is not None:
+        timer.route = route
+    return profiling.profile(method, route, request.headers,
+                             partial(respond, request, handler))
+
+
+def respond(request, handler):
+    """
+    Call the handler of a routed request. GETs are conditional and compressed.
+
+    """
+    if request.method == 'GET':
+        encoding = compression.negotiate(request.headers.get('accept-encoding'))
+        return conditional_get(request, handler, encoding)
+    return handler(request)
@@ -0,0 +1,411 @@
+"""
+Load test a kennel server and report the results as JSON.
+
+Starts request_handler.py on a free port against a scratch copy of the
+database, sends it a request mix from concurrent keep-alive clients and
+prints throughput, latency percentiles and error rates, overall and per
+route, so runs can be compared between server modes and commits:
+
+    python loadtest.py --mode threaded --concurrency 32 --duration 20
+    python loadtest.py --mode prefork --workers 4 --rate 2000 --requests 50000
+    python loadtest.py --replay traffic.jsonl --out results.json
+
+Without --replay a synthetic mix of GET, POST, PUT and DELETE over all four
+resources is sent (see --mix). Updates and deletes only touch rows the run
+created itself, so the mix never fails on missing rows or foreign keys.
+
+A replay file has one request per line, e.g.
+{"method": "POST", "path": "/animals", "body": {"name": "Rex", ...}}, and
+is sent in order, starting over when it runs out. Lines without a method
+and path are skipped and counted, so a file of other records (such as the
+backlog in requests.jsonl) replays nothing.
+
+With --rate the requests are sent on a fixed schedule, and each latency is
+measured from the moment its request was due, so a stalled server shows
+up in the percentiles instead of slowing the clients down.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+
+from benchmark import (add_animals, free_port, http_request, percentile,
+                       scratch_database, start_server)
+
+RESOURCES = ('animals', 'locations', 'employees', 'customers')
+
+DEFAULT_MIX = 'get=80,post=10,put=5,delete=5'
+
+# Rows per page for the collection GETs of the synthetic mix
+PAGE_SIZE = 50
+
+# Seconds a single request may take before it counts as an error
+REQUEST_TIMEOUT = 30
+
+# Seconds the server gets to stop before it is killed
+SHUTDOWN_TIMEOUT = 20
+
+
+def parse_mix(text):
+    """
+    Parse a mix like 'get=80,post=10' into {method: weight}.
+
+    """
+    mix = {}
+    for item in text.split(','):
+        (method, _, weight) = item.partition('=')
+        method = method.strip().upper()
+        if method not in ('GET', 'POST', 'PUT', 'DELETE'):
+            raise ValueError(f"unknown method {method} in mix")
+        try:
+            mix[method] = float(weight)
+        except ValueError as ex:
+            raise ValueError(f"weight of {method} must be a number") from ex
+    if sum(mix.values()) <= 0:
+        raise ValueError("the mix needs at least one positive weight")
+    return mix
+
+
+def route_label(method, path):
+    """
+    Group a request by its route, e.g. 'GET /animals/{id}'.
+
+    """
+    return f"{method} {re.sub(r'/[0-9]+', '/{id}', path.partition('?')[0])}"
+
+
+def read_replay(path):
+    """
+    Read the requests of a replay file, returning (requests, skipped lines).
+
+    """
+    requests = []
+    skipped = 0
+    with open(path, encoding='utf-8') as replay:
+        for line in replay:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not (isinstance(record, dict) and isinstance(record.get('method'), str)
+                    and isinstance(record.get('path'), str)):
+                skipped += 1
+                continue
+            body = record.get('body', b"")
+            if not isinstance(body, (str, bytes)):
+                body = json.dumps(body)
+            if isinstance(body, str):
+                body = body.encode()
+            requests.append((record['method'].upper(), record['path'], body))
+    return (requests, skipped)
+
+
+class SyntheticTraffic():
+    """
+    Random requests over every resource, weighted by method.
+
+    Reads pick from the ids of the scratch database and of rows created
+    during the run; PUT and DELETE pick from the created rows only, and
+    fall back to a POST until there are any. A row being updated is taken
+    out of the pool until its PUT is answered, so it cannot be deleted
+    meanwhile.
+    """
+    def __init__(self, db_path, mix, seed=None):
+        self.mix = mix
+        self.random = random.Random(seed)
+        self.serial = itertools.count(1)
+        conn = sqlite3.connect(db_path)
+        try:
+            self.ids = {resource: [row[0] for row in conn.execute(
+                f"SELECT id FROM {resource[:-1].capitalize()}")] for resource in RESOURCES}
+        finally:
+            conn.close()
+        self.created = {resource: [] for resource in RESOURCES}
+
+    def body(self, resource):
+        """
+        A complete JSON body for creating or replacing a row of `resource`.
+
+        """
+        number = next(self.serial)
+        location_id = self.random.choice(self.ids['locations'])
+        if resource == 'animals':
+            data = {'name': f"Load {number}",
+                    'breed': self.random.choice(('Poodle', 'Beagle', 'Boxer', 'Siamese')),
+                    'status': self.random.choice(('Kennel', 'Treatment', 'Recreation')),
+                    'location_id': location_id,
+                    'customer_id': self.random.choice(self.ids['customers'])}
+        elif resource == 'locations':
+            data = {'name': f"Load {number}", 'address': f"{number} Load Street"}
+        elif resource == 'employees':
+            data = {'name': f"Load {number}", 'address': f"{number} Load Street",
+                    'location_id': location_id}
+        else:
+            # Customer emails are unique
+            data = {'name': f"Load {number}", 'address': f"{number} Load Street",
+                    'email': f"load{number}.{self.random.getrandbits(32)}@example.com",
+                    'password': "load"}
+        return json.dumps(data).encode()
+
+    def next(self):
+        """
+        The (method, path, body) of the next request.
+
+        """
+        method = self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        resource = self.random.choice(RESOURCES)
+        created = self.created[resource]
+
+        if method in ('PUT', 'DELETE') and not created:
+            method = 'POST'
+        if method == 'POST':
+            return ('POST', f"/{resource}", self.body(resource))
+        if method in ('PUT', 'DELETE'):
+            id = created.pop(self.random.randrange(len(created)))
+            body = self.body(resource) if method == 'PUT' else b""
+            return (method, f"/{resource}/{id}", body)
+
+        if self.random.random() < 0.5:
+            return ('GET', f"/{resource}?limit={PAGE_SIZE}", b"")
+        id = self.random.choice(self.ids[resource] + created)
+        return ('GET', f"/{resource}/{id}", b"")
+
+    def record(self, method, path, status, body):
+        """
+        Remember the id of a row created by a POST or updated by a PUT.
+
+        """
+        if method == 'POST' and status == 201:
+            self.created[path.strip('/')].append(json.loads(body)['id'])
+        elif method == 'PUT':
+            (resource, _, id) = path.strip('/').partition('/')
+            self.created[resource].append(int(id))
+
+
+class ReplayTraffic():
+    """
+    The requests of a replay file, in order and starting over at the end.
+
+    """
+    def __init__(self, requests):
+        self.requests = itertools.cycle(requests)
+
+    def next(self):
+        """
+        The (method, path, body) of the next request.
+
+        """
+        return next(self.requests)
+
+    def record(self, method, path, status, body):
+        """
+        Replayed requests need no bookkeeping.
+
+        """
+
+
+async def run_load(port, traffic, concurrency, requests=None, duration=None, rate=None):
+    """
+    Send `traffic` from `concurrency` clients until `requests` were sent or
+    `duration` seconds have passed, at most `rate` requests/sec if given.
+
+    Returns the elapsed time and a (route, status, seconds) sample per
+    request; the status is None when the request failed outright.
+    """
+    samples = []
+    issued = itertools.count()
+    start = time.perf_counter()
+    deadline = start + duration if duration is not None else None
+
+    async def client():
+        conn = None
+        while True:
+            index = next(issued)
+            if requests is not None and index >= requests:
+                break
+            due = start + index / rate if rate else time.perf_counter()
+            if deadline is not None and due >= deadline:
+                break
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            (method, path, body) = traffic.next()
+            sent = due if rate else time.perf_counter()
+            try:
+                (status, response, conn) = await asyncio.wait_for(
+                    http_request(port, method, path, body, conn), REQUEST_TIMEOUT)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+                if conn is not None:
+                    conn[1].close()
+                (status, conn) = (None, None)
+            else:
+                traffic.record(method, path, status, response)
+            samples.append((route_label(method, path), status, time.perf_counter() - sent))
+        if conn is not None:
+            conn[1].close()
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return (time.perf_counter() - start, samples)
+
+
+def summarize(samples, elapsed=None):
+    """
+    Throughput, latency percentiles and error rate of a list of samples.
+
+    A request is an error when it failed outright or got a 4xx/5xx status.
+    """
+    latencies = sorted(seconds for (_, _, seconds) in samples)
+    errors = sum(1 for (_, status, _) in samples if status is None or status >= 400)
+    summary = {'requests': len(samples)}
+    if elapsed is not None:
+        summary['duration_s'] = round(elapsed, 3)
+        summary['throughput_rps'] = round(len(samples) / elapsed, 1) if elapsed else None
+    summary.update({
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 3),
+            'p95': round(percentile(latencies, 95) * 1000, 3),
+            'p99': round(percentile(latencies, 99) * 1000, 3),
+            'max': round(latencies[-1] * 1000, 3),
+            'mean': round(sum(latencies) / len(latencies) * 1000, 3)
+        } if latencies else None,
+        'errors': errors,
+        'error_rate': round(errors / len(samples), 4) if samples else None
+    })
+    return summary
+
+
+def git_commit():
+    """
+    The commit the working tree is at, or None outside a git checkout.
+
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    """
+    Run one load test and print its results as JSON.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mode', default='threaded',
+                        choices=('single', 'threaded', 'prefork', 'asyncio'))
+    parser.add_argument('--threads', type=int, default=16,
+                        help="server request threads per process")
+    parser.add_argument('--workers', type=int, default=2,
+                        help="server worker processes in prefork mode")
+    parser.add_argument('--server-arg', action='append', default=[],
+                        help="extra server option, e.g. --server-arg=--write-queue "
+                             "(repeatable)")
+    parser.add_argument('--db', default='./kennel.sqlite3',
+                        help="database copied to the scratch database")
+    parser.add_argument('--rows', type=int, default=0,
+                        help="synthetic animals added to the scratch database")
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help="concurrent clients, each on its own keep-alive connection")
+    parser.add_argument('--rate', type=float, default=None,
+                        help="requests/sec to send on a fixed schedule (default: "
+                             "as fast as the clients get answers)")
+    parser.add_argument('--requests', type=int, default=None,
+                        help="requests to send (default: 2000 unless --duration is given)")
+    parser.add_argument('--duration', type=float, default=None,
+                        help="seconds to send requests for")
+    parser.add_argument('--replay', default=None,
+                        help="JSONL file of requests to replay instead of the synthetic mix")
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f"method weights of the synthetic mix (default: {DEFAULT_MIX})")
+    parser.add_argument('--seed', type=int, default=None,
+                        help="random seed of the synthetic mix")
+    parser.add_argument('--out', default=None,
+                        help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.rate is not None and args.rate <= 0:
+        parser.error("--rate must be positive")
+    if args.requests is None and args.duration is None:
+        args.requests = 2000
+
+    path = scratch_database(args.db)
+    if args.rows:
+        add_animals(path, args.rows)
+
+    skipped = None
+    if args.replay is not None:
+        (replayed, skipped) = read_replay(args.replay)
+        if not replayed:
+            print(f"{args.replay} has no requests to replay ({skipped} lines without "
+                  f"a method and path)", file=sys.stderr)
+            return 1
+        traffic = ReplayTraffic(replayed)
+    else:
+        try:
+            traffic = SyntheticTraffic(path, parse_mix(args.mix), args.seed)
+        except ValueError as ex:
+            parser.error(str(ex))
+
+    port = free_port()
+    server = start_server(args.mode, port, path, '--threads', str(args.threads),
+                          '--workers', str(args.workers), *args.server_arg)
+    try:
+        (elapsed, samples) = asyncio.run(run_load(port, traffic, args.concurrency,
+                                                  args.requests, args.duration, args.rate))
+    finally:
+        server.terminate()
+        try:
+            server.wait(SHUTDOWN_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            # Kill the server's whole process group, prefork workers included
+            os.killpg(server.pid, signal.SIGKILL)
+            server.wait()
+
+    statuses = {}
+    routes = {}
+    for sample in samples:
+        (route, status, _) = sample
+        key = 'failed' if status is None else str(status)
+        statuses[key] = statuses.get(key, 0) + 1
+        routes.setdefault(route, []).append(sample)
+
+    results = {
+        'commit': git_commit(),
+        'server': {'mode': args.mode, 'threads': args.threads, 'workers': args.workers,
+                   'options': args.server_arg},
+        'traffic': args.replay or f"synthetic {args.mix}",
+        'concurrency': args.concurrency,
+        'rate': args.rate,
+        **summarize(samples, elapsed),
+        'statuses': dict(sorted(statuses.items())),
+        'routes': {route: summarize(route_samples)
+                   for (route, route_samples) in sorted(routes.items())}
+    }
+    if skipped is not None:
+        results['skipped_lines'] = skipped
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.out is not None:
+        with open(args.out, 'w', encoding='utf-8') as out:
+            out.write(output + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
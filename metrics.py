@@ -0,0 +1,344 @@
+"""
+Request metrics served at GET /metrics in the Prometheus text format.
+
+    kennel_requests_total{method,route,status}       requests answered
+    kennel_request_bytes_total{method,route}         request body bytes
+    kennel_response_bytes_total{method,route}        response body bytes sent
+    kennel_request_duration_seconds{method,route}    histogram, whole request
+    kennel_db_duration_seconds{method,route}         histogram, time in sqlite
+    kennel_serialize_duration_seconds{method,route}  histogram, JSON encoding
+
+Alongside them, dispatch exports the counters of the entity cache, the
+connection pools, the write queue and the JSON fragment caches as
+kennel_cache_*, kennel_pool_*, kennel_write_queue_* and kennel_fragments_*.
+
+`route` is the matched route template (e.g. /animals/{id}), never the raw
+path, so ids and typos cannot grow the number of series. A streamed body
+is measured until it has been sent, and its bytes are counted after
+compression, as they went out.
+
+Recording never takes a lock: every thread writes to its own shard and a
+scrape adds the shards up. Metrics are per process, so in prefork mode
+each scrape is answered by, and reports, a single worker.
+"""
+import bisect
+import os
+import threading
+import time
+
+ENABLED = os.environ.get("KENNEL_METRICS", "1") != "0"
+
+# Upper bounds in seconds of the duration histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HISTOGRAMS = (
+    ('kennel_request_duration_seconds', "Time from dispatch until the response was sent."),
+    ('kennel_db_duration_seconds', "Time spent executing statements and fetching rows."),
+    ('kennel_serialize_duration_seconds', "Time spent encoding JSON bodies.")
+)
+
+clock = time.perf_counter
+
+
+def configure(enabled=None):
+    """
+    Turn recording on or off.
+
+    """
+    global ENABLED
+    if enabled is not None:
+        ENABLED = enabled
+
+
+class RequestTimer():
+    """
+    The timings of one request, filled in while it is handled.
+
+    `route` is set once the request has been routed. `db` and
+    `serialize` accumulate seconds from every thread the request runs on.
+    """
+    __slots__ = ('method', 'route', 'received', 'start', 'db', 'serialize')
+
+    def __init__(self, method, received=0):
+        self.method = method
+        self.route = 'unmatched'
+        self.received = received
+        self.start = clock()
+        self.db = 0.0
+        self.serialize = 0.0
+
+
+class Series():
+    """
+    The counters of one (method, route) in one shard.
+
+    `durations` holds one list per histogram: a count per bucket (the last
+    one for values above every bound), then the sum of the observations.
+    """
+    __slots__ = ('statuses', 'received', 'sent', 'durations')
+
+    def __init__(self):
+        self.statuses = {}
+        self.received = 0
+        self.sent = 0
+        self.durations = tuple([0] * (len(BUCKETS) + 1) + [0.0] for _ in HISTOGRAMS)
+
+
+class Shard():
+    """
+    The series recorded by one thread, written only by that thread.
+
+    """
+    __slots__ = ('series',)
+
+    def __init__(self):
+        self.series = {}
+
+
+_local = threading.local()
+_shards = []
+_shards_lock = threading.Lock()
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = Shard()
+        with _shards_lock:
+            _shards.append(shard)
+        return shard
+
+
+def start(method, received=0):
+    """
+    Start timing a request on this thread, returning its RequestTimer.
+
+    Returns None when metrics are disabled.
+    """
+    if not ENABLED:
+        return None
+    timer = _local.timer = RequestTimer(method, received)
+    return timer
+
+
+def current():
+    """
+    The RequestTimer of the request running on this thread, if any.
+
+    """
+    return getattr(_local, 'timer', None)
+
+
+def activate(timer):
+    """
+    Attribute this thread's work to `timer`, returning the previous timer.
+
+    Streamed chunks may be produced on another thread than the one that
+    routed the request, so each chunk activates its request's timer.
+    """
+    previous = getattr(_local, 'timer', None)
+    _local.timer = timer
+    return previous
+
+
+def add_db(seconds):
+    """
+    Count `seconds` of sqlite work towards the current request.
+
+    """
+    timer = getattr(_local, 'timer', None)
+    if timer is not None:
+        timer.db += seconds
+
+
+def add_serialize(seconds):
+    """
+    Count `seconds` of JSON encoding towards the current request.
+
+    """
+    timer = getattr(_local, 'timer', None)
+    if timer is not None:
+        timer.serialize += seconds
+
+
+def finish(timer, status, sent):
+    """
+    Record a finished request: its status, byte counts and durations.
+
+    """
+    elapsed = clock() - timer.start
+    series_by_key = _shard().series
+    key = (timer.method, timer.route)
+    series = series_by_key.get(key)
+    if series is None:
+        series = series_by_key[key] = Series()
+
+    series.statuses[status] = series.statuses.get(status, 0) + 1
+    series.received += timer.received
+    series.sent += sent
+    for (counts, value) in zip(series.durations, (elapsed, timer.db, timer.serialize)):
+        counts[bisect.bisect_left(BUCKETS, value)] += 1
+        counts[-1] += value
+
+
+class MeteredStream():
+    """
+    A streamed body that counts the bytes it yields and records its
+    request when closed.
+
+    """
+    def __init__(self, chunks, timer, status):
+        self.chunks = chunks
+        self.timer = timer
+        self.status = status
+        self.sent = 0
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        previous = activate(self.timer)
+        try:
+            chunk = next(self.chunks)
+        finally:
+            activate(previous)
+        self.sent += len(chunk)
+        return chunk
+
+    def close(self):
+        """
+        Close the source stream and record the request, once.
+
+        """
+        previous = activate(self.timer)
+        try:
+            close = getattr(self.chunks, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            activate(previous)
+            if not self._closed:
+                self._closed = True
+                finish(self.timer, self.status, self.sent)
+
+
+def record(timer, response):
+    """
+    Record `response` for `timer`, now or once its streamed body is closed.
+
+    Returns the response, whose body is wrapped when it is streamed.
+    """
+    if timer is None:
+        return response
+    if current() is timer:
+        # A streamed body activates the timer for every chunk it produces
+        activate(None)
+    if response.streaming:
+        response.body = MeteredStream(response.body, timer, response.status)
+    else:
+        finish(timer, response.status, len(response.body))
+    return response
+
+
+def _labels(method, route, **extra):
+    labels = {'method': method, 'route': route, **extra}
+    return ",".join(f'{name}="{value}"' for (name, value) in labels.items())
+
+
+def collect():
+    """
+    Sum the series of every shard into {(method, route): Series}.
+
+    """
+    with _shards_lock:
+        shards = list(_shards)
+
+    totals = {}
+    for shard in shards:
+        # A copy, since the owning thread may add a series meanwhile
+        for (key, series) in shard.series.copy().items():
+            total = totals.get(key)
+            if total is None:
+                total = totals[key] = Series()
+            for (status, count) in series.statuses.copy().items():
+                total.statuses[status] = total.statuses.get(status, 0) + count
+            total.received += series.received
+            total.sent += series.sent
+            for (counts, added) in zip(total.durations, series.durations):
+                for (index, value) in enumerate(added):
+                    counts[index] += value
+    return totals
+
+
+def render():
+    """
+    The current metrics in the Prometheus text exposition format, as bytes.
+
+    """
+    totals = sorted(collect().items())
+    lines = ["# HELP kennel_requests_total Requests answered.",
+             "# TYPE kennel_requests_total counter"]
+    for ((method, route), series) in totals:
+        for (status, count) in sorted(series.statuses.items()):
+            lines.append(f"kennel_requests_total{{{_labels(method, route, status=status)}}} "
+                         f"{count}")
+
+    for (name, attribute, help_text) in (
+            ('kennel_request_bytes_total', 'received', "Request body bytes received."),
+            ('kennel_response_bytes_total', 'sent', "Response body bytes sent.")):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for ((method, route), series) in totals:
+            lines.append(f"{name}{{{_labels(method, route)}}} {getattr(series, attribute)}")
+
+    for (index, (name, help_text)) in enumerate(HISTOGRAMS):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for ((method, route), series) in totals:
+            counts = series.durations[index]
+            cumulative = 0
+            for (bound, count) in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{{{_labels(method, route, le=bound)}}} "
+                             f"{cumulative}")
+            lines.append(f"{name}_sum{{{_labels(method, route)}}} {counts[-1]:.6f}")
+            lines.append(f"{name}_count{{{_labels(method, route)}}} {cumulative}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def render_stats(families):
+    """
+    Component counters in the Prometheus text exposition format, as bytes.
+
+    `families` is a sequence of (name, type, help, samples) where samples
+    is a list of (labels, value) and labels a dict, possibly empty.
+    """
+    lines = []
+    for (name, kind, help_text, samples) in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for (labels, value) in samples:
+            if labels:
+                pairs = ",".join(f'{label}="{text}"' for (label, text) in labels.items())
+                lines.append(f"{name}{{{pairs}}} {value}")
+            else:
+                lines.append(f"{name} {value}")
+    return ("\n".join(lines) + "\n").encode() if lines else b""
+
+
+def _reset_after_fork():
+    # A forked worker starts with empty metrics of its own; the parent's
+    # shards belong to threads that do not exist in the child.
+    global _shards_lock
+    _shards.clear()
+    _shards_lock = threading.Lock()
+    _local.__dict__.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
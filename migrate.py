@@ -0,0 +1,248 @@
+"""
+Versioned schema migrations for kennel.sqlite3.
+
+Each file in migrations/ is named NNNN_description.sql and is applied once,
+in order, inside its own transaction. The number of the last applied
+migration is stored in the database's `PRAGMA user_version`.
+
+    python migrate.py              apply pending migrations
+    python migrate.py --check      also verify the hot queries use their
+                                   indexes and the summary tables are up
+                                   to date
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+
+from views import database
+from views.animal_requests import FILTERS as ANIMAL_FILTERS
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def animal_filter_check(description, query, index, after=None):
+    """
+    A PLAN_CHECKS entry for the SQL that GET /animals compiles `query` to.
+
+    """
+    (sql, _) = ANIMAL_FILTERS.clause(ANIMAL_FILTERS.parse(query), after, 100)
+    return (description, "SELECT a.id FROM Animal a" + sql, "a", index)
+
+
+# (description, query, table alias that must not be scanned, index the
+# plan must use). Paging by id is left out of the filter checks: with a
+# rowid bound sqlite can plan a primary key search even without the index.
+PLAN_CHECKS = [
+    ("customers by email",
+     "SELECT c.id FROM Customer c WHERE c.email = ?", "c", "idx_customer_email"),
+    ("animals at a location",
+     "SELECT a.id FROM Animal a WHERE a.location_id = ?", "a", "idx_animal_location_id"),
+    ("animals of a customer",
+     "SELECT a.id FROM Animal a WHERE a.customer_id = ?", "a", "idx_animal_customer_id"),
+    ("employees at a location",
+     "SELECT e.id FROM Employee e WHERE e.location_id = ?", "e", "idx_employee_location_id"),
+    ("location with its animals",
+     "SELECT l.id, a.id FROM Location l JOIN Animal a ON a.location_id = l.id WHERE l.id = ?",
+     "a", "idx_animal_location_id"),
+    ("customer with their animals",
+     "SELECT c.id, a.id FROM Customer c JOIN Animal a ON a.customer_id = c.id WHERE c.id = ?",
+     "a", "idx_animal_customer_id"),
+    animal_filter_check("animals by status", {'status': ['Kennel']}, "idx_animal_status"),
+    animal_filter_check("animals by any of several statuses",
+                        {'status': ['Kennel,Treatment']}, "idx_animal_status"),
+    animal_filter_check("animals by breed", {'breed': ['Beagle']}, "idx_animal_breed"),
+    animal_filter_check("animals at a location by status",
+                        {'location_id': ['1'], 'status': ['Kennel']},
+                        "idx_animal_location_status"),
+    animal_filter_check("animals in a range of locations",
+                        {'location_id_gte': ['1'], 'location_id_lte': ['2']},
+                        "idx_animal_location_id"),
+    animal_filter_check("animals sorted by name", {'_sort': ['name']}, "idx_animal_name",
+                        after=1),
+    animal_filter_check("animals by status sorted by name",
+                        {'status': ['Kennel'], '_sort': ['name'], '_order': ['desc']},
+                        "idx_animal_status_name", after=1),
+]
+
+# (description, summary table query, the same rows computed from scratch)
+SUMMARY_CHECKS = [
+    ("LocationStats",
+     "SELECT location_id, status, animals FROM LocationStats",
+     "SELECT location_id, status, COUNT(*) FROM Animal "
+     "WHERE location_id IS NOT NULL GROUP BY location_id, status"),
+]
+
+# FTS5 indexes that must match their external content tables
+SEARCH_INDEXES = ('AnimalSearch', 'CustomerSearch', 'EmployeeSearch')
+
+
+class MigrationError(Exception):
+    """
+    Raised when a migration file cannot be applied.
+
+    """
+
+
+def available_migrations(directory=MIGRATIONS_DIR):
+    """
+    Return (version, name, path) for every migration file, in order.
+
+    """
+    migrations = []
+    for name in sorted(os.listdir(directory)):
+        match = re.match(r"^(\d+)_.+\.sql$", name)
+        if match:
+            migrations.append((int(match.group(1)), name, os.path.join(directory, name)))
+    return migrations
+
+
+def current_version(conn):
+    """
+    Return the number of the last migration applied to the database.
+
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(path=None, directory=MIGRATIONS_DIR, verbose=False):
+    """
+    Apply every pending migration to the database at `path`.
+
+    Returns the list of migration file names that were applied.
+    """
+    path = path or database.POOL.path
+    applied = []
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        version = current_version(conn)
+        for (number, name, filename) in available_migrations(directory):
+            if number <= version:
+                continue
+            with open(filename, encoding="utf-8") as sql_file:
+                script = sql_file.read()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for statement in split_statements(script):
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+                conn.execute("COMMIT")
+            except sqlite3.Error as ex:
+                conn.execute("ROLLBACK")
+                raise MigrationError(f"{name}: {ex}") from ex
+            applied.append(name)
+            if verbose:
+                print(f"applied {name}")
+    finally:
+        conn.close()
+    return applied
+
+
+def split_statements(script):
+    """
+    Split a SQL script into complete statements.
+
+    executescript() would commit the surrounding transaction, so each
+    statement is executed on its own instead.
+    """
+    statements = []
+    current = ""
+    for line in script.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            if current.strip():
+                statements.append(current.strip())
+            current = ""
+    if current.strip() and not current.strip().startswith("--"):
+        statements.append(current.strip())
+    return statements
+
+
+def query_plan(conn, sql):
+    """
+    Return the detail lines of EXPLAIN QUERY PLAN for `sql`.
+
+    """
+    params = (None,) * sql.count("?")
+    return [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def check_query_plans(path=None, checks=None):
+    """
+    Return a list of problems for hot queries that fall back to a table scan
+    or do not use the index meant for them.
+
+    """
+    path = path or database.POOL.path
+    problems = []
+    conn = sqlite3.connect(path)
+    try:
+        for (description, sql, alias, index) in checks or PLAN_CHECKS:
+            plan = query_plan(conn, sql)
+            scans = [line for line in plan
+                     if line.startswith("SCAN") and re.search(rf"\b{alias}\b", line)
+                     and "USING" not in line]
+            if scans:
+                problems.append(f"table scan in {description}: {'; '.join(plan)}")
+            elif not any(re.search(rf"USING (COVERING )?INDEX {index}\b", line)
+                         for line in plan):
+                problems.append(f"{description} does not use {index}: {'; '.join(plan)}")
+    finally:
+        conn.close()
+    return problems
+
+
+def check_summaries(path=None, checks=None):
+    """
+    Return a list of problems for trigger-maintained tables that have drifted.
+
+    """
+    path = path or database.POOL.path
+    problems = []
+    conn = sqlite3.connect(path)
+    try:
+        for (description, summary_sql, source_sql) in checks or SUMMARY_CHECKS:
+            summary = set(conn.execute(summary_sql))
+            source = set(conn.execute(source_sql))
+            if summary != source:
+                problems.append(f"{description}: {len(summary ^ source)} rows differ "
+                                f"from the table they summarize")
+        for index in SEARCH_INDEXES:
+            try:
+                # rank 1 also compares the index against the content table
+                conn.execute(f"INSERT INTO {index} ({index}, rank) VALUES ('integrity-check', 1)")
+            except sqlite3.Error as ex:
+                problems.append(f"{index}: {ex}")
+    finally:
+        conn.close()
+    return problems
+
+
+def main(argv=None):
+    """
+    Apply migrations from the command line.
+
+    """
+    parser = argparse.ArgumentParser(description="Apply kennel schema migrations.")
+    parser.add_argument('--db-path', default=database.POOL.path)
+    parser.add_argument('--check', action='store_true',
+                        help="fail if a hot query plan does not use its index "
+                             "or a summary table has drifted")
+    args = parser.parse_args(argv)
+
+    applied = migrate(args.db_path, verbose=True)
+    if not applied:
+        print("database is up to date")
+
+    if args.check:
+        problems = check_query_plans(args.db_path)
+        problems += [f"stale summary {problem}" for problem in check_summaries(args.db_path)]
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        return 1 if problems else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
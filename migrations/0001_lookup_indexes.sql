@@ -0,0 +1,4 @@
+-- Secondary indexes for the foreign key lookups and joins
+CREATE INDEX IF NOT EXISTS `idx_animal_location_id` ON `Animal` (`location_id`);
+CREATE INDEX IF NOT EXISTS `idx_animal_customer_id` ON `Animal` (`customer_id`);
+CREATE INDEX IF NOT EXISTS `idx_employee_location_id` ON `Employee` (`location_id`);
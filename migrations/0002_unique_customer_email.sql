@@ -0,0 +1,2 @@
+-- get_customers_by_email looks customers up by email, which must be unique
+CREATE UNIQUE INDEX IF NOT EXISTS `idx_customer_email` ON `Customer` (`email`);
@@ -0,0 +1,10 @@
+-- Indexes behind the ?status=, ?breed= and ?_sort= animal filters.
+-- SQLite appends the rowid to every index entry, so (status) serves
+-- ?status=X paged by id, and (status, name) serves ?status=X&_sort=name
+-- including the (name, id) keyset seek.
+CREATE INDEX IF NOT EXISTS `idx_animal_status` ON `Animal` (`status`);
+CREATE INDEX IF NOT EXISTS `idx_animal_status_name` ON `Animal` (`status`, `name`);
+CREATE INDEX IF NOT EXISTS `idx_animal_breed` ON `Animal` (`breed`);
+CREATE INDEX IF NOT EXISTS `idx_animal_name` ON `Animal` (`name`);
+-- The animals at a location with a given status, e.g. every dog in a kennel
+CREATE INDEX IF NOT EXISTS `idx_animal_location_status` ON `Animal` (`location_id`, `status`);
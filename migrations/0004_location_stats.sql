@@ -0,0 +1,48 @@
+-- Animals per location and status, kept current by triggers on Animal so
+-- /locations/stats reads one row per (location, status) instead of
+-- counting every animal.
+CREATE TABLE IF NOT EXISTS `LocationStats` (
+	`location_id`	INTEGER NOT NULL,
+	`status`	TEXT NOT NULL,
+	`animals`	INTEGER NOT NULL,
+	PRIMARY KEY (`location_id`, `status`)
+) WITHOUT ROWID;
+
+DELETE FROM `LocationStats`;
+
+INSERT INTO `LocationStats` (`location_id`, `status`, `animals`)
+SELECT `location_id`, `status`, COUNT(*)
+FROM `Animal`
+WHERE `location_id` IS NOT NULL
+GROUP BY `location_id`, `status`;
+
+CREATE TRIGGER IF NOT EXISTS `animal_stats_insert` AFTER INSERT ON `Animal`
+WHEN NEW.`location_id` IS NOT NULL
+BEGIN
+	INSERT INTO `LocationStats` (`location_id`, `status`, `animals`)
+	VALUES (NEW.`location_id`, NEW.`status`, 1)
+	ON CONFLICT (`location_id`, `status`) DO UPDATE SET `animals` = `animals` + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS `animal_stats_delete` AFTER DELETE ON `Animal`
+WHEN OLD.`location_id` IS NOT NULL
+BEGIN
+	UPDATE `LocationStats` SET `animals` = `animals` - 1
+	WHERE `location_id` = OLD.`location_id` AND `status` = OLD.`status`;
+	DELETE FROM `LocationStats`
+	WHERE `location_id` = OLD.`location_id` AND `status` = OLD.`status` AND `animals` <= 0;
+END;
+
+-- Only a change of location or status moves an animal between counters
+CREATE TRIGGER IF NOT EXISTS `animal_stats_update` AFTER UPDATE OF `location_id`, `status` ON `Animal`
+WHEN OLD.`location_id` IS NOT NEW.`location_id` OR OLD.`status` IS NOT NEW.`status`
+BEGIN
+	UPDATE `LocationStats` SET `animals` = `animals` - 1
+	WHERE `location_id` = OLD.`location_id` AND `status` = OLD.`status`;
+	DELETE FROM `LocationStats`
+	WHERE `location_id` = OLD.`location_id` AND `status` = OLD.`status` AND `animals` <= 0;
+	INSERT INTO `LocationStats` (`location_id`, `status`, `animals`)
+	SELECT NEW.`location_id`, NEW.`status`, 1
+	WHERE NEW.`location_id` IS NOT NULL
+	ON CONFLICT (`location_id`, `status`) DO UPDATE SET `animals` = `animals` + 1;
+END;
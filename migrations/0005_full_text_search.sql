@@ -0,0 +1,76 @@
+-- Full-text indexes for /search and ?q=. Each is an external-content FTS5
+-- table over its source table, so the text is stored once and the index
+-- holds only the tokens; the prefix indexes answer "sn"* style partial
+-- words without scanning the vocabulary. Triggers keep them in sync.
+CREATE VIRTUAL TABLE IF NOT EXISTS `AnimalSearch` USING fts5(
+	`name`, `breed`, content='Animal', content_rowid='id', prefix='2 3'
+);
+INSERT INTO `AnimalSearch` (`AnimalSearch`) VALUES ('rebuild');
+
+CREATE TRIGGER IF NOT EXISTS `animal_search_insert` AFTER INSERT ON `Animal`
+BEGIN
+	INSERT INTO `AnimalSearch` (`rowid`, `name`, `breed`)
+	VALUES (NEW.`id`, NEW.`name`, NEW.`breed`);
+END;
+
+CREATE TRIGGER IF NOT EXISTS `animal_search_delete` AFTER DELETE ON `Animal`
+BEGIN
+	INSERT INTO `AnimalSearch` (`AnimalSearch`, `rowid`, `name`, `breed`)
+	VALUES ('delete', OLD.`id`, OLD.`name`, OLD.`breed`);
+END;
+
+CREATE TRIGGER IF NOT EXISTS `animal_search_update` AFTER UPDATE OF `name`, `breed` ON `Animal`
+BEGIN
+	INSERT INTO `AnimalSearch` (`AnimalSearch`, `rowid`, `name`, `breed`)
+	VALUES ('delete', OLD.`id`, OLD.`name`, OLD.`breed`);
+	INSERT INTO `AnimalSearch` (`rowid`, `name`, `breed`)
+	VALUES (NEW.`id`, NEW.`name`, NEW.`breed`);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS `CustomerSearch` USING fts5(
+	`name`, `address`, content='Customer', content_rowid='id', prefix='2 3'
+);
+INSERT INTO `CustomerSearch` (`CustomerSearch`) VALUES ('rebuild');
+
+CREATE TRIGGER IF NOT EXISTS `customer_search_insert` AFTER INSERT ON `Customer`
+BEGIN
+	INSERT INTO `CustomerSearch` (`rowid`, `name`, `address`)
+	VALUES (NEW.`id`, NEW.`name`, NEW.`address`);
+END;
+
+CREATE TRIGGER IF NOT EXISTS `customer_search_delete` AFTER DELETE ON `Customer`
+BEGIN
+	INSERT INTO `CustomerSearch` (`CustomerSearch`, `rowid`, `name`, `address`)
+	VALUES ('delete', OLD.`id`, OLD.`name`, OLD.`address`);
+END;
+
+CREATE TRIGGER IF NOT EXISTS `customer_search_update` AFTER UPDATE OF `name`, `address` ON `Customer`
+BEGIN
+	INSERT INTO `CustomerSearch` (`CustomerSearch`, `rowid`, `name`, `address`)
+	VALUES ('delete', OLD.`id`, OLD.`name`, OLD.`address`);
+	INSERT INTO `CustomerSearch` (`rowid`, `name`, `address`)
+	VALUES (NEW.`id`, NEW.`name`, NEW.`address`);
+END;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS `EmployeeSearch` USING fts5(
+	`name`, content='Employee', content_rowid='id', prefix='2 3'
+);
+INSERT INTO `EmployeeSearch` (`EmployeeSearch`) VALUES ('rebuild');
+
+CREATE TRIGGER IF NOT EXISTS `employee_search_insert` AFTER INSERT ON `Employee`
+BEGIN
+	INSERT INTO `EmployeeSearch` (`rowid`, `name`) VALUES (NEW.`id`, NEW.`name`);
+END;
+
+CREATE TRIGGER IF NOT EXISTS `employee_search_delete` AFTER DELETE ON `Employee`
+BEGIN
+	INSERT INTO `EmployeeSearch` (`EmployeeSearch`, `rowid`, `name`)
+	VALUES ('delete', OLD.`id`, OLD.`name`);
+END;
+
+CREATE TRIGGER IF NOT EXISTS `employee_search_update` AFTER UPDATE OF `name` ON `Employee`
+BEGIN
+	INSERT INTO `EmployeeSearch` (`EmployeeSearch`, `rowid`, `name`)
+	VALUES ('delete', OLD.`id`, OLD.`name`);
+	INSERT INTO `EmployeeSearch` (`rowid`, `name`) VALUES (NEW.`id`, NEW.`name`);
+END;
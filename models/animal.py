@@ -1,7 +1,22 @@
+import serializer
+from serializer import dumps
+from .customer import Customer
+from .location import Location
+
+_new = object.__new__
+
+
 class Animal():
     """
     new Animal class
     """
+    __slots__ = ('id', 'name', 'breed', 'status', 'location_id', 'customer_id',
+                 'location', 'customer')
+
+    # The keys of the JSON representation, which clients may select with ?fields=
+    fields = ('id', 'name', 'breed', 'status', 'location_id', 'customer_id',
+              'location', 'customer')
+
     def __init__(self, id, name, breed, status, location_id, customer_id, customer=None):
         self.id = id
         self.name = name
@@ -10,4 +25,76 @@ class Animal():
         self.location_id = location_id
         self.customer_id = customer_id
         self.location = None
-        self.customer = customer
\ No newline at end of file
+        self.customer = customer
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        """
+        Row factory for (id, name, breed, status, location_id, customer_id,
+        location name, location address, customer name, customer email) tuples.
+
+        Runs once per row of every animal query, so the instances are filled
+        in directly instead of going through three __init__ calls. The
+        location and customer are LEFT JOINed, and None when there is none.
+        """
+        animal = _new(cls)
+        (animal.id, animal.name, animal.breed, animal.status,
+         animal.location_id, animal.customer_id) = row[:6]
+
+        if row[6] is None:
+            animal.location = None
+        else:
+            location = animal.location = _new(Location)
+            (location.id, location.name, location.address) = (row[4], row[6], row[7])
+
+        if row[8] is None:
+            animal.customer = None
+        else:
+            customer = animal.customer = _new(Customer)
+            (customer.id, customer.name, customer.address, customer.email,
+             customer.password) = (row[5], row[8], None, row[9], None)
+        return animal
+
+    def to_dict(self):
+        """
+        The animal as a dictionary ready to be encoded as JSON, embedding
+        the name and address of its location and the name and email of
+        its customer.
+        """
+        location = self.location
+        customer = self.customer
+        return {
+            'id': self.id,
+            'name': self.name,
+            'breed': self.breed,
+            'status': self.status,
+            'location_id': self.location_id,
+            'customer_id': self.customer_id,
+            'location': (None if location is None else
+                         {'name': location.name, 'address': location.address}),
+            'customer': (None if customer is None else
+                         {'name': customer.name, 'email': customer.email})
+        }
+
+    def to_json(self):
+        """
+        The animal encoded as JSON bytes, splicing in the cached encodings
+        of its location and customer when serializer.FRAGMENTS is on.
+        """
+        if not serializer.FRAGMENTS:
+            return dumps(self.to_dict())
+
+        location = self.location
+        customer = self.customer
+        head = dumps({
+            'id': self.id,
+            'name': self.name,
+            'breed': self.breed,
+            'status': self.status,
+            'location_id': self.location_id,
+            'customer_id': self.customer_id
+        })
+        return b"".join((head[:-1],
+                         b',"location":', b"null" if location is None else location.embed_json(),
+                         b',"customer":', b"null" if customer is None else customer.embed_json(),
+                         b"}"))
@@ -1,11 +1,52 @@
+from serializer import dumps, Fragments
+
+
 class Customer():
     '''
     new Customer class
     '''
+    __slots__ = ('id', 'name', 'address', 'email', 'password')
+
+    # The keys of the JSON representation, which clients may select with ?fields=
+    fields = ('id', 'name', 'address', 'email', 'password')
+
+    # Encoded {"name", "email"} objects embedded in animals
+    embedded = Fragments(('name', 'email'))
+
     def __init__(self, id, name, address, email = "", password = ""):
         self.id = id
         self.name = name
         self.address = address
         self.email = email
         self.password = password
-        
\ No newline at end of file
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        '''
+        Row factory for (id, name, address, email, password) tuples.
+        '''
+        return cls(row[0], row[1], row[2], row[3], row[4])
+
+    def to_dict(self):
+        '''
+        The customer as a dictionary ready to be encoded as JSON.
+        '''
+        return {
+            'id': self.id,
+            'name': self.name,
+            'address': self.address,
+            'email': self.email,
+            'password': self.password
+        }
+
+    def to_json(self):
+        '''
+        The customer encoded as JSON bytes.
+        '''
+        return dumps(self.to_dict())
+
+    def embed_json(self):
+        '''
+        The name and email embedded in animal rows, as cached JSON bytes.
+        '''
+        return self.embedded.encode(self.name, self.email)
@@ -1,9 +1,63 @@
+import serializer
+from serializer import dumps
+from .location import Location
+
+_new = object.__new__
+
+
 class Employee():
     '''
     new Employee class
     '''
+    __slots__ = ('id', 'name', 'location')
+
+    # The keys of the JSON representation, which clients may select with ?fields=
+    fields = ('id', 'name', 'location')
+
     def __init__(self, id, name, location=None):
         self.id = id
         self.name = name
         self.location = location
-        
\ No newline at end of file
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        '''
+        Row factory for (id, name, location id, location name, location address) tuples.
+
+        The location is LEFT JOINed, and None when there is none.
+        '''
+        if row[3] is None:
+            location = None
+        else:
+            location = _new(Location)
+            (location.id, location.name, location.address) = row[2:]
+        employee = _new(cls)
+        (employee.id, employee.name, employee.location) = (row[0], row[1], location)
+        return employee
+
+    def to_dict(self):
+        '''
+        The employee as a dictionary ready to be encoded as JSON, embedding
+        the name and address of its location.
+        '''
+        location = self.location
+        return {
+            'id': self.id,
+            'name': self.name,
+            'location': (None if location is None else
+                         {'name': location.name, 'address': location.address})
+        }
+
+    def to_json(self):
+        '''
+        The employee encoded as JSON bytes, splicing in the cached encoding
+        of its location when serializer.FRAGMENTS is on.
+        '''
+        if not serializer.FRAGMENTS:
+            return dumps(self.to_dict())
+
+        location = self.location
+        head = dumps({'id': self.id, 'name': self.name})
+        return b"".join((head[:-1],
+                         b',"location":', b"null" if location is None else location.embed_json(),
+                         b"}"))
@@ -1,9 +1,48 @@
+from serializer import dumps, Fragments
+
+
 class Location():
     '''
     new Location class
     '''
+    __slots__ = ('id', 'name', 'address')
+
+    # The keys of the JSON representation, which clients may select with ?fields=
+    fields = ('id', 'name', 'address')
+
+    # Encoded {"name", "address"} objects embedded in animals and employees
+    embedded = Fragments(('name', 'address'))
+
     def __init__(self, id, name, address):
         self.id = id
         self.name = name
         self.address = address
-        
\ No newline at end of file
+
+    @classmethod
+    def from_row(cls, cursor, row):
+        '''
+        Row factory for (id, name, address) tuples.
+        '''
+        return cls(row[0], row[1], row[2])
+
+    def to_dict(self):
+        '''
+        The location as a dictionary ready to be encoded as JSON.
+        '''
+        return {
+            'id': self.id,
+            'name': self.name,
+            'address': self.address
+        }
+
+    def to_json(self):
+        '''
+        The location encoded as JSON bytes.
+        '''
+        return dumps(self.to_dict())
+
+    def embed_json(self):
+        '''
+        The name and address embedded in other rows, as cached JSON bytes.
+        '''
+        return self.embedded.encode(self.name, self.address)
@@ -0,0 +1,280 @@
+"""
+On-demand cProfile profiling of live requests.
+
+Profiling is off until an admin asks for it, with the KENNEL_ADMIN_TOKEN
+in an X-Admin-Token header:
+
+    POST /profile {"requests": 50}                    the next 50 requests
+    POST /profile {"requests": 50, "sample": 0.1,     every tenth request of
+                   "route": "/animals/{id}"}          one route, 50 at most
+    GET /profile                                      the current session
+    DELETE /profile                                   stop profiling
+
+or for a single request, by sending it with `X-Profile: 1` as well as the
+token. Each profiled request is written to PROFILE_DIR as a .pstats file
+in a directory per route, e.g. profiles/GET_animals_id/. Without an admin
+token profiling cannot be turned on at all.
+
+The session lives in shared memory created before any prefork worker is
+started, so a session started through one worker profiles requests on all
+of them. Run `python profiling.py` to rank the hottest functions per route.
+"""
+import argparse
+import cProfile
+import hmac
+import itertools
+import multiprocessing
+import os
+import pstats
+import random
+import sys
+import time
+
+ADMIN_TOKEN = os.environ.get("KENNEL_ADMIN_TOKEN") or None
+PROFILE_DIR = os.environ.get("KENNEL_PROFILE_DIR", "./profiles")
+
+# Longest route filter a session can hold, in bytes
+MAX_ROUTE = 256
+
+# Requests still to be profiled (0 when no session is running), the share
+# of requests sampled and the route filter ('' for every route)
+_REMAINING = multiprocessing.RawValue('q', 0)
+_SAMPLE = multiprocessing.RawValue('d', 1.0)
+_ROUTE = multiprocessing.RawArray('c', MAX_ROUTE)
+_LOCK = multiprocessing.Lock()
+
+_sequence = itertools.count()
+
+
+def configure(directory=None, admin_token=None):
+    """
+    Set the directory profiles are written to and the admin token.
+
+    """
+    global PROFILE_DIR, ADMIN_TOKEN
+    if directory is not None:
+        PROFILE_DIR = directory
+    if admin_token is not None:
+        ADMIN_TOKEN = admin_token or None
+
+
+def authorized(headers):
+    """
+    True when `headers` carry the admin token.
+
+    """
+    given = headers.get('x-admin-token')
+    if ADMIN_TOKEN is None or given is None:
+        return False
+    return hmac.compare_digest(given.encode(), ADMIN_TOKEN.encode())
+
+
+def start_session(requests, sample=1.0, route=None):
+    """
+    Profile the next `requests` requests, of `route` only if given.
+
+    Each candidate request is profiled with probability `sample`. Raises
+    ValueError for out-of-range arguments.
+    """
+    if not isinstance(requests, int) or requests < 1:
+        raise ValueError("requests must be a positive integer")
+    if not isinstance(sample, (int, float)) or not 0 < sample <= 1:
+        raise ValueError("sample must be a number in (0, 1]")
+    route = (route or "").encode()
+    if len(route) >= MAX_ROUTE:
+        raise ValueError(f"route must be shorter than {MAX_ROUTE} bytes")
+
+    with _LOCK:
+        _SAMPLE.value = float(sample)
+        _ROUTE.value = route
+        _REMAINING.value = requests
+    return session()
+
+
+def stop_session():
+    """
+    Stop profiling, returning the session as it was.
+
+    """
+    with _LOCK:
+        current = session()
+        _REMAINING.value = 0
+    return current
+
+
+def session():
+    """
+    Describe the current profiling session.
+
+    """
+    return {
+        'remaining': _REMAINING.value,
+        'sample': _SAMPLE.value,
+        'route': _ROUTE.value.decode() or None,
+        'directory': os.path.abspath(PROFILE_DIR)
+    }
+
+
+def _take(route):
+    # Claim one of the session's remaining requests for `route`
+    if _REMAINING.value <= 0:
+        return False
+    selected = _ROUTE.value
+    if selected and selected.decode() != route:
+        return False
+    if _SAMPLE.value < 1.0 and random.random() >= _SAMPLE.value:
+        return False
+    with _LOCK:
+        if _REMAINING.value <= 0:
+            return False
+        _REMAINING.value -= 1
+    return True
+
+
+def route_name(route):
+    """
+    A route as a file name, e.g. animals_id for /animals/{id}.
+
+    """
+    return "_".join(part.strip('{}') for part in route.split('/') if part)
+
+
+def route_directory(method, route):
+    """
+    The directory the profiles of one route are written to.
+
+    """
+    return os.path.join(PROFILE_DIR, f"{method}_{route_name(route)}")
+
+
+def profile(method, route, headers, respond):
+    """
+    Call `respond()` for a request, profiling it if it was asked for.
+
+    Returns the Response. A streamed body keeps being profiled while its
+    chunks are produced and is written when it is closed.
+    """
+    wanted = headers.get('x-profile') == '1' and authorized(headers)
+    if not wanted and not _take(route):
+        return respond()
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        response = respond()
+    finally:
+        profiler.disable()
+
+    path = os.path.join(route_directory(method, route),
+                        f"{time.time_ns()}-{os.getpid()}-{next(_sequence)}.pstats")
+    if response.streaming:
+        response.body = ProfiledStream(response.body, profiler, path)
+    else:
+        dump(profiler, path)
+    return response
+
+
+def dump(profiler, path):
+    """
+    Write the stats of `profiler` to `path`.
+
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    profiler.dump_stats(path)
+
+
+class ProfiledStream():
+    """
+    A streamed body that is profiled chunk by chunk and written when closed.
+
+    """
+    def __init__(self, chunks, profiler, path):
+        self.chunks = chunks
+        self.profiler = profiler
+        self.path = path
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.profiler.enable()
+        try:
+            return next(self.chunks)
+        finally:
+            self.profiler.disable()
+
+    def close(self):
+        """
+        Close the source stream and write the profile, once.
+
+        """
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+        if not self._closed:
+            self._closed = True
+            dump(self.profiler, self.path)
+
+
+def report(directory=PROFILE_DIR, route=None, modules=None, limit=15, out=sys.stdout):
+    """
+    Print the hottest functions of every profiled route in `directory`.
+
+    Functions are ranked by their own time summed over every profile of
+    the route. Only functions from files under the repository, or under
+    one of `modules` (e.g. views, request_handler) when given, are listed.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    prefixes = tuple(os.path.join(root, module) for module in modules or [''])
+
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        files = sorted(os.path.join(path, file) for file in os.listdir(path)
+                       if file.endswith('.pstats')) if os.path.isdir(path) else []
+        (method, _, slug) = name.partition('_')
+        if not files or (route is not None and slug != route_name(route)):
+            continue
+
+        # The server's main script is recorded by a path relative to where
+        # it was started; builtins have no file ('~')
+        stats = pstats.Stats(*files).stats
+        rows = sorted(((own, total, calls, (os.path.abspath(file), line, function))
+                       for ((file, line, function), (_, calls, own, total, _)) in stats.items()
+                       if file != '~' and os.path.abspath(file).startswith(prefixes)),
+                      reverse=True)[:limit]
+
+        print(f"{method} {slug}: {len(files)} profiled requests", file=out)
+        print(f"{'own ms':>10}{'total ms':>10}{'calls':>9}  function", file=out)
+        for (own, total, calls, (file, line, function)) in rows:
+            print(f"{own * 1000:>10.2f}{total * 1000:>10.2f}{calls:>9}  "
+                  f"{function} ({os.path.relpath(file, root)}:{line})", file=out)
+        print(file=out)
+
+
+def main(argv=None):
+    """
+    Rank the hottest functions of the profiles written by the server.
+
+    """
+    parser = argparse.ArgumentParser(description="Report on profiled kennel requests.")
+    parser.add_argument('--dir', default=PROFILE_DIR,
+                        help="directory the server wrote profiles to")
+    parser.add_argument('--route', default=None,
+                        help="only this route, e.g. /animals/{id}")
+    parser.add_argument('--module', dest='modules', action='append',
+                        help="only functions in this module or package, e.g. views "
+                             "(repeatable; default: the whole repository)")
+    parser.add_argument('--limit', type=int, default=15,
+                        help="functions listed per route")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.dir):
+        print(f"no profiles in {args.dir}", file=sys.stderr)
+        return 1
+    report(args.dir, args.route, args.modules, args.limit)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,236 +1,146 @@
-import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from urllib.parse import urlparse, parse_qs
-from views import (
-    get_all_animals,
-    get_single_animal,
-    create_animal,
-    delete_animal,
-    update_animal,
-    get_all_locations,
-    get_single_location,
-    create_location,
-    delete_location,
-    update_location,
-    get_all_employees,
-    get_single_employee,
-    create_employee,
-    delete_employee,
-    update_employee,
-    get_all_customers,
-    get_single_customer,
-    create_customer,
-    delete_customer,
-    update_customer,
-    get_customers_by_email
-)
+from http.server import BaseHTTPRequestHandler
+import dispatch
+import servers
+import settings
 
 class HandleRequests(BaseHTTPRequestHandler):
     """
     A custom request handler class that extends the BaseHTTPRequestHandler class.
 
-    """
-    def parse_url(self, path):
-        """Parse the url into the resource and id"""
-        parsed_url = urlparse(path)
-        path_params = parsed_url.path.split('/')  # ['', 'animals', 1]
-        resource = path_params[1]
+    Routing lives in `dispatch` so the asyncio front end serves the same
+    responses; this class only reads requests and writes responses.
 
-        if parsed_url.query:
-            query = parse_qs(parsed_url.query)
-            return (resource, query)
+    Connections are persistent (HTTP/1.1): every response carries an
+    explicit Content-Length, idle connections are closed after `timeout`
+    seconds and a connection is closed after `max_requests` responses.
+    """
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; with Nagle on, the body of a
+    # keep-alive response waits for the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+    timeout = settings.IDLE_TIMEOUT
+    max_requests = settings.MAX_KEEPALIVE_REQUESTS
 
-        pk = None
-        try:
-            pk = int(path_params[2])
-        except (IndexError, ValueError):
-            pass
-        return (resource, pk)
+    def setup(self):
+        super().setup()
+        self.requests_served = 0
 
     def do_GET(self):
         """
-        method docstring
-        """
-        self._set_headers(200)
+        Handle HTTP GET requests.
 
-        response = {}
-
-        # Parse URL and store entire tuple in a variable
-        parsed = self.parse_url(self.path)
-
-        # If the path does not include a query parameter, continue with the original if block
-        if '?' not in self.path:
-            ( resource, id ) = parsed
-
-            if resource == "animals":
-                if id is not None:
-                    response = get_single_animal(id)
-                else:
-                    response = get_all_animals()
-            if resource == "locations":
-                if id is not None:
-                    response = get_single_location(id)
-                else:
-                    response = get_all_locations()
-            if resource == "employees":
-                if id is not None:
-                    response = get_single_employee(id)
-                else:
-                    response = get_all_employees()
-            elif resource == "customers":
-                if id is not None:
-                    response = get_single_customer(id)
-                else:
-                    response = get_all_customers()
-
-        else: # There is a ? in the path, run the query param functions
-            (resource, query) = parsed
-
-            # see if the query dictionary has an email key
-            if query.get('email') and resource == 'customers':
-                response = get_customers_by_email(query['email'][0])
-
-        self.wfile.write(json.dumps(response).encode())
+        """
+        self._respond(dispatch.handle('GET', self.path, headers=self.headers))
 
     def do_POST(self):
         """
         Handle HTTP POST requests.
 
         """
-        self._set_headers(201)
-        content_len = int(self.headers.get('content-length', 0))
-        post_body = self.rfile.read(content_len)
-
-        # Convert JSON string to a Python dictionary
-        post_body = json.loads(post_body)
-
-        # Parse the URL
-        (resource, id) = self.parse_url(self.path)
-
-        # Initialize new animal
-        new_animal = None
-
-        # Initialize new location
-        new_location = None
-
-        # Initialize new employee
-        new_employee = None
-
-        # Initialize new customer
-        new_customer = None
-
-        # Add a new animal, location, or employee to the list
-        if resource == "animals":
-            new_animal = create_animal(post_body)
-        elif resource == "locations":
-            new_location = create_location(post_body)
-        elif resource == "employees":
-            new_employee = create_employee(post_body)
-        elif resource == "customers":
-            new_customer = create_customer(post_body)
-
-        # Encode the new object and send in response
-        if new_location is not None:
-            self.wfile.write(json.dumps(new_location).encode())
-        elif new_employee is not None:
-            self.wfile.write(json.dumps(new_employee).encode())
-        elif new_customer is not None:
-            self.wfile.write(json.dumps(new_customer).encode())
-        else:
-            self.wfile.write(json.dumps(new_animal).encode())
+        self._respond_with_body('POST')
 
     def do_PUT(self):
         """
-        handle boolean value
-        """
-        content_len = int(self.headers.get('content-length', 0))
-        post_body = self.rfile.read(content_len)
-        post_body = json.loads(post_body)
-
-        # Parse the URL
-        (resource, id) = self.parse_url(self.path)
-
-        success = False
-
-            # Delete a single animal from the list
-        if resource == "animals":
-            update_animal(id, post_body)
-        elif resource == "locations":
-            update_location(id, post_body)
-        elif resource == "employees":
-            update_employee(id, post_body)
-        elif resource == "customers":
-            update_customer(id, post_body)
+        Handle HTTP PUT requests.
 
-        if success:
-            self._set_headers(204)
-        else:
-            self._set_headers(404)
-
-        self.wfile.write("".encode())
+        """
+        self._respond_with_body('PUT')
 
-    def _set_headers(self, status, new_location=None, new_employee=None, new_customer=None):
+    def do_PATCH(self):
         """
-        Set response headers.
+        Handle HTTP PATCH requests.
 
         """
-        self.send_response(status)
-        self.send_header('Content-type', 'application/json')
-        self.send_header('Access-Control-Allow-Origin', '*')
-        if new_location is not None:
-            self.send_header('Location', f"/locations/{new_location['id']}")
-        elif new_employee is not None:
-            self.send_header('Location', f"/employees/{new_employee['id']}")
-        elif new_customer is not None:
-            self.send_header('Location', f"/customers/{new_customer['id']}")
-        self.end_headers()
+        self._respond_with_body('PATCH')
 
     def do_OPTIONS(self):
         """
         Handle HTTP OPTIONS requests.
 
         """
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, PUT, DELETE')
-        self.send_header('Access-Control-Allow-Headers', 'X-Requested-With, Content-Type, Accept')
-        self.end_headers()
+        self._respond(dispatch.handle('OPTIONS', self.path, headers=self.headers))
 
     def do_DELETE(self):
         """
         Handle HTTP DELETE requests.
 
         """
-        # Set a 204 response code
-        self._set_headers(204)
+        self._respond(dispatch.handle('DELETE', self.path, headers=self.headers))
 
-        # Parse the URL
-        (resource, id) = self.parse_url(self.path)
+    def _respond_with_body(self, method):
+        try:
+            content_len = dispatch.content_length(self.headers.get('content-length'))
+        except ValueError as ex:
+            # The body cannot be framed, so the connection is closed after the 400
+            self.close_connection = True
+            self._respond(dispatch.json_response(400, {'message': str(ex)}))
+            return
+        self._respond(dispatch.handle(method, self.path, self.rfile.read(content_len),
+                                      self.headers))
+
+    def _respond(self, response):
+        """
+        Write the status, headers and body of a dispatch.Response.
 
-        # Delete a single animal from the list
-        if resource == "animals":
-            delete_animal(id)
-        if resource == "locations":
-            delete_location(id)
-        if resource == "employees":
-            delete_employee(id)
-        if resource == "customers":
-            delete_customer(id)
+        """
+        self.requests_served += 1
+        if self.requests_served >= self.max_requests:
+            self.close_connection = True
+
+        # HTTP/1.0 clients cannot read chunked bodies, so a streamed body
+        # is framed by closing the connection instead.
+        chunked = response.streaming and self.request_version != 'HTTP/1.0'
+        if response.streaming and not chunked:
+            self.close_connection = True
+
+        self.send_response(response.status)
+        for (name, value) in response.headers:
+            self.send_header(name, value)
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        elif not response.streaming and response.status != 304:
+            self.send_header('Content-Length', str(len(response.body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
 
-        # Encode the new animal and send in response
-        self.wfile.write("".encode())
+        if not response.streaming:
+            self.wfile.write(response.body)
+            return
+
+        try:
+            for chunk in response.body:
+                if not chunk:
+                    continue
+                if chunked:
+                    self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                else:
+                    self.wfile.write(chunk)
+            if chunked:
+                self.wfile.write(b"0\r\n\r\n")
+        except Exception:
+            # The status line is already sent, so the only way to report a
+            # failure mid-stream is to drop the connection.
+            self.close_connection = True
+            raise
+        finally:
+            response.close()
 
 
 # This function is not inside the class. It is the starting
 # point of this application.
-def main():
+def main(argv=None):
     """
-    Start the server on port 8088 using the HandleRequests class.
+    Start the server using the HandleRequests class.
 
+    The host, port and server mode come from `settings`; by default this
+    serves one request at a time on port 8088.
     """
-    host = ''
-    port = 8088
-    HTTPServer((host, port), HandleRequests).serve_forever()
+    args = settings.parse_args(argv)
+    servers.prepare(args)
+    HandleRequests.timeout = args.idle_timeout
+    HandleRequests.max_requests = args.max_keepalive_requests
+    servers.serve_forever(args, HandleRequests)
 
 
 if __name__ == "__main__":
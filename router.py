@@ -0,0 +1,102 @@
+"""
+URL parsing and the route table used by `dispatch`.
+
+A request path is parsed once into its resource, id, shape and query. The
+handler is then found with a single dict lookup on (method, resource,
+shape), so the cost of routing does not grow with the number of routes.
+
+Shapes:
+
+    /animals            collection
+    /animals/3          item
+    /locations/stats    stats
+    /locations/3/stats  item/stats
+"""
+import re
+from urllib.parse import urlparse, parse_qs
+from views.validation import INTEGER_RANGE
+
+# An id segment: ASCII digits only, since str.isdigit() also accepts e.g. '²'
+ID_PATTERN = re.compile(r"[0-9]+")
+
+
+class Request():
+    """
+    A request with its URL parsed into resource, id, shape and query.
+
+    """
+    def __init__(self, method, path, body=b"", headers=None):
+        self.method = method
+        self.path = path
+        self.body = body
+        self.headers = headers if headers is not None else {}
+
+        parsed_url = urlparse(path)
+        self.query = parse_qs(parsed_url.query) if parsed_url.query else {}
+        (self.resource, self.id, self.shape) = parse_path(parsed_url.path)
+
+
+def parse_path(path):
+    """
+    Split a URL path into (resource, id, shape).
+
+    `shape` is None for paths no route can match, including ids too large
+    for sqlite to look up.
+    """
+    segments = [segment for segment in path.split('/') if segment]
+    if not segments:
+        return ('', None, None)
+
+    resource = segments[0]
+    rest = segments[1:]
+
+    if not rest:
+        return (resource, None, 'collection')
+
+    if ID_PATTERN.fullmatch(rest[0]):
+        pk = int(rest[0])
+        if pk not in INTEGER_RANGE:
+            return (resource, None, None)
+        if len(rest) == 1:
+            return (resource, pk, 'item')
+        if len(rest) == 2:
+            return (resource, pk, 'item/' + rest[1])
+        return (resource, pk, None)
+
+    if len(rest) == 1:
+        return (resource, None, rest[0])
+    return (resource, None, None)
+
+
+class Router():
+    """
+    A precompiled table mapping (method, resource, shape) to handlers.
+
+    """
+    def __init__(self):
+        self.routes = {}
+
+    def add(self, method, resource, shape, handler):
+        """
+        Register `handler` for requests of this method, resource and shape.
+
+        """
+        key = (method, resource, shape)
+        if key in self.routes:
+            raise ValueError(f"route {key} is already registered")
+        self.routes[key] = handler
+
+    def resolve(self, request):
+        """
+        Return the handler for a parsed request, or None.
+
+        """
+        return self.routes.get((request.method, request.resource, request.shape))
+
+    def methods(self, resource, shape):
+        """
+        Return the methods routed for a resource and shape.
+
+        """
+        return sorted(method for (method, res, shp) in self.routes
+                      if res == resource and shp == shape)
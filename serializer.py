@@ -0,0 +1,86 @@
+"""
+JSON encoding and decoding of request and response bodies.
+
+orjson is used when it is installed (`pip install orjson`) and the stdlib
+json module otherwise; KENNEL_JSON=json forces the stdlib. Either way the
+output is compact UTF-8 bytes, so responses do not depend on which encoder
+produced them.
+
+The location and customer objects embedded in every animal row repeat
+across thousands of rows, so their encoded bytes are cached in Fragments
+and spliced into the row instead of being encoded again. That only pays
+off with the stdlib encoder: orjson encodes the nested objects faster than
+Python can look the fragments up, so FRAGMENTS defaults to off with orjson.
+"""
+import json
+import os
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None and os.environ.get("KENNEL_JSON", "orjson") != "json":
+    ENCODER = 'orjson'
+    dumps = orjson.dumps
+    loads = orjson.loads
+else:
+    ENCODER = 'json'
+    _encode = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+
+    def dumps(data):
+        """
+        Encode `data` as compact JSON bytes.
+
+        """
+        return _encode(data).encode()
+
+    loads = json.loads
+
+FRAGMENTS = os.environ.get("KENNEL_JSON_FRAGMENTS", "1" if ENCODER == 'json' else "0") != "0"
+
+# Encoded fragments kept per Fragments instance before it starts over
+FRAGMENT_CACHE_SIZE = int(os.environ.get("KENNEL_FRAGMENT_CACHE_SIZE", 10000))
+
+
+class Fragments():
+    """
+    A cache of encoded JSON objects with the given `fields`, keyed by their values.
+
+    Since a fragment only depends on the values it encodes, entries never
+    go stale; the cache is simply emptied when it reaches `max_size`.
+    """
+    def __init__(self, fields, max_size=FRAGMENT_CACHE_SIZE):
+        self.fields = fields
+        self.max_size = max_size
+        self._encoded = {}
+        self.hits = 0
+        self.misses = 0
+
+    def encode(self, *values):
+        """
+        Return the JSON bytes of the object whose fields have `values`.
+
+        """
+        encoded = self._encoded.get(values)
+        if encoded is not None:
+            self.hits += 1
+            return encoded
+
+        self.misses += 1
+        encoded = dumps(dict(zip(self.fields, values)))
+        if len(self._encoded) >= self.max_size:
+            self._encoded.clear()
+        self._encoded[values] = encoded
+        return encoded
+
+    def stats(self):
+        """
+        Return a snapshot of the cache counters.
+
+        """
+        return {
+            'size': len(self._encoded),
+            'hits': self.hits,
+            'misses': self.misses
+        }
@@ -0,0 +1,271 @@
+"""
+Concurrent server modes for HandleRequests.
+
+`threaded` serves requests from a bounded thread pool. `prefork` binds the
+listening socket once and forks worker processes that all accept on the
+inherited fd, so one server can use every core.
+"""
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer
+import compression
+import metrics
+import migrate
+import profiling
+from views import cache, database, write_queue
+
+# Connections the kernel queues for accept(); the stdlib default of 5 makes
+# clients beyond it retry their SYN after a second
+BACKLOG = 128
+
+
+class KennelHTTPServer(HTTPServer):
+    """
+    An HTTPServer listening with the server's BACKLOG.
+
+    """
+    request_queue_size = BACKLOG
+
+
+class ThreadPoolHTTPServer(KennelHTTPServer):
+    """
+    An HTTPServer that hands each accepted connection to a fixed-size pool.
+
+    When every worker is busy the accept loop blocks, so connections queue
+    in the kernel backlog instead of piling up as unbounded threads.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, threads,
+                 bind_and_activate=True):
+        super().__init__(server_address, handler_class, bind_and_activate)
+        self._executor = ThreadPoolExecutor(threads, thread_name_prefix="kennel")
+        self._slots = threading.BoundedSemaphore(threads)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            self._executor.submit(self._process, request, client_address)
+        except RuntimeError:
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=True)
+
+
+def prepare(settings):
+    """
+    Point the views at the configured database and bring its schema up to date.
+
+    Runs once in the parent process, before any workers are started.
+    """
+    database.configure(path=settings.db_path, size=settings.pool_size,
+                       synchronous=settings.synchronous,
+                       journal_mode=settings.journal_mode,
+                       busy_timeout=settings.busy_timeout,
+                       wal_autocheckpoint=settings.wal_autocheckpoint,
+                       checkpoint_interval=settings.checkpoint_interval)
+    mode = database.set_journal_mode()
+    if mode != settings.journal_mode:
+        print(f"journal mode is {mode}, not {settings.journal_mode}", file=sys.stderr)
+    cache.configure(settings.cache_size, settings.cache_ttl)
+    compression.configure(settings.compress_level, settings.compress_min_size)
+    metrics.configure(settings.metrics)
+    profiling.configure(settings.profile_dir)
+    write_queue.configure(settings.write_queue, settings.write_max_latency,
+                          settings.write_max_batch, settings.write_timeout)
+    for name in migrate.migrate():
+        print(f"applied migration {name}", file=sys.stderr)
+
+
+def make_server(settings, handler_class, sock=None):
+    """
+    Build the server for `settings.mode`, optionally on an already bound socket.
+
+    """
+    address = (settings.host, settings.port)
+    bind = sock is None
+
+    if settings.mode == 'single':
+        server = KennelHTTPServer(address, handler_class, bind_and_activate=bind)
+    else:
+        server = ThreadPoolHTTPServer(address, handler_class, settings.threads,
+                                      bind_and_activate=bind)
+
+    if sock is not None:
+        server.socket.close()
+        server.socket = sock
+        host, port = sock.getsockname()[:2]
+        server.server_name = socket.getfqdn(host)
+        server.server_port = port
+    return server
+
+
+def listen(settings, backlog=BACKLOG):
+    """
+    Bind and listen on the configured address, returning the socket.
+
+    The socket is non-blocking: every prefork worker wakes up for a new
+    connection, and the ones that lose the race must not block in accept(),
+    where they would no longer notice a shutdown.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((settings.host, settings.port))
+    sock.listen(backlog)
+    sock.setblocking(False)
+    return sock
+
+
+def serve_forever(settings, handler_class):
+    """
+    Run the server in the configured mode until interrupted.
+
+    """
+    if settings.mode == 'prefork':
+        PreforkServer(settings, handler_class).run()
+        return
+    if settings.mode == 'asyncio':
+        import async_server
+        async_server.serve_forever(settings)
+        return
+
+    server = make_server(settings, handler_class)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class PreforkServer():
+    """
+    Supervise a fixed number of worker processes sharing one listening socket.
+
+    SIGHUP restarts the workers one at a time, starting each replacement
+    before the old worker is asked to finish its in-flight requests, so the
+    port keeps accepting throughout. SIGTERM and SIGINT stop every worker
+    gracefully. Workers that die unexpectedly are replaced.
+    """
+    def __init__(self, settings, handler_class):
+        self.settings = settings
+        self.handler_class = handler_class
+        self.sock = None
+        self.workers = set()
+        self._restart = False
+        self._stopping = False
+
+    def run(self):
+        """
+        Bind the socket, start the workers and supervise them until stopped.
+
+        """
+        self.sock = listen(self.settings)
+        signal.signal(signal.SIGHUP, self._on_hup)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+
+        for _ in range(self.settings.workers):
+            self._spawn()
+
+        try:
+            while not self._stopping:
+                if self._restart:
+                    self._restart = False
+                    self._rolling_restart()
+                self._reap(respawn=True)
+                time.sleep(0.2)
+        finally:
+            self._stop_all()
+            self.sock.close()
+
+    def _on_hup(self, signum, frame):
+        self._restart = True
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                self._worker()
+            except Exception:
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        self.workers.add(pid)
+        return pid
+
+    def _worker(self):
+        server = make_server(self.settings, self.handler_class, self.sock)
+
+        def stop(signum, frame):
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+
+    def _reap(self, respawn):
+        while self.workers:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.workers.clear()
+                return
+            if pid == 0:
+                return
+            if pid in self.workers:
+                self.workers.discard(pid)
+                if respawn and not self._stopping:
+                    self._spawn()
+
+    def _wait_for(self, pid):
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+        self.workers.discard(pid)
+
+    def _rolling_restart(self):
+        for pid in list(self.workers):
+            self._spawn()
+            self._signal(pid, signal.SIGTERM)
+            self._wait_for(pid)
+
+    def _stop_all(self):
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGTERM)
+        for pid in list(self.workers):
+            self._wait_for(pid)
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            self.workers.discard(pid)
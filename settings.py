@@ -0,0 +1,117 @@
+"""
+Server configuration shared by every server mode.
+
+Defaults come from KENNEL_* environment variables and can be overridden on
+the command line, e.g. `python request_handler.py --mode prefork --workers 4`.
+"""
+import argparse
+import os
+import compression
+import metrics
+import profiling
+from views import cache, database, write_queue
+
+HOST = os.environ.get("KENNEL_HOST", "")
+PORT = int(os.environ.get("KENNEL_PORT", 8088))
+MODE = os.environ.get("KENNEL_MODE", "single")
+WORKERS = int(os.environ.get("KENNEL_WORKERS", os.cpu_count() or 1))
+THREADS = int(os.environ.get("KENNEL_THREADS", 16))
+# An idle keep-alive connection holds a request thread in the threaded and
+# prefork modes, so --threads idle clients would lock everyone else out
+# for this long
+IDLE_TIMEOUT = float(os.environ.get("KENNEL_IDLE_TIMEOUT", 2))
+MAX_KEEPALIVE_REQUESTS = int(os.environ.get("KENNEL_MAX_KEEPALIVE_REQUESTS", 1000))
+
+MODES = ('single', 'threaded', 'prefork', 'asyncio')
+
+
+def parse_args(argv=None):
+    """
+    Build the server settings from the environment and the command line.
+
+    """
+    parser = argparse.ArgumentParser(description="Run the kennel server.")
+    parser.add_argument('--host', default=HOST,
+                        help="interface to listen on (default: all)")
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--mode', choices=MODES, default=MODE,
+                        help="single: one request at a time, "
+                             "threaded: bounded thread pool, "
+                             "prefork: worker processes sharing one socket, "
+                             "asyncio: event loop with a bounded executor")
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help="number of worker processes in prefork mode")
+    parser.add_argument('--threads', type=int, default=THREADS,
+                        help="request threads per process (executor size in asyncio mode)")
+    parser.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT,
+                        help="seconds an idle keep-alive connection is kept open; "
+                             "outside asyncio mode it holds a request thread meanwhile")
+    parser.add_argument('--max-keepalive-requests', type=int, default=None,
+                        help="requests served on one connection before it is closed "
+                             f"(default {MAX_KEEPALIVE_REQUESTS}; single mode only "
+                             "allows 1)")
+    parser.add_argument('--compress-level', type=int, default=compression.LEVEL,
+                        choices=range(0, 10), metavar='0-9',
+                        help="gzip/deflate level for GET responses (0 disables)")
+    parser.add_argument('--compress-min-size', type=int, default=compression.MIN_SIZE,
+                        help="smallest response body in bytes worth compressing")
+    parser.add_argument('--metrics', action=argparse.BooleanOptionalAction,
+                        default=metrics.ENABLED,
+                        help="record request counts and timings for GET /metrics")
+    parser.add_argument('--profile-dir', default=profiling.PROFILE_DIR,
+                        help="directory profiled requests are written to; profiling is "
+                             "turned on through /profile with KENNEL_ADMIN_TOKEN")
+    parser.add_argument('--db-path', default=None,
+                        help="sqlite database file (default: KENNEL_DB_PATH)")
+    parser.add_argument('--pool-size', type=int, default=None,
+                        help="pooled read-only connections per process")
+    parser.add_argument('--cache-size', type=int, default=cache.CACHE_SIZE,
+                        help="entities kept in the per-process lookup cache (0 disables)")
+    parser.add_argument('--cache-ttl', type=float, default=cache.CACHE_TTL,
+                        help="seconds a cached entity is served at most; a write "
+                             "to a table it was read from drops it sooner")
+    parser.add_argument('--write-queue', action=argparse.BooleanOptionalAction,
+                        default=write_queue.ENABLED,
+                        help="group-commit single-row writes on one writer thread")
+    parser.add_argument('--write-max-latency', type=float, default=write_queue.MAX_LATENCY,
+                        help="seconds a queued write waits for others to share its commit")
+    parser.add_argument('--write-max-batch', type=int, default=write_queue.MAX_BATCH,
+                        help="most writes committed together by the write queue")
+    parser.add_argument('--write-timeout', type=float, default=write_queue.WRITE_TIMEOUT,
+                        help="seconds a queued write waits for its commit before "
+                             "the request is answered with a 503")
+    parser.add_argument('--synchronous', type=str.upper, default=database.SYNCHRONOUS,
+                        choices=database.SYNCHRONOUS_LEVELS,
+                        help="PRAGMA synchronous for every write: OFF and NORMAL "
+                             "trade durability of the last commits for speed")
+    parser.add_argument('--journal-mode', type=str.upper, default=database.JOURNAL_MODE,
+                        choices=database.JOURNAL_MODES,
+                        help="journal mode set on the database at startup; in WAL "
+                             "mode reads are not blocked by writes")
+    parser.add_argument('--busy-timeout', type=float, default=database.BUSY_TIMEOUT,
+                        help="seconds a connection waits on a locked database")
+    parser.add_argument('--wal-autocheckpoint', type=int,
+                        default=database.WAL_AUTOCHECKPOINT,
+                        help="WAL pages after which a commit checkpoints (0 disables)")
+    parser.add_argument('--checkpoint-interval', type=float,
+                        default=database.CHECKPOINT_INTERVAL,
+                        help="seconds between background WAL checkpoints (0 disables)")
+    args = parser.parse_args(argv)
+
+    if args.workers < 1 or args.threads < 1:
+        parser.error("--workers and --threads must be at least 1")
+    if args.mode == 'single':
+        # A single-threaded server would be blocked by one idle client.
+        if args.max_keepalive_requests not in (None, 1):
+            parser.error("--max-keepalive-requests must be 1 in single mode, "
+                         "which closes every connection after one request")
+        args.max_keepalive_requests = 1
+    elif args.max_keepalive_requests is None:
+        args.max_keepalive_requests = MAX_KEEPALIVE_REQUESTS
+    if args.max_keepalive_requests < 1:
+        parser.error("--max-keepalive-requests must be at least 1")
+    if args.write_max_latency < 0 or args.write_max_batch < 1:
+        parser.error("--write-max-latency must be >= 0 and --write-max-batch >= 1")
+    if args.write_timeout <= 0:
+        parser.error("--write-timeout must be positive")
+    return args
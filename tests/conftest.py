@@ -0,0 +1,43 @@
+"""
+Fixtures shared by the kennel tests.
+
+Every test gets its own copy of kennel.sqlite3, so tests may write freely.
+"""
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import migrate  # pylint: disable=wrong-import-position
+from views import database  # pylint: disable=wrong-import-position
+from views.cache import CACHE  # pylint: disable=wrong-import-position
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    """
+    The path of a copy of kennel.sqlite3 with every migration applied.
+
+    """
+    path = str(tmp_path / "kennel.sqlite3")
+    shutil.copyfile(os.path.join(ROOT, "kennel.sqlite3"), path)
+    migrate.migrate(path)
+    return path
+
+
+@pytest.fixture
+def kennel(db_path):
+    """
+    Point the views at `db_path` for the duration of a test.
+
+    """
+    previous = database.READ_POOL.path
+    database.configure(path=db_path)
+    CACHE.clear()
+    yield db_path
+    CACHE.clear()
+    database.configure(path=previous)
@@ -0,0 +1,35 @@
+"""
+Request parsing of the asyncio front end.
+
+"""
+import asyncio
+
+import pytest
+
+from async_server import BadRequest, read_request
+
+
+def parse(raw):
+    """
+    Run read_request over the bytes of `raw`.
+
+    """
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        return await read_request(reader)
+    return asyncio.run(run())
+
+
+def test_reads_the_body_given_by_content_length():
+    (method, path, _, headers, body) = parse(
+        b"POST /animals HTTP/1.1\r\nContent-Length: 2\r\n\r\n{}")
+
+    assert (method, path, headers['content-length'], body) == ('POST', '/animals', '2', b"{}")
+
+
+@pytest.mark.parametrize('length', [b"-5", b"abc", b"1.5"])
+def test_rejects_a_bad_content_length(length):
+    with pytest.raises(BadRequest):
+        parse(b"POST /animals HTTP/1.1\r\nContent-Length: " + length + b"\r\n\r\n{}")
@@ -0,0 +1,146 @@
+"""
+Bulk creates, updates and deletes, on the fully migrated schema with its triggers.
+
+"""
+import sqlite3
+
+import pytest
+
+from test_dispatch import call
+from views.animal_requests import (create_animals, delete_animals, get_all_animals,
+                                   get_single_animal, update_animals)
+from views.bulk import BulkError
+from views.customer_requests import create_customers, get_all_customers
+
+
+def animal(**fields):
+    """
+    A valid new animal, with `fields` replaced.
+
+    """
+    return {'name': "Rex", 'breed': "Pug", 'status': "Kennel",
+            'location_id': 1, 'customer_id': 1, **fields}
+
+
+def test_atomic_create_rejects_mistyped_values(kennel):
+    with pytest.raises(BulkError) as raised:
+        create_animals([animal(), animal(name={'x': 1}), animal(location_id="abc")])
+
+    assert raised.value.errors == [
+        {'index': 1, 'message': "name must be a string"},
+        {'index': 2, 'message': "location_id must be an integer"}
+    ]
+
+
+def test_partial_create_reports_mistyped_values_per_item(kennel):
+    results = create_animals([animal(), animal(customer_id=[1]), animal(location_id=2 ** 63)],
+                             atomic=False)
+
+    assert 'id' in results[0]
+    assert results[1:] == [{'index': 1, 'error': "customer_id must be an integer"},
+                           {'index': 2, 'error': "location_id is out of range"}]
+
+
+@pytest.mark.parametrize('atomic', [True, False])
+def test_update_reports_mistyped_fields_per_item(kennel, atomic):
+    changes = [{'id': 1, 'fields': {'name': {'x': 1}}},
+               {'id': 2, 'fields': {'location_id': "abc"}},
+               {'id': 3, 'fields': {'location_id': None, 'customer_id': None}}]
+    expected = [
+        {'index': 0, 'id': 1, 'status': 'error', 'message': "name must be a string"},
+        {'index': 1, 'id': 2, 'status': 'error',
+         'message': "location_id must be an integer"},
+        {'index': 2, 'id': 3, 'status': 'error', 'message': "customer_id cannot be null"}
+    ]
+
+    if atomic:
+        with pytest.raises(BulkError) as raised:
+            update_animals(changes)
+        assert raised.value.errors == expected
+    else:
+        assert update_animals(changes, atomic=False) == expected
+    assert get_single_animal(2)['location_id'] is not None
+
+
+def test_atomic_create_reports_the_index_of_the_failing_item(kennel):
+    conn = sqlite3.connect(kennel)
+    try:
+        conn.execute("""
+        CREATE TRIGGER reject_bad_animal BEFORE INSERT ON Animal
+        WHEN NEW.name = 'Bad'
+        BEGIN
+            SELECT RAISE(ABORT, 'bad animal');
+        END
+        """)
+        conn.commit()
+    finally:
+        conn.close()
+
+    # The items before it also write LocationStats and search index rows
+    with pytest.raises(BulkError) as raised:
+        create_animals([animal(), animal(), animal(name="Bad"), animal()])
+
+    assert raised.value.errors == [{'index': 2, 'message': "bad animal"}]
+
+
+def test_atomic_create_reports_a_duplicate_email_at_its_index(kennel):
+    (taken, ) = (customer['email'] for customer in get_all_customers(limit=1))
+    customers = [{'name': name, 'address': "1 Main St", 'email': email, 'password': "x"}
+                 for (name, email) in (("A", "a@example.com"), ("B", "b@example.com"),
+                                       ("C", taken), ("D", "d@example.com"))]
+
+    # The customers before it are also written to the CustomerSearch index
+    with pytest.raises(BulkError) as raised:
+        create_customers(customers)
+
+    assert [error['index'] for error in raised.value.errors] == [2]
+
+
+def test_atomic_create_reports_a_duplicate_within_the_batch_at_its_index(kennel):
+    customers = [{'name': name, 'address': "1 Main St", 'email': "same@example.com",
+                  'password': "x"} for name in ("A", "B")]
+
+    with pytest.raises(BulkError) as raised:
+        create_customers(customers)
+
+    assert [error['index'] for error in raised.value.errors] == [1]
+
+
+def test_atomic_create_assigns_the_ids_of_the_inserted_rows(kennel):
+    created = create_animals([animal(name="First"), animal(name="Second")])
+
+    assert [get_single_animal(item['id'])['name'] for item in created] == ["First", "Second"]
+
+
+def test_delete_by_ids_reports_every_id(kennel):
+    (first, second) = create_animals([animal(), animal()])
+
+    results = delete_animals(ids=[first['id'], 9999, second['id']])
+
+    assert results == [{'id': first['id'], 'status': 'deleted'},
+                       {'id': 9999, 'status': 'not_found'},
+                       {'id': second['id'], 'status': 'deleted'}]
+    assert get_single_animal(first['id']) is None
+
+
+def test_delete_by_filters_needs_every_filter_to_match(kennel):
+    created = create_animals([animal(name="Gone", location_id=1),
+                              animal(name="Gone", location_id=2),
+                              animal(name="Kept", location_id=1)])
+
+    (status, results) = call('DELETE', '/animals?name=Gone&location_id=1,3')
+
+    assert status == 200
+    assert results == [{'id': created[0]['id'], 'status': 'deleted'}]
+    remaining = [row['id'] for row in get_all_animals(limit=100)]
+    assert created[1]['id'] in remaining and created[2]['id'] in remaining
+
+
+@pytest.mark.parametrize('query', ['', '?id=', '?id=x', '?colour=red'])
+def test_delete_never_runs_without_ids_or_known_filters(kennel, query):
+    before = len(get_all_animals(limit=100))
+
+    (status, _) = call('DELETE', f'/animals{query}')
+
+    assert status == 400
+    assert len(get_all_animals(limit=100)) == before
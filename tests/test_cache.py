@@ -0,0 +1,36 @@
+"""
+The per-process entity cache and the shared table versions.
+
+"""
+from views import versions
+from views.cache import EntityCache
+
+
+def test_entry_is_served_until_a_table_it_was_read_from_changes():
+    cache = EntityCache(max_size=10, ttl=60)
+    cache.set('animals', 1, {'id': 1}, token=cache.token())
+    assert cache.get('animals', 1) == {'id': 1}
+
+    # As another prefork worker would: the shared counter moves, but this
+    # process never sees the invalidation
+    versions.bump('customers')
+
+    assert cache.get('animals', 1) is None
+
+
+def test_entry_survives_writes_to_unrelated_tables():
+    cache = EntityCache(max_size=10, ttl=60)
+    cache.set('locations', 1, {'id': 1}, token=cache.token())
+
+    versions.bump('animals')
+
+    assert cache.get('locations', 1) == {'id': 1}
+
+
+def test_value_read_before_a_write_is_stamped_with_the_old_versions():
+    cache = EntityCache(max_size=10, ttl=60)
+    token = cache.token()
+    versions.bump('animals')
+    cache.set('animals', 1, {'id': 1}, token=token)
+
+    assert cache.get('animals', 1) is None
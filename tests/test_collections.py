@@ -0,0 +1,129 @@
+"""
+Reading collections: keyset pages, streamed bodies, filters and sorting,
+and related entities attached with ?_expand= and ?_embed=.
+
+"""
+import json
+
+import pytest
+
+import dispatch
+from test_dispatch import call, header
+
+
+def next_page(response):
+    """
+    The path the Link header of `response` points to, or None.
+
+    """
+    link = header(response, 'Link')
+    if link is None:
+        return None
+    (target, rel) = link.split(';')
+    assert rel.strip() == 'rel="next"'
+    return target.strip()[1:-1]
+
+
+def test_pages_follow_their_links_through_the_whole_collection(kennel):
+    (_, everything) = call('GET', '/animals')
+
+    ids = []
+    path = '/animals?limit=2'
+    while path is not None:
+        response = dispatch.handle('GET', path, b"", {})
+        assert response.status == 200
+        page = json.loads(response.body)
+        assert len(page) <= 2
+        ids += [row['id'] for row in page]
+        path = next_page(response)
+
+    assert ids == [row['id'] for row in everything]
+
+
+def test_a_page_starts_after_its_cursor(kennel):
+    (_, everything) = call('GET', '/animals')
+    after = everything[1]['id']
+
+    (_, page) = call('GET', f'/animals?limit=3&after={after}')
+
+    assert page == everything[2:5]
+
+
+def test_the_next_link_keeps_the_other_parameters(kennel):
+    response = dispatch.handle('GET', '/animals?limit=1&status=Kennel&fields=id,name',
+                               b"", {})
+
+    assert next_page(response).startswith('/animals?limit=1&after=')
+    assert 'status=Kennel' in next_page(response)
+    assert 'fields=id,name' in next_page(response)
+
+
+@pytest.mark.parametrize('query', ['limit=0', 'limit=x', 'after=x'])
+def test_a_bad_cursor_is_rejected(kennel, query):
+    (status, _) = call('GET', f'/animals?{query}')
+
+    assert status == 400
+
+
+def test_a_whole_collection_is_streamed_in_chunks(kennel, monkeypatch):
+    chunks_of = dispatch.json_array_chunks
+    monkeypatch.setattr(dispatch, 'json_array_chunks', lambda rows: chunks_of(rows, 256))
+    (_, everything) = call('GET', '/animals?limit=100')
+
+    response = dispatch.handle('GET', '/animals', b"", {})
+    assert response.streaming
+    chunks = list(response.body)
+    response.close()
+
+    assert len(chunks) > 1
+    assert json.loads(b"".join(chunks)) == everything
+
+
+def test_filters_narrow_and_sort_orders_the_rows(kennel):
+    (_, everything) = call('GET', '/animals')
+    expected = sorted((row for row in everything if row['status'] in ("Kennel", "Treatment")),
+                      key=lambda row: (row['name'], row['id']))
+
+    (status, rows) = call('GET', '/animals?status=Kennel,Treatment&_sort=name')
+
+    assert status == 200
+    assert rows == expected
+
+
+def test_range_filters_and_descending_order(kennel):
+    (_, rows) = call('GET', '/animals?location_id_gte=2&_sort=id&_order=desc')
+
+    assert rows
+    assert all(row['location_id'] >= 2 for row in rows)
+    assert [row['id'] for row in rows] == sorted((row['id'] for row in rows), reverse=True)
+
+
+@pytest.mark.parametrize('query', ['colour=red', 'location_id=x', '_sort=password'])
+def test_unknown_filters_and_sort_fields_are_rejected(kennel, query):
+    (status, body) = call('GET', f'/animals?{query}')
+
+    assert status == 400
+    assert body['message']
+
+
+def test_expand_attaches_the_parents_of_every_row(kennel):
+    (_, rows) = call('GET', '/animals?_expand=location')
+    (_, locations) = call('GET', '/locations')
+    by_id = {location['id']: location for location in locations}
+
+    assert all(row['location'] == by_id[row['location_id']] for row in rows)
+
+
+def test_embed_lists_the_children_of_an_item(kennel):
+    (_, location) = call('GET', '/locations/1?_embed=animals')
+    (_, animals) = call('GET', '/locations/1/animals')
+
+    assert [animal['id'] for animal in location['animals']] == \
+        [animal['id'] for animal in animals]
+
+
+def test_a_relation_the_resource_does_not_have_is_rejected(kennel):
+    (status, body) = call('GET', '/animals?_embed=employees')
+
+    assert status == 400
+    assert 'employees' in body['message']
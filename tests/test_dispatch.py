@@ -0,0 +1,80 @@
+"""
+Requests through dispatch.handle, the entry point every front end shares.
+
+"""
+import json
+
+import compression
+import dispatch
+from views.database import PoolExhausted
+
+
+def call(method, path, body=None):
+    """
+    Handle one request, returning its status and decoded JSON body.
+
+    """
+    data = json.dumps(body).encode() if body is not None else b""
+    response = dispatch.handle(method, path, data, {})
+    payload = b"".join(response.body) if response.streaming else response.body
+    return (response.status, json.loads(payload) if payload else None)
+
+
+def test_create_customer_with_taken_email_conflicts(kennel):
+    (_, customers) = call('GET', '/customers')
+    taken = customers[0]['email']
+
+    (status, body) = call('POST', '/customers', {'name': "A", 'address': "B",
+                                                 'email': taken, 'password': "C"})
+
+    assert status == 409
+    assert taken in body['message']
+
+
+def test_update_customer_to_taken_email_conflicts(kennel):
+    (_, customers) = call('GET', '/customers')
+    changed = dict(customers[1], email=customers[0]['email'])
+
+    (status, _) = call('PUT', f"/customers/{changed['id']}", changed)
+
+    assert status == 409
+
+
+def header(response, name):
+    """
+    The value of the `name` header of `response`, or None.
+
+    """
+    return next((value for (key, value) in response.headers if key == name), None)
+
+
+def test_body_too_small_to_compress_keeps_the_plain_etag(kennel):
+    response = dispatch.handle('GET', '/animals/1', b"", {'accept-encoding': "gzip"})
+
+    assert len(response.body) < compression.MIN_SIZE
+    assert header(response, 'Content-Encoding') is None
+    assert not header(response, 'ETag').endswith('-gzip"')
+
+    revalidated = dispatch.handle('GET', '/animals/1', b"",
+                                  {'accept-encoding': "gzip",
+                                   'if-none-match': header(response, 'ETag')})
+    assert revalidated.status == 304
+
+
+def test_compressed_body_has_an_etag_of_its_own(kennel):
+    response = dispatch.handle('GET', '/animals', b"", {'accept-encoding': "gzip"})
+    response.close()
+
+    assert header(response, 'Content-Encoding') == 'gzip'
+    assert header(response, 'ETag').endswith('-gzip"')
+
+
+def test_an_exhausted_pool_is_answered_with_503(kennel, monkeypatch):
+    def exhausted(id):
+        raise PoolExhausted("no connection available after 5.0s")
+
+    monkeypatch.setitem(dispatch.RESOURCES['animals'], 'get', exhausted)
+    response = dispatch.handle('GET', '/animals/1', b"", {})
+
+    assert response.status == 503
+    assert ('Retry-After', str(dispatch.RETRY_AFTER)) in response.headers
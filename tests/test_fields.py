@@ -0,0 +1,52 @@
+"""
+Sparse fieldsets (?fields=), which narrow the fields of every row but
+never which rows are returned.
+
+"""
+import sqlite3
+
+import pytest
+
+from test_dispatch import call
+
+
+@pytest.fixture
+def orphans(kennel):
+    """
+    An animal without a location and an employee whose location is gone.
+
+    """
+    conn = sqlite3.connect(kennel)
+    try:
+        animal = conn.execute("INSERT INTO Animal (name, breed, status, location_id, customer_id) "
+                              "VALUES ('Stray', 'Mutt', 'Kennel', NULL, 1)").lastrowid
+        employee = conn.execute("INSERT INTO Employee (name, address, location_id) "
+                                "VALUES ('Gone', '1 Main St', 9999)").lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+    return {'animals': animal, 'employees': employee}
+
+
+@pytest.mark.parametrize(('resource', 'fieldsets'), [
+    ('animals', ['id', 'name', 'location', 'customer', 'location,customer']),
+    ('employees', ['id', 'name', 'location']),
+])
+def test_every_fieldset_returns_the_same_rows(orphans, resource, fieldsets):
+    (_, everything) = call('GET', f'/{resource}')
+    ids = [row['id'] for row in everything]
+    assert orphans[resource] in ids
+
+    for fields in fieldsets:
+        (status, rows) = call('GET', f'/{resource}?fields={fields}')
+        assert status == 200
+        assert [row['id'] for row in rows] == ids, fields
+
+
+def test_a_missing_relation_is_null(orphans):
+    (status, animal) = call('GET', f"/animals/{orphans['animals']}")
+    assert status == 200
+    assert animal['location'] is None and animal['customer'] is not None
+
+    (_, rows) = call('GET', '/employees?fields=location')
+    assert {'id': orphans['employees'], 'location': None} in rows
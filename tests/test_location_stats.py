@@ -0,0 +1,47 @@
+"""
+LocationStats, the per-location animal counts kept by triggers.
+
+"""
+import migrate
+from test_dispatch import call
+
+
+def counted(location_id):
+    """
+    The animal counts of one location, by status.
+
+    """
+    (status, stats) = call('GET', f'/locations/{location_id}/stats')
+    assert status == 200
+    return stats
+
+
+def test_stats_match_the_animals_of_each_location(kennel):
+    (_, stats) = call('GET', '/locations/stats')
+
+    for location in stats:
+        (_, animals) = call('GET', f"/locations/{location['location_id']}/animals")
+        assert location['animals'] == len(animals)
+        assert sum(location['statuses'].values()) == len(animals)
+
+
+def test_triggers_follow_creates_moves_and_deletes(kennel):
+    before = counted(1)
+
+    (_, created) = call('POST', '/animals', {'name': "Rex", 'breed': "Pug",
+                                             'status': "Kennel", 'location_id': 1,
+                                             'customer_id': 1})
+    assert counted(1)['animals'] == before['animals'] + 1
+    assert counted(1)['statuses']['Kennel'] == before['statuses'].get('Kennel', 0) + 1
+
+    call('PUT', f"/animals/{created['id']}", dict(created, location_id=2))
+    assert counted(1) == before
+
+    call('DELETE', f"/animals/{created['id']}")
+    assert migrate.check_summaries(kennel) == []
+
+
+def test_unknown_location_has_no_stats(kennel):
+    (status, _) = call('GET', '/locations/9999/stats')
+
+    assert status == 404
@@ -0,0 +1,66 @@
+"""
+The request and component metrics served at GET /metrics.
+
+"""
+import dispatch
+from views import write_queue
+from views.write_queue import WriteQueue
+
+ANIMAL_OK = 'kennel_requests_total{method="GET",route="/animals/{id}",status="200"}'
+
+
+def scrape():
+    """
+    Fetch /metrics, returning its samples as {series: value}.
+
+    """
+    response = dispatch.handle('GET', '/metrics', b"", {})
+    assert response.status == 200
+    samples = {}
+    for line in response.body.decode().splitlines():
+        if not line.startswith('#'):
+            (series, value) = line.rsplit(' ', 1)
+            samples[series] = float(value)
+    return samples
+
+
+def test_requests_are_counted_by_route(kennel):
+    before = scrape().get(ANIMAL_OK, 0)
+
+    dispatch.handle('GET', '/animals/1', b"", {})
+
+    assert scrape()[ANIMAL_OK] == before + 1
+
+
+def test_cache_counters_are_exported(kennel):
+    dispatch.handle('GET', '/animals/1', b"", {})
+    dispatch.handle('GET', '/animals/1', b"", {})
+
+    samples = scrape()
+
+    assert samples['kennel_cache_hits_total'] >= 1
+    assert samples['kennel_cache_misses_total'] >= 1
+    assert samples['kennel_cache_entries'] >= 1
+
+
+def test_pool_and_fragment_counters_are_exported(kennel):
+    samples = scrape()
+
+    assert 'kennel_pool_size{pool="read"}' in samples
+    assert 'kennel_pool_idle{pool="write"}' in samples
+    assert 'kennel_fragments_hits_total{cache="location"}' in samples
+
+
+def test_write_queue_counters_are_exported_when_it_runs(kennel, monkeypatch):
+    assert 'kennel_write_queue_commits_total' not in scrape()
+    queue = WriteQueue(kennel)
+    monkeypatch.setattr(write_queue, 'QUEUE', queue)
+    try:
+        queue.execute("UPDATE Animal SET name = 'Rex' WHERE id = ?", (1, ))
+        samples = scrape()
+    finally:
+        queue.close()
+
+    assert samples['kennel_write_queue_commits_total'] == 1
+    assert samples['kennel_write_queue_writes_total'] == 1
+    assert samples['kennel_write_queue_pending'] == 0
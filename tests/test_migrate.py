@@ -0,0 +1,65 @@
+"""
+The migrations, and the query plans of the lookups they index.
+
+"""
+import sqlite3
+
+import pytest
+
+import migrate
+
+
+def test_migrate_applies_every_migration_once(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        version = migrate.current_version(conn)
+    finally:
+        conn.close()
+
+    assert version == migrate.available_migrations()[-1][0]
+    assert migrate.migrate(db_path) == []
+
+
+@pytest.mark.parametrize(('query', 'index'),
+                         [(query, index) for (_, query, _, index) in migrate.PLAN_CHECKS],
+                         ids=[description for (description, *_) in migrate.PLAN_CHECKS])
+def test_lookup_uses_its_index(db_path, query, index):
+    conn = sqlite3.connect(db_path)
+    try:
+        plan = migrate.query_plan(conn, query)
+    finally:
+        conn.close()
+
+    assert any(f"INDEX {index} " in line for line in plan), plan
+
+
+def test_migrated_database_passes_the_plan_checks(db_path):
+    assert migrate.check_query_plans(db_path) == []
+
+
+@pytest.mark.parametrize('index', sorted({index for (*_, index) in migrate.PLAN_CHECKS}))
+def test_plan_checks_catch_a_dropped_index(db_path, index):
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(f"DROP INDEX {index}")
+        conn.commit()
+    finally:
+        conn.close()
+
+    guarded = {description for (description, *_, checked) in migrate.PLAN_CHECKS
+               if checked == index}
+    problems = migrate.check_query_plans(db_path)
+    assert all(any(problem.startswith((description, f"table scan in {description}"))
+                   for problem in problems)
+               for description in guarded), problems
+
+
+def test_unique_customer_email(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        email = conn.execute("SELECT email FROM Customer LIMIT 1").fetchone()[0]
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute("INSERT INTO Customer (name, address, email, password) "
+                         "VALUES ('A', 'B', ?, 'C')", (email, ))
+    finally:
+        conn.close()
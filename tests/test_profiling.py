@@ -0,0 +1,83 @@
+"""
+The admin-only /profile endpoints and the profiles they write.
+
+"""
+import json
+
+import pytest
+
+import dispatch
+import profiling
+
+TOKEN = "s3cret"
+
+
+@pytest.fixture
+def admin(kennel, tmp_path, monkeypatch):
+    """
+    An admin token and a profile directory, with no session left running.
+
+    """
+    monkeypatch.setattr(profiling, 'ADMIN_TOKEN', TOKEN)
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path / "profiles"))
+    yield {'x-admin-token': TOKEN}
+    profiling.stop_session()
+
+
+def request(method, path, headers, body=None):
+    """
+    Handle one request with `headers`, returning its status and JSON body.
+
+    """
+    data = json.dumps(body).encode() if body is not None else b""
+    response = dispatch.handle(method, path, data, headers)
+    return (response.status, json.loads(response.body))
+
+
+@pytest.mark.parametrize('method', ['GET', 'POST', 'DELETE'])
+def test_profiling_is_refused_without_a_configured_token(kennel, monkeypatch, method):
+    monkeypatch.setattr(profiling, 'ADMIN_TOKEN', None)
+
+    (status, _) = request(method, '/profile', {'x-admin-token': ""}, {'requests': 1})
+
+    assert status == 403
+
+
+@pytest.mark.parametrize('headers', [{}, {'x-admin-token': "wrong"}])
+def test_profiling_is_refused_without_the_right_token(admin, headers):
+    (status, body) = request('POST', '/profile', headers, {'requests': 1})
+
+    assert status == 403
+    assert 'X-Admin-Token' in body['message']
+    assert profiling.session()['remaining'] == 0
+
+
+def test_a_session_profiles_its_requests_then_ends(admin, tmp_path):
+    (status, session) = request('POST', '/profile', admin,
+                                {'requests': 1, 'route': '/animals/{id}'})
+    assert status == 200
+    assert session['remaining'] == 1
+
+    dispatch.handle('GET', '/locations/1', b"", {})
+    dispatch.handle('GET', '/animals/1', b"", {})
+    dispatch.handle('GET', '/animals/2', b"", {})
+
+    assert request('GET', '/profile', admin)[1]['remaining'] == 0
+    assert [path.name for path in (tmp_path / "profiles").iterdir()] == ['GET_animals_id']
+    assert len(list((tmp_path / "profiles" / "GET_animals_id").iterdir())) == 1
+
+
+def test_a_session_can_be_stopped(admin):
+    request('POST', '/profile', admin, {'requests': 5})
+
+    (status, _) = request('DELETE', '/profile', admin)
+
+    assert status == 200
+    assert profiling.session()['remaining'] == 0
+
+
+@pytest.mark.parametrize('body', [{'requests': 0}, {'requests': 1, 'sample': 2}, [1]])
+def test_a_bad_session_is_rejected(admin, body):
+    (status, _) = request('POST', '/profile', admin, body)
+
+    assert status == 400
@@ -0,0 +1,26 @@
+"""
+URL parsing into resource, id and shape.
+
+"""
+import pytest
+
+import dispatch
+from router import parse_path
+
+
+def test_item_paths_parse_their_id():
+    assert parse_path('/animals/3') == ('animals', 3, 'item')
+    assert parse_path('/locations/3/stats') == ('locations', 3, 'item/stats')
+
+
+def test_ids_beyond_64_bits_match_no_route():
+    assert parse_path(f'/animals/{2 ** 63}')[2] is None
+    assert parse_path(f'/animals/{2 ** 63 - 1}') == ('animals', 2 ** 63 - 1, 'item')
+
+
+@pytest.mark.parametrize('method', ['GET', 'PUT', 'DELETE'])
+@pytest.mark.parametrize('segment', ['99999999999999999999999', '²', '٣'])
+def test_ids_sqlite_cannot_look_up_are_not_found(kennel, method, segment):
+    response = dispatch.handle(method, f'/animals/{segment}', b"{}", {})
+
+    assert response.status == 404
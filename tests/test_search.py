@@ -0,0 +1,50 @@
+"""
+Full-text search with ?q= and GET /search, kept current by triggers.
+
+"""
+import pytest
+
+import migrate
+from test_dispatch import call
+
+
+def test_every_word_matches_the_start_of_a_word(kennel):
+    (status, rows) = call('GET', '/animals?q=snick dalm')
+
+    assert status == 200
+    assert [row['name'] for row in rows] == ["Snickers"]
+
+
+def test_created_updated_and_deleted_rows_are_searchable_at_once(kennel):
+    (_, created) = call('POST', '/animals', {'name': "Zephyrine", 'breed': "Whippet",
+                                             'status': "Kennel", 'location_id': 1,
+                                             'customer_id': 1})
+    (_, found) = call('GET', '/animals?q=zephyr')
+    assert [row['id'] for row in found] == [created['id']]
+
+    call('PUT', f"/animals/{created['id']}", dict(created, name="Quillon"))
+    assert call('GET', '/animals?q=zephyr')[1] == []
+    assert [row['id'] for row in call('GET', '/animals?q=quill')[1]] == [created['id']]
+
+    call('DELETE', f"/animals/{created['id']}")
+    assert call('GET', '/animals?q=quill')[1] == []
+    assert migrate.check_summaries(kennel) == []
+
+
+def test_search_all_groups_matches_by_resource(kennel):
+    (_, customers) = call('GET', '/customers?limit=1')
+    surname = customers[0]['name'].split()[-1]
+
+    (status, body) = call('GET', f'/search?q={surname}')
+
+    assert status == 200
+    assert set(body) == {'animals', 'employees', 'customers'}
+    assert customers[0]['id'] in [row['id'] for row in body['customers']]
+
+
+@pytest.mark.parametrize('path', ['/animals?q=*', '/search?q=rex&after=1', '/search?q=-',
+                                  '/locations?q=north', '/animals?q=rex&_sort=name'])
+def test_bad_searches_are_rejected(kennel, path):
+    (status, _) = call('GET', path)
+
+    assert status == 400
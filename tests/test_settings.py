@@ -0,0 +1,18 @@
+"""
+Server settings from the command line.
+
+"""
+import pytest
+
+import settings
+
+
+def test_single_mode_serves_one_request_per_connection():
+    assert settings.parse_args([]).max_keepalive_requests == 1
+    assert settings.parse_args(['--mode', 'threaded']).max_keepalive_requests == \
+        settings.MAX_KEEPALIVE_REQUESTS
+
+
+def test_single_mode_rejects_more_keep_alive_requests():
+    with pytest.raises(SystemExit):
+        settings.parse_args(['--max-keepalive-requests', '5'])
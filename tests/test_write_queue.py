@@ -0,0 +1,82 @@
+"""
+The group-commit write queue.
+
+"""
+import sqlite3
+import time
+
+import pytest
+
+import dispatch
+from views.write_queue import WriteQueue, WriteTimeout
+
+
+@pytest.fixture
+def writes(kennel):
+    """
+    A write queue on the test database, closed afterwards.
+
+    """
+    queue = WriteQueue(kennel)
+    yield queue
+    queue.close()
+
+
+def test_a_burst_of_writes_shares_one_commit(kennel):
+    queue = WriteQueue(kennel, max_latency=0.2)
+    try:
+        futures = [queue.submit("UPDATE Animal SET name = ? WHERE id = 1", ("Rex", )),
+                   queue.submit("INSERT INTO Customer (name, address, email, password) "
+                                "SELECT name, address, email, password FROM Customer "
+                                "WHERE id = 1"),
+                   queue.submit("UPDATE Animal SET breed = ? WHERE id = 1", ("Pug", ))]
+        assert futures[0].result(5).rowcount == 1
+        with pytest.raises(sqlite3.IntegrityError):
+            futures[1].result(5)
+        assert futures[2].result(5).rowcount == 1
+        stats = queue.stats()
+    finally:
+        queue.close()
+
+    # The duplicate email was rolled back alone, inside the shared commit
+    assert (stats['commits'], stats['writes']) == (1, 3)
+    conn = sqlite3.connect(kennel)
+    try:
+        assert conn.execute("SELECT name, breed FROM Animal WHERE id = 1").fetchone() == \
+            ("Rex", "Pug")
+    finally:
+        conn.close()
+
+
+def test_a_write_that_cannot_bind_fails_alone(writes):
+    with pytest.raises(OverflowError):
+        writes.execute("DELETE FROM Animal WHERE id = ?", (10 ** 30, ))
+
+    # The writer thread survived and serves the next write
+    result = writes.execute("UPDATE Animal SET name = 'Rex' WHERE id = ?", (1, ))
+    assert result.rowcount == 1
+
+
+def test_a_write_waits_a_bounded_time_for_its_commit(writes, monkeypatch):
+    commit = writes._commit  # pylint: disable=protected-access
+
+    def slow_commit(conn, batch):
+        time.sleep(0.5)
+        commit(conn, batch)
+
+    monkeypatch.setattr(writes, '_commit', slow_commit)
+    started = time.monotonic()
+    with pytest.raises(WriteTimeout):
+        writes.execute("UPDATE Animal SET name = 'Rex' WHERE id = ?", (1, ), timeout=0.05)
+    assert time.monotonic() - started < 0.5
+
+
+def test_a_write_timeout_is_answered_with_503(kennel, monkeypatch):
+    def timed_out(sql, params=()):
+        raise WriteTimeout("write not committed after 5.0s")
+
+    monkeypatch.setattr('views.animal_requests.execute_write', timed_out)
+    response = dispatch.handle('DELETE', '/animals/1', b"", {})
+
+    assert response.status == 503
+    assert ('Retry-After', str(dispatch.RETRY_AFTER)) in response.headers
@@ -1,21 +1,48 @@
 from .animal_requests import (get_all_animals,
+                            iter_animals,
                             get_single_animal,
                             create_animal,
+                            create_animals,
                             delete_animal,
-                            update_animal)
+                            update_animal,
+                            update_animals,
+                            delete_animals,
+                            get_animals_by_location,
+                            get_animals_by_locations,
+                            get_animals_by_customers,
+                            search_animals)
 from .customer_requests import (get_all_customers,
+                            iter_customers,
                             get_single_customer,
                             create_customer,
+                            create_customers,
                             delete_customer,
                             update_customer,
-                            get_customers_by_email)
+                            update_customers,
+                            delete_customers,
+                            get_customers_by_email,
+                            get_customers_by_ids,
+                            search_customers)
 from .employee_requests import (get_all_employees,
+                            iter_employees,
                             get_single_employee,
                             create_employee,
+                            create_employees,
                             delete_employee,
-                            update_employee)
+                            update_employee,
+                            update_employees,
+                            delete_employees,
+                            get_employees_by_locations,
+                            search_employees)
 from .location_requests import (get_all_locations,
+                            iter_locations,
                             get_single_location,
                             create_location,
+                            create_locations,
                             delete_location,
-                            update_location)
+                            update_location,
+                            update_locations,
+                            delete_locations,
+                            get_locations_by_ids,
+                            get_all_location_stats,
+                            get_location_stats)
@@ -1,72 +1,125 @@
-import sqlite3
+from . import versions
+from .bulk import bulk_insert, bulk_update, bulk_delete
+from .cache import CACHE
+from .database import get_read_connection, FETCH_SIZE
+from .filtering import FilterSet
+from .projection import Column, Projection
+from .validation import check_fields
+from .write_queue import execute_write
 from models.animal import Animal
-from models.location import Location
 
-def get_all_animals():
+# The SQL behind each field of an animal, for sparse ?fields= selects
+COLUMNS = {
+    'id': Column("a.id"),
+    'name': Column("a.name"),
+    'breed': Column("a.breed"),
+    'status': Column("a.status"),
+    'location_id': Column("a.location_id"),
+    'customer_id': Column("a.customer_id"),
+    'location': Column(("l.name", "l.address"), ('name', 'address'),
+                       "LEFT JOIN Location l ON l.id = a.location_id"),
+    'customer': Column(("c.name", "c.email"), ('name', 'email'),
+                       "LEFT JOIN Customer c ON c.id = a.customer_id")
+}
+
+# The fields animals may be filtered (?status=, ?location_id_gte=) and sorted on.
+# Migration 0003 indexes these, and `migrate.py --check` verifies the plans.
+FILTERS = FilterSet("Animal", "a",
+                    filters={
+                        'id': ("a.id", int),
+                        'name': ("a.name", str),
+                        'breed': ("a.breed", str),
+                        'status': ("a.status", str),
+                        'location_id': ("a.location_id", int),
+                        'customer_id': ("a.customer_id", int)
+                    },
+                    sortable={
+                        'id': 'id',
+                        'name': 'name',
+                        'breed': 'breed',
+                        'status': 'status',
+                        'customer_id': 'customer_id'
+                    })
+
+# The columns clients write, with the type of their values and whether
+# they may be null
+WRITABLE = {
+    'name': (str, False),
+    'breed': (str, False),
+    'status': (str, False),
+    'location_id': (int, True),
+    'customer_id': (int, False)
+}
+
+def get_all_animals(limit=None, after=None, fields=None, query=None):
     """
-    Get all animals
+    Get all animals, optionally one keyset page of `limit` animals after id `after`
 
     """
-    # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
-        db_cursor = conn.cursor()
-
-        db_cursor.execute("""
-        SELECT
-            a.id,
-            a.name,
-            a.breed,
-            a.status,
-            a.location_id,
-            a.customer_id,
-            l.name AS location_name,
-            l.address AS location_address,
-            c.name AS customer_name,
-            c.email AS customer_email
-        FROM Animal a
-        JOIN Location l ON l.id = a.location_id
-        JOIN Customer c ON c.id = a.customer_id
-        """)
+    return [row.to_dict() for row in iter_animals(limit, after, fields, query)]
 
-        animals = []
-        dataset = db_cursor.fetchall()
-
-    for row in dataset:
-        # Create a Customer instance from the current row
-        customer = {
-            'name': row['customer_name'],
-            'email': row['customer_email']
-        }
-
-        # Create an Animal instance from the current row
-        animal = Animal(row['id'], row['name'], row['breed'], row['status'],
-                        row['location_id'], row['customer_id'], customer)
+def iter_animals(limit=None, after=None, fields=None, query=None):
+    """
+    Yield Animal instances one at a time, reading the cursor FETCH_SIZE rows at a time
 
-        # Create a Location instance from the current row
-        location = {
-            'name': row['location_name'],
-            'address': row['location_address']
-            }
+    With `fields` only those fields are selected, as PartialRow dictionaries.
+    `query` is a Filter from FILTERS.parse that narrows and orders the rows.
+    """
+    (page_sql, page_params) = FILTERS.clause(query, after, limit)
 
-        # Assign the location dictionary to the Animal's 'location' property
-        animal.location = location
+    # Open a connection to the database
+    with get_read_connection() as conn:
 
-        # Add the dictionary representation of the animal to the list
-        animals.append(animal.__dict__)
+        db_cursor = conn.cursor()
 
-    return animals
+        if fields is not None:
+            # Only the requested columns, and only the joins they need
+            projection = Projection(COLUMNS, fields)
+            db_cursor.row_factory = projection.row_factory
+            db_cursor.execute(f"""
+            SELECT {projection.select}
+            FROM Animal a {projection.joins}
+            """ + page_sql, page_params)
+        else:
+            # Map the cursor tuples straight into Animal instances
+            db_cursor.row_factory = Animal.from_row
+
+            db_cursor.execute("""
+            SELECT
+                a.id,
+                a.name,
+                a.breed,
+                a.status,
+                a.location_id,
+                a.customer_id,
+                l.name AS location_name,
+                l.address AS location_address,
+                c.name AS customer_name,
+                c.email AS customer_email
+            FROM Animal a
+            LEFT JOIN Location l ON l.id = a.location_id
+            LEFT JOIN Customer c ON c.id = a.customer_id
+            """ + page_sql, page_params)
+
+        dataset = db_cursor.fetchmany(FETCH_SIZE)
+
+        while dataset:
+            yield from dataset
+            dataset = db_cursor.fetchmany(FETCH_SIZE)
 
 def get_single_animal(id):
     """
     Get a single animal by ID.
 
     """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
+    cached = CACHE.get('animals', id)
+    if cached is not None:
+        return cached
+    token = CACHE.token()
+
+    with get_read_connection() as conn:
         db_cursor = conn.cursor()
+        db_cursor.row_factory = Animal.from_row
 
         db_cursor.execute("""
         SELECT
@@ -81,105 +134,105 @@ def get_single_animal(id):
             c.name AS customer_name,
             c.email AS customer_email
         FROM Animal a
-        JOIN Location l ON l.id = a.location_id
-        JOIN Customer c ON c.id = a.customer_id
+        LEFT JOIN Location l ON l.id = a.location_id
+        LEFT JOIN Customer c ON c.id = a.customer_id
         WHERE a.id = ?
         """, (id, ))
 
-        row = db_cursor.fetchone()
-
-        if row is not None:
-            # Create a Customer instance from the current row
-            customer = {
-                'name': row['customer_name'],
-                'email': row['customer_email']
-            }
-
-            # Create an Animal instance from the current row
-            animal = Animal(row['id'],
-                            row['name'],
-                            row['breed'],
-                            row['status'],
-                            row['location_id'],
-                            row['customer_id'],
-                            customer)
-
-            # Create a Location instance from the current row
-            location = {
-                'name': row['location_name'],
-                'address': row['location_address']
-            }
-
-            # Assign the location dictionary to the Animal's 'location' property
-            animal.location = location
-
-            return animal.__dict__
-        else:
-            return None
+        animal = db_cursor.fetchone()
+
+    if animal is None:
+        return None
+
+    animal_dict = animal.to_dict()
+
+    # The cached animal embeds its location and customer, so it
+    # is dropped whenever either of those changes
+    CACHE.set('animals', id, animal_dict,
+              depends_on=[('locations', animal.location_id),
+                          ('customers', animal.customer_id)],
+              token=token)
+
+    return animal_dict
 
 def create_animal(new_animal):
     """
     create animal
     """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
+    check_fields(new_animal, WRITABLE)
 
-        db_cursor.execute("""
-        INSERT INTO Animal
-            ( name, breed, status, location_id, customer_id )
-        VALUES
-            ( ?, ?, ?, ?, ?);
-        """, (new_animal['name'], new_animal['breed'],
-            new_animal['status'], new_animal['location_id'],
-            new_animal['customer_id'], ))
+    result = execute_write("""
+    INSERT INTO Animal
+        ( name, breed, status, location_id, customer_id )
+    VALUES
+        ( ?, ?, ?, ?, ?);
+    """, (new_animal['name'], new_animal['breed'],
+        new_animal['status'], new_animal['location_id'],
+        new_animal['customer_id'], ))
+
+    # The `lastrowid` property of the result will return
+    # the primary key of the last thing that got added to
+    # the database.
+    id = result.lastrowid
 
-        # The `lastrowid` property on the cursor will return
-        # the primary key of the last thing that got added to
-        # the database.
-        id = db_cursor.lastrowid
+    # Add the `id` property to the animal dictionary that
+    # was sent by the client so that the client sees the
+    # primary key in the response.
+    new_animal['id'] = id
 
-        # Add the `id` property to the animal dictionary that
-        # was sent by the client so that the client sees the
-        # primary key in the response.
-        new_animal['id'] = id
+    versions.bump('animals')
 
     return new_animal
 
+def create_animals(new_animals, atomic=True):
+    """
+    Create many animals in one transaction.
+
+    See bulk_insert for how `atomic` changes the handling of failed items.
+    """
+    results = bulk_insert("Animal", WRITABLE, new_animals, atomic)
+
+    versions.bump('animals')
+
+    return results
+
 def delete_animal(id):
     """
     delete animal function
     """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
+    execute_write("""
+    DELETE FROM animal
+    WHERE id = ?
+    """, (id, ))
 
-        db_cursor.execute("""
-        DELETE FROM animal
-        WHERE id = ?
-        """, (id, ))
+    CACHE.invalidate('animals', id)
+    versions.bump('animals')
 
 def update_animal(id, new_animal):
     """
     update animal
     """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
+    check_fields(new_animal, WRITABLE)
+
+    result = execute_write("""
+    UPDATE Animal
+        SET
+            name = ?,
+            breed = ?,
+            status = ?,
+            location_id = ?,
+            customer_id = ?
+    WHERE id = ?
+    """, (new_animal['name'], new_animal['breed'],
+            new_animal['status'], new_animal['location_id'],
+            new_animal['customer_id'], id, ))
 
-        db_cursor.execute("""
-        UPDATE Animal
-            SET
-                name = ?,
-                breed = ?,
-                status = ?,
-                location_id = ?,
-                customer_id = ?
-        WHERE id = ?
-        """, (new_animal['name'], new_animal['breed'],
-                new_animal['status'], new_animal['location_id'],
-                new_animal['customer_id'], id, ))
-
-        # Were any rows affected?
-        # Did the client send an `id` that exists?
-        rows_affected = db_cursor.rowcount
+    # Were any rows affected?
+    # Did the client send an `id` that exists?
+    rows_affected = result.rowcount
+
+    CACHE.invalidate('animals', id)
+    versions.bump('animals')
 
     if rows_affected == 0:
         # Forces 404 response by main module
@@ -188,14 +241,43 @@ def update_animal(id, new_animal):
         # Forces 204 response by main module
         return True
 
+def update_animals(changes, atomic=True):
+    """
+    Update many animals in one transaction from {'id': id, 'fields': {...}} changes.
+
+    See bulk_update for the per-id results and how `atomic` changes them.
+    """
+    results = bulk_update("Animal", WRITABLE, changes, atomic)
+
+    for result in results:
+        if result['status'] == 'updated':
+            CACHE.invalidate('animals', result['id'])
+    versions.bump('animals')
+
+    return results
+
+def delete_animals(ids=None, filters=None):
+    """
+    Delete many animals in one transaction, by id or by column filters.
+
+    """
+    results = bulk_delete("Animal", ids, filters)
+
+    for result in results:
+        if result['status'] == 'deleted':
+            CACHE.invalidate('animals', result['id'])
+    versions.bump('animals')
+
+    return results
+
 def get_animals_by_location(location_id):
     """
     get animals by location
 
     """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
+    with get_read_connection() as conn:
         db_cursor = conn.cursor()
+        db_cursor.row_factory = Animal.from_row
 
         # Write the SQL query to get the information you want,
         # including the JOIN with the Location table
@@ -208,44 +290,84 @@ def get_animals_by_location(location_id):
             a.location_id,
             a.customer_id,
             l.name location_name,
-            l.address location_address
+            l.address location_address,
             c.name customer_name,
             c.email customer_email
         FROM Animal a
-        JOIN Location l ON l.id = a.location_id
-        JOIN Customer c ON c.id = a.customer_id
+        LEFT JOIN Location l ON l.id = a.location_id
+        LEFT JOIN Customer c ON c.id = a.customer_id
         WHERE a.location_id = ?
+        ORDER BY a.id
         """, (location_id, ))
 
-        animals = []
         dataset = db_cursor.fetchall()
 
-        for row in dataset:
-            # Create a Customer instance from the current row
-            customer = {
-                'name': row['customer_name'],
-                'email': row['customer_email']
-            }
-
-            # Create an Animal instance from the current row
-            animal = Animal(row['id'],
-                            row['name'],
-                            row['breed'],
-                            row['status'],
-                            row['location_id'],
-                            row['customer_id'],
-                            customer)
-
-            # Create a Location instance from the current row
-            location = {
-                'name': row['location_name'],
-                'address': row['location_address']
-            }
-
-            # Assign the location dictionary to the Animal's 'location' property
-            animal.location = location
-
-            # Add the dictionary representation of the animal to the list
-            animals.append(animal.__dict__)
-
-    return animals
+    return [animal.to_dict() for animal in dataset]
+
+def get_animals_by_locations(location_ids):
+    """
+    Get the animals at any of `location_ids` in one query,
+    as (location id, animal) pairs
+
+    """
+    return [(animal.location_id, animal.to_dict())
+            for animal in iter_animals(query=FILTERS.any_of('location_id', location_ids))]
+
+def get_animals_by_customers(customer_ids):
+    """
+    Get the animals of any of `customer_ids` in one query,
+    as (customer id, animal) pairs
+
+    """
+    return [(animal.customer_id, animal.to_dict())
+            for animal in iter_animals(query=FILTERS.any_of('customer_id', customer_ids))]
+
+def search_animals(match, limit, offset=0, query=None):
+    """
+    Get one page of the animals whose name or breed matches, best match first
+
+    `match` is an FTS5 expression from search.match_expression, and
+    `query` an optional Filter from FILTERS.parse narrowing the matches.
+    """
+    conditions = ["AnimalSearch MATCH ?"]
+    params = [match]
+    join = ""
+    if query is not None and query.conditions:
+        # Filters are checked on each match before the page is cut
+        join = "JOIN Animal a ON a.id = AnimalSearch.rowid"
+        conditions.extend(query.conditions)
+        params.extend(query.params)
+
+    with get_read_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = Animal.from_row
+
+        # Rank inside the full-text index, then join only the page of matches
+        db_cursor.execute(f"""
+        SELECT
+            a.id,
+            a.name,
+            a.breed,
+            a.status,
+            a.location_id,
+            a.customer_id,
+            l.name AS location_name,
+            l.address AS location_address,
+            c.name AS customer_name,
+            c.email AS customer_email
+        FROM (
+            SELECT AnimalSearch.rowid AS id, AnimalSearch.rank AS rank
+            FROM AnimalSearch {join}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY AnimalSearch.rank, AnimalSearch.rowid
+            LIMIT ? OFFSET ?
+        ) m
+        JOIN Animal a ON a.id = m.id
+        LEFT JOIN Location l ON l.id = a.location_id
+        LEFT JOIN Customer c ON c.id = a.customer_id
+        ORDER BY m.rank, m.id
+        """, (*params, limit, offset))
+
+        dataset = db_cursor.fetchall()
+
+    return [animal.to_dict() for animal in dataset]
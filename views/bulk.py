@@ -0,0 +1,206 @@
+import sqlite3
+from .database import get_connection
+from .validation import field_errors
+
+# What sqlite raises for one bad item: a violated constraint, or a value of
+# a type it cannot bind
+ITEM_ERRORS = (sqlite3.IntegrityError, sqlite3.InterfaceError, sqlite3.ProgrammingError)
+
+
+class BulkError(Exception):
+    """
+    Raised when an all-or-nothing bulk write is rejected.
+
+    `errors` lists {'index': i, 'message': ...} for the offending items.
+    """
+    def __init__(self, message, errors):
+        super().__init__(message)
+        self.errors = errors
+
+
+def validate_items(items, columns):
+    """
+    Return an error for every item that is not an object with all `columns`,
+    each holding a value of its column's type.
+
+    """
+    errors = []
+    for (index, item) in enumerate(items):
+        problems = field_errors(item, columns)
+        if problems:
+            errors.append({'index': index, 'message': "; ".join(problems)})
+    return errors
+
+
+def failing_item(conn, sql, rows, error):
+    """
+    Find the first of `rows` that `sql` fails on, returning its error.
+
+    Only called after executemany failed, with its rows rolled back; the
+    rows inserted while searching are left for the caller to roll back.
+    `error` is reported if no row fails on its own.
+    """
+    for (index, row) in enumerate(rows):
+        try:
+            conn.execute(sql, row)
+        except ITEM_ERRORS as ex:
+            return {'index': index, 'message': str(ex)}
+    return {'index': None, 'message': str(error)}
+
+
+def bulk_insert(table, columns, items, atomic=True):
+    """
+    Insert `items` into `table` inside a single transaction.
+
+    `columns` maps each column to the (type, nullable) of its values, like
+    the WRITABLE of a views module.
+
+    With `atomic` every item is inserted with one executemany call and the
+    whole batch is rolled back if any item fails, raising BulkError for the
+    first failing item. The assigned ids are added to the items, in order,
+    and the items returned.
+
+    Without `atomic` each item runs inside its own savepoint, so a failing
+    item is rolled back alone. Returns one result per item in order: the
+    item with its new 'id', or {'index': i, 'error': message}.
+    """
+    errors = validate_items(items, columns)
+    if atomic and errors:
+        raise BulkError("no items were created", errors)
+    invalid = {error['index']: error['message'] for error in errors}
+
+    sql = (f"INSERT INTO {table} ( {', '.join(columns)} ) "
+           f"VALUES ( {', '.join('?' for _ in columns)} )")
+
+    with get_connection() as conn:
+        # Take the write lock up front so the batch commits exactly once
+        conn.execute("BEGIN IMMEDIATE")
+
+        if atomic:
+            rows = [tuple(item[column] for column in columns) for item in items]
+            conn.execute("SAVEPOINT bulk_batch")
+            try:
+                conn.executemany(sql, rows)
+            except ITEM_ERRORS as ex:
+                # Counting changed rows would also count the rows triggers
+                # write, so replay the batch one item at a time to name it
+                conn.execute("ROLLBACK TO SAVEPOINT bulk_batch")
+                raise BulkError("no items were created",
+                                [failing_item(conn, sql, rows, ex)]) from ex
+            conn.execute("RELEASE SAVEPOINT bulk_batch")
+
+            # Under the write lock AUTOINCREMENT hands out consecutive ids,
+            # so the batch ends at last_insert_rowid()
+            last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+            for (offset, item) in enumerate(items):
+                item['id'] = last_id - len(items) + 1 + offset
+            return items
+
+        results = []
+        for (index, item) in enumerate(items):
+            if index in invalid:
+                results.append({'index': index, 'error': invalid[index]})
+                continue
+            conn.execute("SAVEPOINT bulk_item")
+            try:
+                cursor = conn.execute(sql, tuple(item[column] for column in columns))
+            except ITEM_ERRORS as ex:
+                conn.execute("ROLLBACK TO SAVEPOINT bulk_item")
+                conn.execute("RELEASE SAVEPOINT bulk_item")
+                results.append({'index': index, 'error': str(ex)})
+                continue
+            conn.execute("RELEASE SAVEPOINT bulk_item")
+            item['id'] = cursor.lastrowid
+            results.append(item)
+        return results
+
+
+def bulk_update(table, columns, changes, atomic=True):
+    """
+    Apply a list of {'id': id, 'fields': {...}} changes in one transaction.
+
+    `columns` maps each writable column to the (type, nullable) of its
+    values. Returns one result per change, in order: {'id': id, 'status': ...}
+    where status is 'updated', 'not_found' or 'error' (with a 'message').
+    Each change runs in its own savepoint. With `atomic` any change that is
+    not 'updated' rolls back the whole batch and raises BulkError.
+    """
+    results = []
+
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+
+        for (index, change) in enumerate(changes):
+            if (not isinstance(change, dict) or not isinstance(change.get('id'), int)
+                    or not isinstance(change.get('fields'), dict) or not change['fields']):
+                results.append({'index': index, 'id': None, 'status': 'error',
+                                'message': "expected {\"id\": <int>, \"fields\": {...}}"})
+                continue
+
+            fields = change['fields']
+            unknown = [field for field in fields if field not in columns]
+            problems = [f"unknown fields {', '.join(unknown)}"] if unknown else []
+            problems += field_errors(fields, columns, partial=True)
+            if problems:
+                results.append({'index': index, 'id': change['id'], 'status': 'error',
+                                'message': "; ".join(problems)})
+                continue
+
+            assignments = ", ".join(f"{field} = ?" for field in fields)
+            conn.execute("SAVEPOINT bulk_item")
+            try:
+                cursor = conn.execute(f"UPDATE {table} SET {assignments} WHERE id = ?",
+                                      (*fields.values(), change['id']))
+            except ITEM_ERRORS as ex:
+                conn.execute("ROLLBACK TO SAVEPOINT bulk_item")
+                conn.execute("RELEASE SAVEPOINT bulk_item")
+                results.append({'index': index, 'id': change['id'], 'status': 'error',
+                                'message': str(ex)})
+                continue
+            conn.execute("RELEASE SAVEPOINT bulk_item")
+            results.append({'index': index, 'id': change['id'],
+                            'status': 'updated' if cursor.rowcount else 'not_found'})
+
+        if atomic and any(result['status'] != 'updated' for result in results):
+            conn.rollback()
+            raise BulkError("no items were updated",
+                            [result for result in results if result['status'] != 'updated'])
+
+    return results
+
+
+def bulk_delete(table, ids=None, filters=None):
+    """
+    Delete rows by id or by column filters in one transaction.
+
+    `filters` maps column names to lists of accepted values. Returns
+    {'id': id, 'status': 'deleted' | 'not_found'} for every requested id,
+    or one 'deleted' result per matching row when deleting by filter.
+    """
+    if ids is None and not filters:
+        raise ValueError("a bulk delete needs ids or at least one filter")
+
+    if ids is not None:
+        where = f"id IN ({', '.join('?' for _ in ids)})"
+        params = list(ids)
+    else:
+        clauses = []
+        params = []
+        for (column, values) in filters.items():
+            clauses.append(f"{column} IN ({', '.join('?' for _ in values)})")
+            params.extend(values)
+        where = " AND ".join(clauses)
+
+    with get_connection() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        found = [row[0] for row in conn.execute(f"SELECT id FROM {table} WHERE {where}",
+                                                params)]
+        if found:
+            conn.execute(f"DELETE FROM {table} WHERE {where}", params)
+
+    if ids is None:
+        return [{'id': id, 'status': 'deleted'} for id in found]
+
+    deleted = set(found)
+    return [{'id': id, 'status': 'deleted' if id in deleted else 'not_found'}
+            for id in ids]
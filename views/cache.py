@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from . import versions
+
+CACHE_SIZE = int(os.environ.get("KENNEL_CACHE_SIZE", 4096))
+CACHE_TTL = float(os.environ.get("KENNEL_CACHE_TTL", 30.0))
+
+
+class EntityCache():
+    """
+    An in-process LRU cache of single-entity lookups with a TTL.
+
+    Entries are keyed by (resource, id). An entry can depend on other
+    entities, e.g. an animal embeds its location and customer, so
+    invalidating ('locations', 2) also drops every cached animal that
+    embeds location 2. A size of 0 disables caching.
+
+    The cache is per process, but each entry is stamped with the version
+    counters of the tables it was read from (versions.DEPENDENCIES). They
+    are shared by every prefork worker, so an entry written before a write
+    in another worker is a miss, and never served under that write's ETag.
+    """
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._dependents = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def token(self):
+        """
+        Return a token to pass to `set` for a value about to be read.
+
+        If anything is invalidated between `token` and `set`, the value may
+        predate that write and is not cached. The token also holds the table
+        versions the entry is stamped with.
+        """
+        return (self._generation, versions.snapshot())
+
+    def get(self, resource, id):
+        """
+        Return the cached value for (resource, id), or None.
+
+        """
+        if self.max_size <= 0:
+            return None
+        key = (resource, id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            (value, expires, _, stamp) = entry
+            if (expires < time.monotonic()
+                    or stamp != versions.snapshot(versions.DEPENDENCIES[resource])):
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, resource, id, value, depends_on=(), token=None):
+        """
+        Cache `value` for (resource, id), tagged with the entities it embeds.
+
+        """
+        if self.max_size <= 0:
+            return
+        key = (resource, id)
+        (generation, counters) = token if token is not None else self.token()
+        read_at = dict(zip(versions.TABLES, counters))
+        stamp = tuple(read_at[table] for table in versions.DEPENDENCIES[resource])
+        with self._lock:
+            if generation != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            deps = tuple(depends_on)
+            self._entries[key] = (value, time.monotonic() + self.ttl, deps, stamp)
+            for dep in deps:
+                self._dependents.setdefault(dep, set()).add(key)
+            while len(self._entries) > self.max_size:
+                (oldest, _) = next(iter(self._entries.items()))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, resource, id):
+        """
+        Drop (resource, id) and every entry that embeds it.
+
+        """
+        key = (resource, id)
+        with self._lock:
+            self._generation += 1
+            self.invalidations += 1
+            self._remove(key)
+            for dependent in self._dependents.pop(key, ()):
+                self._remove(dependent)
+
+    def clear(self):
+        """
+        Drop every entry.
+
+        """
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._dependents.clear()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for dep in entry[2]:
+            dependents = self._dependents.get(dep)
+            if dependents is not None:
+                dependents.discard(key)
+                if not dependents:
+                    del self._dependents[dep]
+
+    def stats(self):
+        """
+        Return a snapshot of the cache counters.
+
+        """
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+CACHE = EntityCache()
+
+
+def configure(max_size=None, ttl=None):
+    """
+    Resize the shared cache or change its TTL, dropping every entry.
+
+    """
+    if max_size is not None:
+        CACHE.max_size = max_size
+    if ttl is not None:
+        CACHE.ttl = ttl
+    CACHE.clear()
+    return CACHE
@@ -1,29 +1,96 @@
 import sqlite3
+from . import versions
+from .bulk import bulk_insert, bulk_update, bulk_delete
+from .cache import CACHE
+from .database import get_read_connection, FETCH_SIZE
+from .pagination import keyset_clause
+from .projection import Column, Projection
+from .validation import Conflict, check_fields
+from .write_queue import execute_write
 from models import Customer
 
-CUSTOMERS = [
-    {
-        "id": 1,
-        "name": "Ryan Tanay",
-        "address": "123 4th St",
-        "email": "ryantanay@email.com",
-        "password": "password"
-    }
-]
+# The SQL behind each field of a customer, for sparse ?fields= selects
+COLUMNS = {
+    'id': Column("c.id"),
+    'name': Column("c.name"),
+    'address': Column("c.address"),
+    'email': Column("c.email"),
+    'password': Column("c.password")
+}
+
+# The columns clients write, with the type of their values and whether
+# they may be null
+WRITABLE = {
+    'name': (str, False),
+    'address': (str, False),
+    'email': (str, False),
+    'password': (str, False)
+}
+
+def get_all_customers(limit=None, after=None, fields=None):
+    """
+    Get all customers, optionally one keyset page of `limit` customers after id `after`
+
+    """
+    return [row.to_dict() for row in iter_customers(limit, after, fields)]
 
-def get_all_customers():
+def iter_customers(limit=None, after=None, fields=None):
     """
-    Get all customers
+    Yield Customer instances one at a time, reading the cursor FETCH_SIZE rows at a time
 
+    With `fields` only those fields are selected, as PartialRow dictionaries.
     """
+    (page_sql, page_params) = keyset_clause("c.id", after, limit)
+
     # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
+    with get_read_connection() as conn:
 
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
         db_cursor = conn.cursor()
 
-        # Write the SQL query to get the information you want
+        if fields is not None:
+            # Only the requested columns, and only the joins they need
+            projection = Projection(COLUMNS, fields)
+            db_cursor.row_factory = projection.row_factory
+            db_cursor.execute(f"""
+            SELECT {projection.select}
+            FROM Customer c {projection.joins}
+            """ + page_sql, page_params)
+        else:
+            # Map the cursor tuples straight into Customer instances
+            db_cursor.row_factory = Customer.from_row
+
+            # Write the SQL query to get the information you want
+            db_cursor.execute("""
+            SELECT
+                c.id,
+                c.name,
+                c.address,
+                c.email,
+                c.password
+            FROM Customer c
+            """ + page_sql, page_params)
+
+        # Read the rows in batches so memory does not grow with the table
+        dataset = db_cursor.fetchmany(FETCH_SIZE)
+
+        while dataset:
+            yield from dataset
+            dataset = db_cursor.fetchmany(FETCH_SIZE)
+
+def get_single_customer(id):
+    """
+    Get a single customer by ID.
+
+    """
+    cached = CACHE.get('customers', id)
+    if cached is not None:
+        return cached
+    token = CACHE.token()
+
+    with get_read_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = Customer.from_row
+
         db_cursor.execute("""
         SELECT
             c.id,
@@ -32,110 +99,113 @@ def get_all_customers():
             c.email,
             c.password
         FROM Customer c
-        """)
+        WHERE c.id = ?
+        """, (id, ))
 
-        # Initialize an empty list to hold all customer representations
-        customers = []
+        customer = db_cursor.fetchone()
 
-        # Convert rows of data into a Python list
-        dataset = db_cursor.fetchall()
+    if customer is None:
+        return None
 
-        # Iterate list of data returned from database
-        for row in dataset:
+    customer_dict = customer.to_dict()
 
-            # Create an customer instance from the current row.
-            # Note that the database fields are specified in
-            # exact order of the parameters defined in the
-            # Customer class above.
-            customer = Customer(row['id'],
-                                row['name'],
-                                row['address'],
-                                row['email'],
-                                row['password'])
+    CACHE.set('customers', id, customer_dict, token=token)
 
-            customers.append(customer.__dict__)
+    return customer_dict
 
-    return customers
-
-def get_single_customer(id):
+def duplicate_email(customer):
     """
-    Get a single customer by ID.
+    The Conflict of writing `customer` with an email another customer has.
 
+    Emails are unique through idx_customer_email (migration 0002).
     """
-    requested_customer = None
-
-    for customer in CUSTOMERS:
+    return Conflict(f"a customer with email {customer['email']} already exists")
 
-        if customer["id"] == id:
-            requested_customer = customer
-        return requested_customer
-
-def create_customer(customer):
+def create_customer(new_customer):
     """
-    Create a new customer and add it to the list of customers.
+    Create a new customer.
 
     Args:
-        customer (dict): A dictionary representing the new customer to be created.
+        new_customer (dict): A dictionary representing the new customer to be created.
 
     Returns:
         dict: The dictionary representing the new customer with the 'id' property added.
 
     """
-    # Get the id value of the last customer in the list
-    max_id = CUSTOMERS[-1]["id"]
+    check_fields(new_customer, WRITABLE)
+
+    try:
+        result = execute_write("""
+        INSERT INTO Customer
+            ( name, address, email, password )
+        VALUES
+            ( ?, ?, ?, ?);
+        """, (new_customer['name'], new_customer['address'],
+            new_customer['email'], new_customer['password'], ))
+    except sqlite3.IntegrityError as ex:
+        raise duplicate_email(new_customer) from ex
 
-    # Add 1 to whatever that number is
-    new_id = max_id + 1
+    # Add the `id` property to the customer dictionary so that
+    # the client sees the primary key in the response.
+    new_customer['id'] = result.lastrowid
 
-    # Add an `id` property to the customer dictionary
-    customer["id"] = new_id
+    versions.bump('customers')
 
-    # Add the customer dictionary to the list
-    CUSTOMERS.append(customer)
+    return new_customer
 
-    # Return the dictionary with `id` property added
-    return customer
+def create_customers(new_customers, atomic=True):
+    """
+    Create many customers in one transaction.
+
+    See bulk_insert for how `atomic` changes the handling of failed items.
+    """
+    results = bulk_insert("Customer", WRITABLE, new_customers, atomic)
+
+    versions.bump('customers')
+
+    return results
 
 def delete_customer(id):
     """
     delete customer
 
     """
-    # Initial -1 value for customer index, in case one isn't found
-    customer_index = -1
+    execute_write("""
+    DELETE FROM Customer
+    WHERE id = ?
+    """, (id, ))
 
-    # Iterate the CUSTOMERS list, but use enumerate() so that you
-    # can access the index value of each item
-    for index, customer in enumerate(CUSTOMERS):
-        if customer["id"] == id:
-            # Found the customer. Store the current index.
-            customer_index = index
-
-    # If the customer was found, use pop(int) to remove it from list
-    if customer_index >= 0:
-        CUSTOMERS.pop(customer_index)
+    # Also drops every cached animal that embeds this customer
+    CACHE.invalidate('customers', id)
+    versions.bump('customers')
 
 def update_customer(id, new_customer):
     """
     update customer
     """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
+    check_fields(new_customer, WRITABLE)
 
-        db_cursor.execute("""
+    try:
+        result = execute_write("""
         UPDATE Customer
             SET
                 name = ?,
                 address = ?,
                 email = ?,
-                password = ?,
+                password = ?
         WHERE id = ?
         """, (new_customer['name'], new_customer['address'],
                 new_customer['email'], new_customer['password'], id, ))
+    except sqlite3.IntegrityError as ex:
+        raise duplicate_email(new_customer) from ex
+
+    # Were any rows affected?
+    # Did the client send an `id` that exists?
+    rows_affected = result.rowcount
 
-        # Were any rows affected?
-        # Did the client send an `id` that exists?
-        rows_affected = db_cursor.rowcount
+    # Also drops every cached animal that embeds this customer
+    CACHE.invalidate('customers', id)
+    versions.bump('customers')
 
     if rows_affected == 0:
         # Forces 404 response by main module
@@ -144,14 +214,45 @@ def update_customer(id, new_customer):
         # Forces 204 response by main module
         return True
 
+def update_customers(changes, atomic=True):
+    """
+    Update many customers in one transaction from {'id': id, 'fields': {...}} changes.
+
+    See bulk_update for the per-id results and how `atomic` changes them.
+    """
+    results = bulk_update("Customer", WRITABLE, changes, atomic)
+
+    # Also drops every cached animal that embeds these customers
+    for result in results:
+        if result['status'] == 'updated':
+            CACHE.invalidate('customers', result['id'])
+    versions.bump('customers')
+
+    return results
+
+def delete_customers(ids=None, filters=None):
+    """
+    Delete many customers in one transaction, by id or by column filters.
+
+    """
+    results = bulk_delete("Customer", ids, filters)
+
+    # Also drops every cached animal that embeds these customers
+    for result in results:
+        if result['status'] == 'deleted':
+            CACHE.invalidate('customers', result['id'])
+    versions.bump('customers')
+
+    return results
+
 def get_customers_by_email(email):
     """
     get customers by email
 
     """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        conn.row_factory = sqlite3.Row
+    with get_read_connection() as conn:
         db_cursor = conn.cursor()
+        db_cursor.row_factory = Customer.from_row
 
         # Write the SQL query to get the information you want
         db_cursor.execute("""
@@ -165,15 +266,62 @@ def get_customers_by_email(email):
         WHERE c.email = ?
         """, ( email, ))
 
-        customers = []
         dataset = db_cursor.fetchall()
 
-        for row in dataset:
-            customer = Customer(row['id'],
-                                row['name'],
-                                row['address'],
-                                row['email'] ,
-                                row['password'])
-            customers.append(customer.__dict__)
+    return [customer.to_dict() for customer in dataset]
+
+def get_customers_by_ids(ids):
+    """
+    Get the customers with any of `ids` in one query, as (id, customer) pairs
+
+    """
+    with get_read_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = Customer.from_row
+
+        db_cursor.execute(f"""
+        SELECT
+            c.id,
+            c.name,
+            c.address,
+            c.email,
+            c.password
+        FROM Customer c
+        WHERE c.id IN ({', '.join('?' for _ in ids)})
+        """, tuple(ids))
+
+        dataset = db_cursor.fetchall()
+
+    return [(customer.id, customer.to_dict()) for customer in dataset]
+
+def search_customers(match, limit, offset=0):
+    """
+    Get one page of the customers whose name or address matches, best match first
+
+    `match` is an FTS5 expression from search.match_expression.
+    """
+    with get_read_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = Customer.from_row
+
+        db_cursor.execute("""
+        SELECT
+            c.id,
+            c.name,
+            c.address,
+            c.email,
+            c.password
+        FROM (
+            SELECT rowid AS id, rank
+            FROM CustomerSearch
+            WHERE CustomerSearch MATCH ?
+            ORDER BY rank, rowid
+            LIMIT ? OFFSET ?
+        ) m
+        JOIN Customer c ON c.id = m.id
+        ORDER BY m.rank, m.id
+        """, (match, limit, offset))
+
+        dataset = db_cursor.fetchall()
 
-    return customers
+    return [customer.to_dict() for customer in dataset]
@@ -0,0 +1,423 @@
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+import metrics
+
+DB_PATH = os.environ.get("KENNEL_DB_PATH", "./kennel.sqlite3")
+POOL_SIZE = int(os.environ.get("KENNEL_POOL_SIZE", 8))
+POOL_TIMEOUT = float(os.environ.get("KENNEL_POOL_TIMEOUT", 5.0))
+FETCH_SIZE = 500
+
+# PRAGMA synchronous levels, from fastest to most durable. None keeps the
+# sqlite default (FULL).
+SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+SYNCHRONOUS = os.environ.get("KENNEL_SYNCHRONOUS") or None
+
+# Set once at startup. In WAL mode readers never block the writer and the
+# writer never blocks readers, so GETs keep flowing during write bursts.
+JOURNAL_MODES = ('WAL', 'DELETE', 'TRUNCATE', 'PERSIST')
+JOURNAL_MODE = os.environ.get("KENNEL_JOURNAL_MODE", "WAL").upper()
+
+# Seconds a connection waits on a locked database before raising
+BUSY_TIMEOUT = float(os.environ.get("KENNEL_BUSY_TIMEOUT", 5.0))
+
+# WAL pages after which a committing writer checkpoints (0 disables), and
+# seconds between background checkpoints (0 disables)
+WAL_AUTOCHECKPOINT = int(os.environ.get("KENNEL_WAL_AUTOCHECKPOINT", 1000))
+CHECKPOINT_INTERVAL = float(os.environ.get("KENNEL_CHECKPOINT_INTERVAL", 0))
+
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    A cursor whose statements and fetches count towards the DB time of the
+    request running on the calling thread.
+
+    Rows are built by the row factory inside the fetch calls, so mapping
+    rows to models is DB time too.
+    """
+    def execute(self, sql, parameters=()):
+        """
+        Execute one statement, timed.
+
+        """
+        start = metrics.clock()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            metrics.add_db(metrics.clock() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        """
+        Execute one statement for every set of parameters, timed.
+
+        """
+        start = metrics.clock()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.add_db(metrics.clock() - start)
+
+    def fetchone(self):
+        """
+        Fetch the next row, timed.
+
+        """
+        start = metrics.clock()
+        try:
+            return super().fetchone()
+        finally:
+            metrics.add_db(metrics.clock() - start)
+
+    def fetchmany(self, size=None):
+        """
+        Fetch the next `size` rows (default arraysize), timed.
+
+        """
+        start = metrics.clock()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            metrics.add_db(metrics.clock() - start)
+
+    def fetchall(self):
+        """
+        Fetch every remaining row, timed.
+
+        """
+        start = metrics.clock()
+        try:
+            return super().fetchall()
+        finally:
+            metrics.add_db(metrics.clock() - start)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    A connection whose cursors are TimedCursors.
+
+    """
+    def cursor(self, factory=None):
+        """
+        Open a TimedCursor, or a cursor of `factory` when one is given.
+
+        """
+        return super().cursor(factory or TimedCursor)
+
+    def execute(self, sql, parameters=()):
+        """
+        Execute one statement on a new TimedCursor.
+
+        """
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        """
+        Execute one statement per set of parameters on a new TimedCursor.
+
+        """
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def connect(path, readonly=False, synchronous=None, **kwargs):
+    """
+    Open a connection with the configured busy timeout and pragmas.
+
+    Read-only connections use a `mode=ro` URI, so sqlite itself rejects any
+    write made on them. Connections are TimedConnections, for /metrics.
+    Opening a writable connection starts the background checkpointer of
+    this process, if one is configured.
+    """
+    if readonly:
+        uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+        return sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT,
+                               factory=TimedConnection, **kwargs)
+
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, factory=TimedConnection, **kwargs)
+    if synchronous is not None:
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+    conn.execute(f"PRAGMA wal_autocheckpoint = {WAL_AUTOCHECKPOINT}")
+    if CHECKPOINTER is not None:
+        CHECKPOINTER.start()
+    return conn
+
+
+class PoolExhausted(Exception):
+    """
+    Raised when no connection could be checked out before the timeout.
+
+    """
+
+
+class ConnectionPool():
+    """
+    A bounded pool of sqlite connections shared by every views module.
+
+    Connections are checked out for the duration of one request and
+    returned afterwards, so the connection setup, schema parsing and page
+    cache warmup only happen once per pooled connection. A size of 0
+    disables pooling and opens a fresh connection for every checkout.
+    `synchronous` sets the durability of commits made on its connections,
+    and a `readonly` pool opens connections that cannot write.
+    """
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, timeout=POOL_TIMEOUT,
+                 synchronous=SYNCHRONOUS, readonly=False):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.synchronous = synchronous
+        self.readonly = readonly
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size) if size > 0 else None
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def _connect(self):
+        conn = connect(self.path, self.readonly, self.synchronous, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def _is_healthy(self, conn):
+        try:
+            conn.execute("SELECT 1").fetchone()
+        except sqlite3.Error:
+            return False
+        return True
+
+    def checkout(self):
+        """
+        Take a connection from the pool, opening one if none are idle.
+
+        """
+        if self._slots is None:
+            return self._connect()
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolExhausted(f"no connection available after {self.timeout}s")
+
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+
+                if self._is_healthy(conn):
+                    return conn
+                self._discard(conn)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def checkin(self, conn, broken=False):
+        """
+        Return a connection to the pool.
+
+        """
+        if self._slots is None:
+            conn.close()
+            return
+
+        if broken or conn.in_transaction:
+            self._discard(conn)
+        else:
+            conn.row_factory = sqlite3.Row
+            self._idle.put(conn)
+        self._slots.release()
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        Check out a connection for the body of a `with` block.
+
+        Mirrors `with sqlite3.connect(...) as conn`: the transaction is
+        committed when the block exits cleanly and rolled back otherwise.
+        """
+        conn = self.checkout()
+        broken = False
+        try:
+            with conn:
+                yield conn
+        except sqlite3.DatabaseError:
+            broken = True
+            raise
+        finally:
+            self.checkin(conn, broken)
+
+    def close(self):
+        """
+        Close every idle connection.
+
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
+
+    def stats(self):
+        """
+        Return a snapshot of the pool counters.
+
+        """
+        return {
+            'path': self.path,
+            'size': self.size,
+            'readonly': self.readonly,
+            'idle': self._idle.qsize(),
+            'created': self._created
+        }
+
+
+class Checkpointer():
+    """
+    Run a PASSIVE WAL checkpoint every `interval` seconds on its own thread.
+
+    Moves checkpoint work off the request path; combine with a large or
+    disabled WAL_AUTOCHECKPOINT so committing writers rarely checkpoint.
+    """
+    def __init__(self, path, interval):
+        self.path = path
+        self.interval = interval
+        self.runs = 0
+        self.last = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Start the checkpoint thread unless it is already running.
+
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="kennel-checkpoint",
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        try:
+            while not self._stopped.wait(self.interval):
+                try:
+                    # (busy, pages in the WAL, pages checkpointed)
+                    self.last = tuple(conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone())
+                except sqlite3.Error:
+                    continue
+                self.runs += 1
+        finally:
+            conn.close()
+
+    def stop(self):
+        """
+        Stop the checkpoint thread.
+
+        """
+        self._stopped.set()
+
+
+def make_checkpointer(path):
+    """
+    Return a Checkpointer for `path` if background checkpoints are enabled.
+
+    """
+    if CHECKPOINT_INTERVAL > 0 and JOURNAL_MODE == 'WAL':
+        return Checkpointer(path, CHECKPOINT_INTERVAL)
+    return None
+
+
+# Writes go through a single writer connection; GETs use the read-only pool
+CHECKPOINTER = make_checkpointer(DB_PATH)
+POOL = ConnectionPool(size=min(POOL_SIZE, 1))
+READ_POOL = ConnectionPool(readonly=True)
+
+
+def configure(path=None, size=None, timeout=None, synchronous=None, journal_mode=None,
+              busy_timeout=None, wal_autocheckpoint=None, checkpoint_interval=None):
+    """
+    Replace the shared pools, e.g. to point the views at another database.
+
+    `size` is the number of read-only connections; writes always share one
+    writer connection per process (none is kept when `size` is 0).
+    """
+    global POOL, READ_POOL, CHECKPOINTER, JOURNAL_MODE, BUSY_TIMEOUT
+    global WAL_AUTOCHECKPOINT, CHECKPOINT_INTERVAL
+    if journal_mode is not None:
+        JOURNAL_MODE = journal_mode
+    if busy_timeout is not None:
+        BUSY_TIMEOUT = busy_timeout
+    if wal_autocheckpoint is not None:
+        WAL_AUTOCHECKPOINT = wal_autocheckpoint
+    if checkpoint_interval is not None:
+        CHECKPOINT_INTERVAL = checkpoint_interval
+
+    old = (POOL, READ_POOL, CHECKPOINTER)
+    path = path if path is not None else old[1].path
+    size = size if size is not None else old[1].size
+    timeout = timeout if timeout is not None else old[1].timeout
+    synchronous = synchronous if synchronous is not None else old[0].synchronous
+
+    CHECKPOINTER = make_checkpointer(path)
+    POOL = ConnectionPool(path, min(size, 1), timeout, synchronous)
+    READ_POOL = ConnectionPool(path, size, timeout, synchronous, readonly=True)
+    for pool in old[:2]:
+        pool.close()
+    if old[2] is not None:
+        old[2].stop()
+    return POOL
+
+
+def set_journal_mode(mode=None):
+    """
+    Switch the database to `mode` (default JOURNAL_MODE), returning the mode now in effect.
+
+    The journal mode is stored in the database file, so this runs once at
+    startup, before any read-only connection is opened.
+    """
+    conn = sqlite3.connect(POOL.path, timeout=BUSY_TIMEOUT, isolation_level=None)
+    try:
+        return conn.execute(f"PRAGMA journal_mode = {mode or JOURNAL_MODE}").fetchone()[0].upper()
+    finally:
+        conn.close()
+
+
+def get_connection():
+    """
+    Check out the writer connection, for views that change the database.
+
+    """
+    return POOL.connection()
+
+
+def get_read_connection():
+    """
+    Check out a read-only connection from the shared pool.
+
+    """
+    return READ_POOL.connection()
+
+
+def _reset_after_fork():
+    # sqlite connections must never be shared across a fork, so a child
+    # process starts with empty pools and no checkpoint thread of its own.
+    global POOL, READ_POOL, CHECKPOINTER
+    POOL = ConnectionPool(POOL.path, POOL.size, POOL.timeout, POOL.synchronous)
+    READ_POOL = ConnectionPool(READ_POOL.path, READ_POOL.size, READ_POOL.timeout,
+                               READ_POOL.synchronous, readonly=True)
+    CHECKPOINTER = make_checkpointer(POOL.path)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -1,131 +1,193 @@
-import sqlite3
+from . import versions
+from .bulk import bulk_insert, bulk_update, bulk_delete
+from .cache import CACHE
+from .database import get_read_connection, FETCH_SIZE
+from .pagination import keyset_clause
+from .projection import Column, Projection
+from .validation import check_fields
+from .write_queue import execute_write
 from models import Employee
 
-EMPLOYEES = [
-    {
-        "id": 1,
-        "name": "Jenna Solis"
-    }
-]
+# The SQL behind each field of an employee, for sparse ?fields= selects
+COLUMNS = {
+    'id': Column("e.id"),
+    'name': Column("e.name"),
+    'location': Column(("l.name", "l.address"), ('name', 'address'),
+                       "LEFT JOIN Location l ON l.id = e.location_id")
+}
 
-def get_all_employees():
+# The columns clients write, with the type of their values and whether
+# they may be null
+WRITABLE = {
+    'name': (str, False),
+    'address': (str, False),
+    'location_id': (int, False)
+}
+
+def get_all_employees(limit=None, after=None, fields=None):
+    """
+    Get all employees, optionally one keyset page of `limit` employees after id `after`
+
+    """
+    return [row.to_dict() for row in iter_employees(limit, after, fields)]
+
+def iter_employees(limit=None, after=None, fields=None):
     """
-    Get all employees
+    Yield Employee instances one at a time, reading the cursor FETCH_SIZE rows at a time
 
+    With `fields` only those fields are selected, as PartialRow dictionaries.
     """
+    (page_sql, page_params) = keyset_clause("e.id", after, limit)
+
     # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
+    with get_read_connection() as conn:
+
+        db_cursor = conn.cursor()
+
+        if fields is not None:
+            # Only the requested columns, and only the joins they need
+            projection = Projection(COLUMNS, fields)
+            db_cursor.row_factory = projection.row_factory
+            db_cursor.execute(f"""
+            SELECT {projection.select}
+            FROM Employee e {projection.joins}
+            """ + page_sql, page_params)
+        else:
+            # Map the cursor tuples straight into Employee instances
+            db_cursor.row_factory = Employee.from_row
+
+            # Write the SQL query to get the information you want
+            db_cursor.execute("""
+            SELECT
+                e.id,
+                e.name,
+                e.location_id,
+                l.name location_name,
+                l.address location_address
+            FROM Employee e
+            LEFT JOIN Location l ON l.id = e.location_id
+            """ + page_sql, page_params)
 
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
+        dataset = db_cursor.fetchmany(FETCH_SIZE)
+
+        while dataset:
+            yield from dataset
+            dataset = db_cursor.fetchmany(FETCH_SIZE)
+
+def get_single_employee(id):
+    """
+    Get a single employee by ID.
+
+    """
+    cached = CACHE.get('employees', id)
+    if cached is not None:
+        return cached
+    token = CACHE.token()
+
+    with get_read_connection() as conn:
         db_cursor = conn.cursor()
+        db_cursor.row_factory = Employee.from_row
 
-        # Write the SQL query to get the information you want
         db_cursor.execute("""
         SELECT
             e.id,
             e.name,
+            e.location_id,
             l.name location_name,
             l.address location_address
         FROM Employee e
-        JOIN Location l ON l.id = e.location_id
-        """)
+        LEFT JOIN Location l ON l.id = e.location_id
+        WHERE e.id = ?
+        """, (id, ))
 
-        employees = []
-        dataset = db_cursor.fetchall()
+        employee = db_cursor.fetchone()
 
-    for row in dataset:
-        # Create a Location instance from the current row
-        location = {
-            'name': row['location_name'],
-            'address': row['location_address']
-            }
+    if employee is None:
+        return None
 
-        # Create an Employee instance from the current row
-        employee = Employee(
-            row['id'],
-            row['name'],
-            location  # Pass the location dictionary to the Employee's 'location' property
-            )
+    employee_dict = employee.to_dict()
 
-        employees.append(employee.__dict__)
+    # The cached employee embeds its location
+    CACHE.set('employees', id, employee_dict,
+              depends_on=[('locations', employee.location.id)],
+              token=token)
 
-    return employees
+    return employee_dict
 
-def get_single_employee(id):
+def create_employee(new_employee):
     """
-    Get a single employee by ID.
-
-    """
-    requested_employee = None
-
-    for employee in EMPLOYEES:
-        if employee["id"] == id:
-            requested_employee = employee
-    return requested_employee
-
-def create_employee(employee):
-    """
-    Create a new employee and add it to the list of employees.
+    Create a new employee.
 
     Args:
-        employee (dict): A dictionary representing the new employee to be created.
+        new_employee (dict): A dictionary representing the new employee to be created.
 
     Returns:
         dict: The dictionary representing the new employee with the 'id' property added.
 
     """
-    # Get the id value of the last employee in the list
-    max_id = EMPLOYEES[-1]["id"]
+    check_fields(new_employee, WRITABLE)
+
+    result = execute_write("""
+    INSERT INTO Employee
+        ( name, address, location_id )
+    VALUES
+        ( ?, ?, ?);
+    """, (new_employee['name'], new_employee['address'],
+        new_employee['location_id'], ))
 
-    # Add 1 to whatever that number is
-    new_id = max_id + 1
+    # Add the `id` property to the employee dictionary so that
+    # the client sees the primary key in the response.
+    new_employee['id'] = result.lastrowid
 
-    # Add an `id` property to the employee dictionary
-    employee["id"] = new_id
+    versions.bump('employees')
 
-    # Add the employee dictionary to the list
-    EMPLOYEES.append(employee)
+    return new_employee
 
-    # Return the dictionary with `id` property added
-    return employee
+def create_employees(new_employees, atomic=True):
+    """
+    Create many employees in one transaction.
+
+    See bulk_insert for how `atomic` changes the handling of failed items.
+    """
+    results = bulk_insert("Employee", WRITABLE, new_employees, atomic)
+
+    versions.bump('employees')
+
+    return results
 
 def delete_employee(id):
     """
     delete employee
 
     """
-    # Initial -1 value for employee index, in case one isn't found
-    employee_index = -1
-
-    # Iterate the EMPLOYEES list, but use enumerate() so that you
-    # can access the index value of each item
-    for index, employee in enumerate(EMPLOYEES):
-        if employee["id"] == id:
-            # Found the employee. Store the current index.
-            employee_index = index
+    execute_write("""
+    DELETE FROM Employee
+    WHERE id = ?
+    """, (id, ))
 
-    # If the employee was found, use pop(int) to remove it from list
-    if employee_index >= 0:
-        EMPLOYEES.pop(employee_index)
+    CACHE.invalidate('employees', id)
+    versions.bump('employees')
 
 def update_employee(id, new_employee):
     """
     update employee
     """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
+    # Only the name of an employee can be replaced
+    check_fields(new_employee, {'name': WRITABLE['name']})
 
-        db_cursor.execute("""
-        UPDATE Employee
-            SET
-                name = ?,
-        WHERE id = ?
-        """, (new_employee['name'], id, ))
+    result = execute_write("""
+    UPDATE Employee
+        SET
+            name = ?
+    WHERE id = ?
+    """, (new_employee['name'], id, ))
 
-        # Were any rows affected?
-        # Did the client send an `id` that exists?
-        rows_affected = db_cursor.rowcount
+    # Were any rows affected?
+    # Did the client send an `id` that exists?
+    rows_affected = result.rowcount
+
+    CACHE.invalidate('employees', id)
+    versions.bump('employees')
 
     if rows_affected == 0:
         # Forces 404 response by main module
@@ -133,4 +195,92 @@ def update_employee(id, new_employee):
     else:
         # Forces 204 response by main module
         return True
-    
\ No newline at end of file
+
+def update_employees(changes, atomic=True):
+    """
+    Update many employees in one transaction from {'id': id, 'fields': {...}} changes.
+
+    See bulk_update for the per-id results and how `atomic` changes them.
+    """
+    results = bulk_update("Employee", WRITABLE, changes, atomic)
+
+    for result in results:
+        if result['status'] == 'updated':
+            CACHE.invalidate('employees', result['id'])
+    versions.bump('employees')
+
+    return results
+
+def delete_employees(ids=None, filters=None):
+    """
+    Delete many employees in one transaction, by id or by column filters.
+
+    """
+    results = bulk_delete("Employee", ids, filters)
+
+    for result in results:
+        if result['status'] == 'deleted':
+            CACHE.invalidate('employees', result['id'])
+    versions.bump('employees')
+
+    return results
+
+def get_employees_by_locations(location_ids):
+    """
+    Get the employees at any of `location_ids` in one query,
+    as (location id, employee) pairs
+
+    """
+    with get_read_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = Employee.from_row
+
+        db_cursor.execute(f"""
+        SELECT
+            e.id,
+            e.name,
+            e.location_id,
+            l.name location_name,
+            l.address location_address
+        FROM Employee e
+        LEFT JOIN Location l ON l.id = e.location_id
+        WHERE e.location_id IN ({', '.join('?' for _ in location_ids)})
+        ORDER BY e.id
+        """, tuple(location_ids))
+
+        dataset = db_cursor.fetchall()
+
+    return [(employee.location.id, employee.to_dict()) for employee in dataset]
+
+def search_employees(match, limit, offset=0):
+    """
+    Get one page of the employees whose name matches, best match first
+
+    `match` is an FTS5 expression from search.match_expression.
+    """
+    with get_read_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = Employee.from_row
+
+        db_cursor.execute("""
+        SELECT
+            e.id,
+            e.name,
+            e.location_id,
+            l.name location_name,
+            l.address location_address
+        FROM (
+            SELECT rowid AS id, rank
+            FROM EmployeeSearch
+            WHERE EmployeeSearch MATCH ?
+            ORDER BY rank, rowid
+            LIMIT ? OFFSET ?
+        ) m
+        JOIN Employee e ON e.id = m.id
+        LEFT JOIN Location l ON l.id = e.location_id
+        ORDER BY m.rank, m.id
+        """, (match, limit, offset))
+
+        dataset = db_cursor.fetchall()
+
+    return [employee.to_dict() for employee in dataset]
@@ -0,0 +1,158 @@
+"""
+Query-string filters and sorting compiled to parameterized SQL.
+
+    ?status=Kennel                 equality
+    ?status=Kennel,Treatment       any of the values (IN)
+    ?location_id_gte=2             range, also _lte, _gt and _lt
+    ?_sort=name&_order=desc        order by a field, then by id
+
+Only whitelisted columns are ever written into the SQL; every value is a
+parameter. Pages stay keyset pages when sorting: the `after` id is the
+last row of the previous page and the seek compares (sort value, id)
+against that row, so a sorted page is read straight from an index on the
+sort column.
+"""
+RANGE_OPERATORS = {
+    'gte': '>=',
+    'lte': '<=',
+    'gt': '>',
+    'lt': '<'
+}
+
+
+class Filter():
+    """
+    The compiled conditions and order of one request.
+
+    """
+    def __init__(self, conditions=(), params=(), sort=None, descending=False):
+        self.conditions = list(conditions)
+        self.params = list(params)
+        self.sort = sort
+        self.descending = descending
+
+
+class FilterSet():
+    """
+    The fields of one table that may be filtered and sorted on.
+
+    `filters` maps a query parameter to its (column, type), where type
+    converts the raw values (int or str). `sortable` maps the fields
+    accepted by ?_sort= to their columns. Sort columns must be NOT NULL,
+    since a NULL would drop out of the keyset comparison.
+    """
+    def __init__(self, table, alias, filters, sortable):
+        self.table = table
+        self.alias = alias
+        self.filters = filters
+        self.sortable = sortable
+
+    def parse(self, query, reserved=()):
+        """
+        Compile a parsed query string into a Filter.
+
+        Parameters in `reserved` belong to the caller and are skipped.
+        Returns None when the query neither filters nor sorts. Raises
+        ValueError for unknown parameters and malformed values.
+        """
+        result = Filter()
+        for (param, items) in query.items():
+            if param in reserved:
+                continue
+            if param == '_sort':
+                if items[-1] not in self.sortable:
+                    raise ValueError(f"cannot sort on {items[-1]}; "
+                                     f"sort on {', '.join(self.sortable)}")
+                result.sort = items[-1]
+                continue
+            if param == '_order':
+                if items[-1] not in ('asc', 'desc'):
+                    raise ValueError("_order must be asc or desc")
+                result.descending = items[-1] == 'desc'
+                continue
+
+            (name, _, suffix) = param.rpartition('_')
+            if suffix in RANGE_OPERATORS and name in self.filters:
+                operator = RANGE_OPERATORS[suffix]
+            else:
+                (name, operator) = (param, None)
+            if name not in self.filters:
+                raise ValueError(f"cannot filter on {param}; "
+                                 f"filter on {', '.join(self.filters)}")
+
+            (column, kind) = self.filters[name]
+            try:
+                values = [kind(value) for item in items
+                          for value in item.split(',') if value]
+            except ValueError as ex:
+                raise ValueError(f"{param} must be a list of integers") from ex
+            if not values:
+                continue
+
+            if operator is not None:
+                # Repeated bounds must all hold, e.g. ?id_gt=1&id_gt=5
+                for value in values:
+                    result.conditions.append(f"{column} {operator} ?")
+                    result.params.append(value)
+            elif len(values) == 1:
+                result.conditions.append(f"{column} = ?")
+                result.params.append(values[0])
+            else:
+                result.conditions.append(
+                    f"{column} IN ({', '.join('?' for _ in values)})")
+                result.params.extend(values)
+
+        if not result.conditions and result.sort is None and not result.descending:
+            return None
+        return result
+
+    def any_of(self, field, values):
+        """
+        A Filter matching rows whose `field` is any of `values`.
+
+        """
+        (column, _) = self.filters[field]
+        return Filter([f"{column} IN ({', '.join('?' for _ in values)})"], values)
+
+    def clause(self, query=None, after=None, limit=None):
+        """
+        Build the WHERE, ORDER BY and LIMIT tail of a SELECT from this table.
+
+        `query` is a Filter from `parse` or None. Without one this is the
+        same keyset tail as `pagination.keyset_clause`. Returns the SQL
+        fragment and its parameters.
+        """
+        query = query or Filter()
+        conditions = list(query.conditions)
+        params = list(query.params)
+
+        id_column = f"{self.alias}.id"
+        sort = self.sortable.get(query.sort, 'id')
+        comparison = "<" if query.descending else ">"
+
+        if after is not None:
+            if sort == 'id':
+                conditions.append(f"{id_column} {comparison} ?")
+                params.append(after)
+            else:
+                # Seek past the (sort value, id) of the last row already read
+                conditions.append(
+                    f"({self.alias}.{sort}, {id_column}) {comparison} "
+                    f"((SELECT {sort} FROM {self.table} WHERE id = ?), ?)")
+                params.extend((after, after))
+
+        sql = ""
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+
+        direction = " DESC" if query.descending else ""
+        order = [f"{id_column}{direction}"]
+        if sort != 'id':
+            order.insert(0, f"{self.alias}.{sort}{direction}")
+        sql += " ORDER BY " + ", ".join(order)
+
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        return (sql, tuple(params))
@@ -1,127 +1,178 @@
-import sqlite3
+from . import versions
+from .bulk import bulk_insert, bulk_update, bulk_delete
+from .cache import CACHE
+from .database import get_read_connection, FETCH_SIZE
+from .pagination import keyset_clause
+from .projection import Column, Projection
+from .validation import check_fields
+from .write_queue import execute_write
 from models import Location
 
-LOCATIONS = [
-    {
-        "id": 1,
-        "name": "Nashville North",
-        "address": "8422 Johnson Pike"
-    },
-    {
-        "id": 2,
-        "name": "Nashville South",
-        "address": "209 Emory Drive"
-    }
-]
+# The SQL behind each field of a location, for sparse ?fields= selects
+COLUMNS = {
+    'id': Column("l.id"),
+    'name': Column("l.name"),
+    'address': Column("l.address")
+}
+
+# The columns clients write, with the type of their values and whether
+# they may be null
+WRITABLE = {
+    'name': (str, False),
+    'address': (str, False)
+}
+
+def get_all_locations(limit=None, after=None, fields=None):
+    """
+    Get all locations, optionally one keyset page of `limit` locations after id `after`
 
-def get_all_locations():
     """
-    Get all locations
+    return [row.to_dict() for row in iter_locations(limit, after, fields)]
 
+def iter_locations(limit=None, after=None, fields=None):
     """
+    Yield Location instances one at a time, reading the cursor FETCH_SIZE rows at a time
+
+    With `fields` only those fields are selected, as PartialRow dictionaries.
+    """
+    (page_sql, page_params) = keyset_clause("l.id", after, limit)
+
     # Open a connection to the database
-    with sqlite3.connect("./kennel.sqlite3") as conn:
+    with get_read_connection() as conn:
 
-        # Just use these. It's a Black Box.
-        conn.row_factory = sqlite3.Row
         db_cursor = conn.cursor()
 
-        # Write the SQL query to get the information you want
+        if fields is not None:
+            # Only the requested columns, and only the joins they need
+            projection = Projection(COLUMNS, fields)
+            db_cursor.row_factory = projection.row_factory
+            db_cursor.execute(f"""
+            SELECT {projection.select}
+            FROM Location l {projection.joins}
+            """ + page_sql, page_params)
+        else:
+            # Map the cursor tuples straight into Location instances
+            db_cursor.row_factory = Location.from_row
+
+            # Write the SQL query to get the information you want
+            db_cursor.execute("""
+            SELECT
+                l.id,
+                l.name,
+                l.address
+            FROM Location l
+            """ + page_sql, page_params)
+
+        # Read the rows in batches so memory does not grow with the table
+        dataset = db_cursor.fetchmany(FETCH_SIZE)
+
+        while dataset:
+            yield from dataset
+            dataset = db_cursor.fetchmany(FETCH_SIZE)
+
+def get_single_location(id):
+    """
+    Get a single location by ID.
+
+    """
+    cached = CACHE.get('locations', id)
+    if cached is not None:
+        return cached
+    token = CACHE.token()
+
+    with get_read_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = Location.from_row
+
         db_cursor.execute("""
         SELECT
             l.id,
             l.name,
             l.address
         FROM Location l
-        """)
-
-        # Initialize an empty list to hold all location representations
-        locations = []
+        WHERE l.id = ?
+        """, (id, ))
 
-        # Convert rows of data into a Python list
-        dataset = db_cursor.fetchall()
+        location = db_cursor.fetchone()
 
-        # Iterate list of data returned from database
-        for row in dataset:
+    if location is None:
+        return None
 
-            # Create an location instance from the current row.
-            # Note that the database fields are specified in
-            # exact order of the parameters defined in the
-            # Location class above.
-            location = Location(row['id'], row['name'], row['address'])
+    location_dict = location.to_dict()
 
-            locations.append(location.__dict__)
+    CACHE.set('locations', id, location_dict, token=token)
 
-    return locations
+    return location_dict
 
-def get_single_location(id):
+def create_location(new_location):
     """
-    Get a single location by ID.
+    Create a new location.
 
     """
-    requested_location = None
-    for location in LOCATIONS:
-        if location["id"] == id:
-            requested_location = location
-        return requested_location
+    check_fields(new_location, WRITABLE)
 
-def create_location(location):
-    """
-    Create a new location and add it to the list of locations.
+    result = execute_write("""
+    INSERT INTO Location
+        ( name, address )
+    VALUES
+        ( ?, ?);
+    """, (new_location['name'], new_location['address'], ))
 
-    """
-    # Get the id value of the last location in the list
-    max_id = LOCATIONS[-1]["id"]
+    # Add the `id` property to the location dictionary so that
+    # the client sees the primary key in the response.
+    new_location['id'] = result.lastrowid
+
+    versions.bump('locations')
 
-    # Add 1 to whatever that number is
-    new_id = max_id + 1
+    return new_location
 
-    # Add an `id` property to the location dictionary
-    location["id"] = new_id
+def create_locations(new_locations, atomic=True):
+    """
+    Create many locations in one transaction.
+
+    See bulk_insert for how `atomic` changes the handling of failed items.
+    """
+    results = bulk_insert("Location", WRITABLE, new_locations, atomic)
 
-    # Add the location dictionary to the list
-    LOCATIONS.append(location)
+    versions.bump('locations')
 
-    # Return the dictionary with `id` property added
-    return location
+    return results
 
 def delete_location(id):
     """
     delete location
 
     """
-    # Initial -1 value for location index, in case one isn't found
-    location_index = -1
+    execute_write("""
+    DELETE FROM Location
+    WHERE id = ?
+    """, (id, ))
 
-    # Iterate the LOCATIONS list, but use enumerate() so that you
-    # can access the index value of each item
-    for index, location in enumerate(LOCATIONS):
-        if location["id"] == id:
-            # Found the location. Store the current index.
-            location_index = index
-
-    # If the location was found, use pop(int) to remove it from list
-    if location_index >= 0:
-        LOCATIONS.pop(location_index)
+    # Also drops every cached animal and employee that embeds this location
+    CACHE.invalidate('locations', id)
+    versions.bump('locations')
 
 def update_location(id, new_location):
     """
     update location
     """
-    with sqlite3.connect("./kennel.sqlite3") as conn:
-        db_cursor = conn.cursor()
+    check_fields(new_location, WRITABLE)
 
-        db_cursor.execute("""
-        UPDATE Location
-            SET
-                name = ?,
-                address = ?,
-        WHERE id = ?
-        """, (new_location['name'], new_location['address'], id, ))
+    result = execute_write("""
+    UPDATE Location
+        SET
+            name = ?,
+            address = ?
+    WHERE id = ?
+    """, (new_location['name'], new_location['address'], id, ))
 
-        # Were any rows affected?
-        # Did the client send an `id` that exists?
-        rows_affected = db_cursor.rowcount
+    # Were any rows affected?
+    # Did the client send an `id` that exists?
+    rows_affected = result.rowcount
+
+    # Also drops every cached animal and employee that embeds this location
+    CACHE.invalidate('locations', id)
+    versions.bump('locations')
 
     if rows_affected == 0:
         # Forces 404 response by main module
@@ -129,4 +180,121 @@ def update_location(id, new_location):
     else:
         # Forces 204 response by main module
         return True
-    
\ No newline at end of file
+
+def update_locations(changes, atomic=True):
+    """
+    Update many locations in one transaction from {'id': id, 'fields': {...}} changes.
+
+    See bulk_update for the per-id results and how `atomic` changes them.
+    """
+    results = bulk_update("Location", WRITABLE, changes, atomic)
+
+    # Also drops every cached animal and employee that embeds these locations
+    for result in results:
+        if result['status'] == 'updated':
+            CACHE.invalidate('locations', result['id'])
+    versions.bump('locations')
+
+    return results
+
+def delete_locations(ids=None, filters=None):
+    """
+    Delete many locations in one transaction, by id or by column filters.
+
+    """
+    results = bulk_delete("Location", ids, filters)
+
+    # Also drops every cached animal and employee that embeds these locations
+    for result in results:
+        if result['status'] == 'deleted':
+            CACHE.invalidate('locations', result['id'])
+    versions.bump('locations')
+
+    return results
+
+def get_locations_by_ids(ids):
+    """
+    Get the locations with any of `ids` in one query, as (id, location) pairs
+
+    """
+    with get_read_connection() as conn:
+        db_cursor = conn.cursor()
+        db_cursor.row_factory = Location.from_row
+
+        db_cursor.execute(f"""
+        SELECT
+            l.id,
+            l.name,
+            l.address
+        FROM Location l
+        WHERE l.id IN ({', '.join('?' for _ in ids)})
+        """, tuple(ids))
+
+        dataset = db_cursor.fetchall()
+
+    return [(location.id, location.to_dict()) for location in dataset]
+
+def get_all_location_stats():
+    """
+    Get the number of animals at every location, by status
+
+    Read from the trigger-maintained LocationStats table, so this costs
+    one row per location and status however many animals there are.
+    """
+    with get_read_connection() as conn:
+        db_cursor = conn.cursor()
+
+        db_cursor.execute("""
+        SELECT
+            l.id,
+            l.name,
+            s.status,
+            s.animals
+        FROM Location l
+        LEFT JOIN LocationStats s ON s.location_id = l.id
+        ORDER BY l.id, s.status
+        """)
+
+        dataset = db_cursor.fetchall()
+
+    return location_stats(dataset)
+
+def get_location_stats(id):
+    """
+    Get the number of animals at one location, by status
+
+    """
+    with get_read_connection() as conn:
+        db_cursor = conn.cursor()
+
+        db_cursor.execute("""
+        SELECT
+            l.id,
+            l.name,
+            s.status,
+            s.animals
+        FROM Location l
+        LEFT JOIN LocationStats s ON s.location_id = l.id
+        WHERE l.id = ?
+        ORDER BY s.status
+        """, (id, ))
+
+        dataset = db_cursor.fetchall()
+
+    stats = location_stats(dataset)
+    return stats[0] if stats else None
+
+def location_stats(rows):
+    """
+    Fold (location id, name, status, animals) rows into one summary per location
+
+    """
+    stats = []
+    for (location_id, name, status, animals) in rows:
+        if not stats or stats[-1]['location_id'] != location_id:
+            stats.append({'location_id': location_id, 'name': name,
+                          'animals': 0, 'statuses': {}})
+        if status is not None:
+            stats[-1]['animals'] += animals
+            stats[-1]['statuses'][status] = animals
+    return stats
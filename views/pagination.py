@@ -0,0 +1,27 @@
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def keyset_clause(column, after=None, limit=None):
+    """
+    Build the keyset pagination tail of a SELECT.
+
+    Rows are ordered by the primary key `column` and only rows after the
+    `after` cursor are read, so SQLite seeks straight to the page through
+    the primary key instead of scanning and discarding earlier rows.
+    Returns the SQL fragment and its parameters.
+    """
+    sql = ""
+    params = []
+
+    if after is not None:
+        sql += f" WHERE {column} > ?"
+        params.append(after)
+
+    sql += f" ORDER BY {column}"
+
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    return (sql, tuple(params))
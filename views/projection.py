@@ -0,0 +1,89 @@
+from serializer import dumps
+
+
+class Column():
+    """
+    The SQL behind one field of a resource.
+
+    A scalar field reads one expression. An embedded object (e.g. an
+    animal's location) reads several expressions into `keys`, and both may
+    need a `join` that is only added to the query when the field is asked for.
+    A join must be a LEFT JOIN, so that asking for a field never changes
+    which rows are returned; an embedded object without a row is null.
+    """
+    def __init__(self, sql, keys=None, join=None):
+        self.sql = (sql,) if isinstance(sql, str) else tuple(sql)
+        self.keys = keys
+        self.join = join
+
+
+class PartialRow(dict):
+    """
+    A row holding only the requested fields, encoded like a model.
+
+    """
+    __slots__ = ()
+
+    def to_dict(self):
+        """
+        The row itself, which already is a dictionary.
+        """
+        return self
+
+    def to_json(self):
+        """
+        The row encoded as JSON bytes.
+        """
+        return dumps(self)
+
+
+class Projection():
+    """
+    The SELECT list, joins and row factory for a subset of a resource's fields.
+
+    `columns` maps every field of the resource to its Column. The `id` is
+    always selected, since keyset pagination needs it. Joins are only kept
+    when a selected field needs them, so `?fields=id,name` on animals reads
+    the Animal table alone.
+    """
+    def __init__(self, columns, fields):
+        self.fields = ['id'] + [field for field in fields if field != 'id']
+
+        expressions = []
+        joins = []
+        # (field, index of its first expression, keys of an embedded object)
+        self._layout = []
+        for field in self.fields:
+            column = columns[field]
+            self._layout.append((field, len(expressions), column.keys))
+            expressions.extend(column.sql)
+            if column.join is not None and column.join not in joins:
+                joins.append(column.join)
+
+        self.select = ", ".join(expressions)
+        self.joins = " ".join(joins)
+
+    def row_factory(self, cursor, row):
+        """
+        Map a cursor tuple to a PartialRow of the selected fields.
+
+        """
+        result = PartialRow()
+        for (field, index, keys) in self._layout:
+            if keys is None:
+                result[field] = row[index]
+            else:
+                values = row[index:index + len(keys)]
+                result[field] = (None if all(value is None for value in values)
+                                 else dict(zip(keys, values)))
+        return result
+
+
+def project(data, fields):
+    """
+    Trim an already loaded dictionary to `fields` (plus its id).
+
+    """
+    if data is None or fields is None:
+        return data
+    return {field: data[field] for field in ['id'] + fields if field in data}
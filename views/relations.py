@@ -0,0 +1,66 @@
+"""
+Related entities attached to rows with one batched query per relation.
+
+    /animals?_expand=location      each animal with its whole location
+    /locations?_embed=animals      each location with a list of its animals
+
+Instead of one query per row, the keys of a whole batch of rows are
+collected, the related entities are read with a single `IN (...)` query
+and grouped back onto the rows in Python, so a page of locations with
+their animals costs two queries however many locations are on it.
+"""
+
+
+class Relation():
+    """
+    How to load one related resource for a batch of rows.
+
+    `load(keys)` reads every related entity for `keys` in one query and
+    returns (key, entity dict) pairs. An expanded relation (`many` false)
+    follows the row's `key` field to a single parent, e.g. an animal's
+    location_id; the pairs are keyed by the parent's id. An embedded
+    relation (`many` true) lists the children of each row, keyed by the
+    row id they belong to.
+    """
+    def __init__(self, resource, key, load, many=False):
+        self.resource = resource
+        self.key = key
+        self.load = load
+        self.many = many
+
+    @property
+    def requires(self):
+        """
+        The field every row needs for this relation to be attached.
+
+        """
+        return 'id' if self.many else self.key
+
+
+def attach(rows, relations):
+    """
+    Add each of `relations` ({name: Relation}) to every row dictionary.
+
+    Runs one query per relation for the whole batch. Rows without related
+    entities get an empty list (embedded) or None (expanded).
+    """
+    for (name, relation) in relations.items():
+        keys = []
+        seen = set()
+        for row in rows:
+            key = row.get(relation.requires)
+            if key is not None and key not in seen:
+                seen.add(key)
+                keys.append(key)
+
+        found = {}
+        for (key, entity) in relation.load(keys) if keys else ():
+            if relation.many:
+                found.setdefault(key, []).append(entity)
+            else:
+                found[key] = entity
+
+        for row in rows:
+            key = row.get(relation.requires)
+            row[name] = found.get(key, []) if relation.many else found.get(key)
+    return rows
@@ -0,0 +1,152 @@
+from models import Animal, Customer, Employee, Location
+from .animal_requests import (get_all_animals,
+                            iter_animals,
+                            get_single_animal,
+                            create_animal,
+                            create_animals,
+                            delete_animal,
+                            update_animal,
+                            update_animals,
+                            delete_animals,
+                            get_animals_by_location,
+                            get_animals_by_locations,
+                            get_animals_by_customers,
+                            search_animals,
+                            FILTERS as ANIMAL_FILTERS)
+from .customer_requests import (get_all_customers,
+                            iter_customers,
+                            get_single_customer,
+                            create_customer,
+                            create_customers,
+                            delete_customer,
+                            update_customer,
+                            update_customers,
+                            delete_customers,
+                            get_customers_by_email,
+                            get_customers_by_ids,
+                            search_customers)
+from .employee_requests import (get_all_employees,
+                            iter_employees,
+                            get_single_employee,
+                            create_employee,
+                            create_employees,
+                            delete_employee,
+                            update_employee,
+                            update_employees,
+                            delete_employees,
+                            get_employees_by_locations,
+                            search_employees)
+from .location_requests import (get_all_locations,
+                            iter_locations,
+                            get_single_location,
+                            create_location,
+                            create_locations,
+                            delete_location,
+                            update_location,
+                            update_locations,
+                            delete_locations,
+                            get_locations_by_ids,
+                            get_all_location_stats,
+                            get_location_stats)
+from .relations import Relation
+
+# The views behind each resource. The router in `dispatch` builds its
+# route table from this, so adding a resource only means adding an entry.
+#
+#   model        the model class, whose `fields` may be selected with ?fields=
+#   list         one keyset page of the collection (limit, after, fields)
+#   stream       the whole collection as an iterator of models (fields)
+#   get          one entity by id
+#   create       insert one entity from a dictionary
+#   create_many  insert a list of entities in one transaction
+#   update       replace one entity by id, returning False if it does not exist
+#   update_many  apply a list of {id, fields} changes in one transaction
+#   delete       delete one entity by id
+#   delete_many  delete by a list of ids or by filters in one transaction
+#   filters      columns a bulk delete may filter on
+#   filter_set   the FilterSet compiling ?<field>= filters and ?_sort= on GET
+#   search       one ranked page of full-text matches for ?q= and /search
+#   lookups      query parameters that select a filtered list instead
+#   related      views of GET /<resource>/<id>/<name>, listing related entities
+#   stats        GET /<resource>/stats, a summary of the whole collection
+#   item_stats   GET /<resource>/<id>/stats, a summary of one entity
+#   expand       parents that ?_expand=<name> attaches to every row
+#   embed        children that ?_embed=<name> lists on every row
+RESOURCES = {
+    'animals': {
+        'model': Animal,
+        'list': get_all_animals,
+        'stream': iter_animals,
+        'get': get_single_animal,
+        'create': create_animal,
+        'create_many': create_animals,
+        'update': update_animal,
+        'update_many': update_animals,
+        'delete': delete_animal,
+        'delete_many': delete_animals,
+        'filters': ('name', 'breed', 'status', 'location_id', 'customer_id'),
+        'filter_set': ANIMAL_FILTERS,
+        'search': search_animals,
+        'expand': {
+            'location': Relation('locations', 'location_id', get_locations_by_ids),
+            'customer': Relation('customers', 'customer_id', get_customers_by_ids)
+        }
+    },
+    'locations': {
+        'model': Location,
+        'list': get_all_locations,
+        'stream': iter_locations,
+        'get': get_single_location,
+        'create': create_location,
+        'create_many': create_locations,
+        'update': update_location,
+        'update_many': update_locations,
+        'delete': delete_location,
+        'delete_many': delete_locations,
+        'filters': ('name', 'address'),
+        'related': {
+            'animals': get_animals_by_location
+        },
+        'stats': get_all_location_stats,
+        'item_stats': get_location_stats,
+        'embed': {
+            'animals': Relation('animals', 'location_id', get_animals_by_locations, many=True),
+            'employees': Relation('employees', 'location_id', get_employees_by_locations,
+                                  many=True)
+        }
+    },
+    'employees': {
+        'model': Employee,
+        'list': get_all_employees,
+        'stream': iter_employees,
+        'get': get_single_employee,
+        'create': create_employee,
+        'create_many': create_employees,
+        'update': update_employee,
+        'update_many': update_employees,
+        'delete': delete_employee,
+        'delete_many': delete_employees,
+        'filters': ('name', 'address', 'location_id'),
+        'search': search_employees
+    },
+    'customers': {
+        'model': Customer,
+        'list': get_all_customers,
+        'stream': iter_customers,
+        'get': get_single_customer,
+        'create': create_customer,
+        'create_many': create_customers,
+        'update': update_customer,
+        'update_many': update_customers,
+        'delete': delete_customer,
+        'delete_many': delete_customers,
+        'filters': ('name', 'address', 'email'),
+        'search': search_customers,
+        'lookups': {
+            'email': get_customers_by_email
+        },
+        'embed': {
+            'animals': Relation('animals', 'customer_id', get_animals_by_customers, many=True)
+        }
+    }
+}
@@ -0,0 +1,25 @@
+"""
+Full-text search over the FTS5 indexes of migration 0005.
+
+A search string is reduced to its words and every word must match the
+start of a word in the indexed text, so "sno bea" finds Snoopy the Beagle.
+Results are ordered best match first (bm25) and paged by offset: FTS5
+scores every match to rank them, so a keyset cursor would save nothing.
+"""
+import re
+
+WORD = re.compile(r"\w+")
+
+
+def match_expression(text):
+    """
+    Build the FTS5 MATCH expression for a user's search string.
+
+    Each word becomes a quoted prefix term, so FTS5 operators and syntax in
+    the input are matched as plain words. Raises ValueError when the string
+    has no words at all.
+    """
+    words = WORD.findall(text)
+    if not words:
+        raise ValueError("q must contain at least one word")
+    return " ".join(f'"{word}"*' for word in words)
@@ -0,0 +1,63 @@
+"""
+Type checks of the fields clients write.
+
+Every views module declares WRITABLE, its writable columns mapped to the
+(type, nullable) of their values. Values are checked before they reach
+sqlite, which would otherwise store "abc" in an INTEGER column, or reject
+a nested object with a ProgrammingError instead of a useful message.
+"""
+class Conflict(Exception):
+    """
+    Raised when a write would duplicate a value that must be unique.
+
+    """
+
+
+TYPE_NAMES = {
+    str: "a string",
+    int: "an integer"
+}
+
+# sqlite stores integers as signed 64 bit values
+INTEGER_RANGE = range(-2 ** 63, 2 ** 63)
+
+
+def field_errors(item, columns, partial=False):
+    """
+    Describe every problem with the values of `item`, a decoded JSON object.
+
+    Unless `partial`, every column of `columns` must be present. Fields
+    that are not columns are left alone. Returns a list of messages, empty
+    when the item is valid.
+    """
+    if not isinstance(item, dict):
+        return ["item must be an object"]
+
+    errors = []
+    missing = [column for column in columns if column not in item]
+    if missing and not partial:
+        errors.append(f"missing {', '.join(missing)}")
+
+    for (column, (kind, nullable)) in columns.items():
+        if column not in item:
+            continue
+        value = item[column]
+        if value is None:
+            if not nullable:
+                errors.append(f"{column} cannot be null")
+        # JSON true/false decode to bool, which is an int subclass
+        elif not isinstance(value, kind) or isinstance(value, bool):
+            errors.append(f"{column} must be {TYPE_NAMES[kind]}")
+        elif kind is int and value not in INTEGER_RANGE:
+            errors.append(f"{column} is out of range")
+    return errors
+
+
+def check_fields(item, columns, partial=False):
+    """
+    Raise ValueError describing the problems of `item`, if it has any.
+
+    """
+    errors = field_errors(item, columns, partial)
+    if errors:
+        raise ValueError("; ".join(errors))
@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+
+TABLES = ('animals', 'locations', 'employees', 'customers')
+
+# The tables whose rows appear in each resource's representation. Nested
+# routes such as /locations/<id>/animals are keyed '<resource>/<name>'.
+DEPENDENCIES = {
+    'animals': ('animals', 'locations', 'customers'),
+    'locations': ('locations',),
+    'employees': ('employees', 'locations'),
+    'customers': ('customers',),
+    'locations/animals': ('animals', 'locations', 'customers'),
+    'locations/stats': ('animals', 'locations'),
+    'search': ('animals', 'locations', 'employees', 'customers')
+}
+
+# The counters live in shared memory created before any prefork worker is
+# started, so a write in one worker changes the version every worker sees.
+_COUNTERS = multiprocessing.RawArray('Q', len(TABLES))
+_LOCK = multiprocessing.Lock()
+_INDEX = {table: index for (index, table) in enumerate(TABLES)}
+
+# Distinguishes this server run, so ETags from before a restart never match
+EPOCH = os.urandom(4).hex()
+
+
+def bump(table):
+    """
+    Record that rows of `table` were created, updated or deleted.
+
+    """
+    with _LOCK:
+        _COUNTERS[_INDEX[table]] += 1
+
+
+def version(table):
+    """
+    Return the current version counter of `table`.
+
+    """
+    return _COUNTERS[_INDEX[table]]
+
+
+def snapshot(tables=TABLES):
+    """
+    Return the current version counters of `tables`, as a tuple.
+
+    """
+    return tuple(_COUNTERS[_INDEX[table]] for table in tables)
+
+
+def etag(resource, related=()):
+    """
+    Return a strong ETag for the current state of `resource`.
+
+    `related` lists resources whose entities are attached to it as well,
+    e.g. the animals embedded with ?_embed=animals. Computing it reads a
+    few shared counters and never touches the database.
+    """
+    tables = DEPENDENCIES[resource]
+    for other in related:
+        tables += tuple(table for table in DEPENDENCIES[other] if table not in tables)
+    counters = "-".join(str(_COUNTERS[_INDEX[table]]) for table in tables)
+    return f'"{resource}.{EPOCH}.{counters}"'
@@ -0,0 +1,246 @@
+"""
+An optional group-commit queue for single-row writes.
+
+Without it every create, update and delete commits on its own, so each
+write pays for its own fsync and concurrent writers take turns on the
+database lock. With the queue enabled the writes are handed to one writer
+thread that runs whatever has queued up (waiting at most MAX_LATENCY for
+more) inside a single transaction, so a burst of writes shares one commit.
+
+Every write runs in its own savepoint, so a failing write is rolled back
+alone and its caller gets the same exception it would have got from a
+direct execute. Results are only handed back after the commit. A caller
+waits at most WRITE_TIMEOUT for its commit and then gets WriteTimeout.
+"""
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+import metrics
+from . import database
+
+ENABLED = os.environ.get("KENNEL_WRITE_QUEUE", "") not in ("", "0")
+MAX_LATENCY = float(os.environ.get("KENNEL_WRITE_MAX_LATENCY", 0.002))
+MAX_BATCH = int(os.environ.get("KENNEL_WRITE_MAX_BATCH", 256))
+WRITE_TIMEOUT = float(os.environ.get("KENNEL_WRITE_TIMEOUT", 5.0))
+
+WriteResult = namedtuple('WriteResult', 'lastrowid rowcount')
+
+_Job = namedtuple('_Job', 'sql params future')
+
+
+class WriteTimeout(Exception):
+    """
+    Raised when a queued write was not committed within WRITE_TIMEOUT.
+
+    """
+
+
+class WriteQueue():
+    """
+    A single writer thread that commits queued statements in groups.
+
+    The thread and its connection are created by the first write, so a
+    queue configured before a prefork fork starts its own writer in each
+    worker process.
+    """
+    def __init__(self, path, max_latency=MAX_LATENCY, max_batch=MAX_BATCH,
+                 synchronous=None):
+        self.path = path
+        self.max_latency = max_latency
+        self.max_batch = max_batch
+        self.synchronous = synchronous
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._commits = 0
+        self._writes = 0
+
+    def submit(self, sql, params=()):
+        """
+        Queue one statement, returning a Future of its WriteResult.
+
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="kennel-writer",
+                                                daemon=True)
+                self._thread.start()
+        future = Future()
+        self._jobs.put(_Job(sql, params, future))
+        return future
+
+    def execute(self, sql, params=(), timeout=None):
+        """
+        Run one statement through the queue and wait for its commit.
+
+        Raises WriteTimeout when it is not committed within `timeout`
+        seconds (default WRITE_TIMEOUT). A write still waiting in the queue
+        by then is cancelled; one the writer already started may still
+        commit.
+        """
+        timeout = WRITE_TIMEOUT if timeout is None else timeout
+        future = self.submit(sql, params)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeout as ex:
+            future.cancel()
+            raise WriteTimeout(f"write not committed after {timeout}s") from ex
+
+    def _connect(self):
+        # Autocommit mode, so the writer controls every transaction itself
+        return database.connect(self.path, synchronous=self.synchronous,
+                                isolation_level=None)
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            batch = [self._jobs.get()]
+            if batch[0] is None:
+                break
+
+            deadline = time.monotonic() + self.max_latency
+            stop = False
+            while len(batch) < self.max_batch:
+                wait = deadline - time.monotonic()
+                try:
+                    job = self._jobs.get(timeout=wait) if wait > 0 else self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    stop = True
+                    break
+                batch.append(job)
+
+            try:
+                self._commit(conn, batch)
+            except Exception as ex:
+                # Whatever failed, the writer keeps serving later writes
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(ex)
+            if stop:
+                break
+        conn.close()
+
+    def _commit(self, conn, batch):
+        # Writes whose callers gave up waiting are skipped
+        batch = [job for job in batch if job.future.set_running_or_notify_cancel()]
+        outcomes = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job in batch:
+                conn.execute("SAVEPOINT queued_write")
+                try:
+                    cursor = conn.execute(job.sql, job.params)
+                # Not only sqlite3.Error: e.g. an int too large to bind
+                # raises OverflowError, and fails only its own write
+                except Exception as ex:
+                    conn.execute("ROLLBACK TO SAVEPOINT queued_write")
+                    conn.execute("RELEASE SAVEPOINT queued_write")
+                    outcomes.append((job, None, ex))
+                    continue
+                conn.execute("RELEASE SAVEPOINT queued_write")
+                outcomes.append((job, WriteResult(cursor.lastrowid, cursor.rowcount), None))
+            conn.execute("COMMIT")
+        except Exception as ex:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for job in batch:
+                job.future.set_exception(ex)
+            return
+
+        self._commits += 1
+        self._writes += len(batch)
+        for (job, result, error) in outcomes:
+            if error is not None:
+                job.future.set_exception(error)
+            else:
+                job.future.set_result(result)
+
+    def close(self):
+        """
+        Commit everything already queued and stop the writer thread.
+
+        """
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread is not None:
+            self._jobs.put(None)
+            thread.join()
+
+    def stats(self):
+        """
+        Return a snapshot of the queue counters.
+
+        """
+        return {
+            'commits': self._commits,
+            'writes': self._writes,
+            'pending': self._jobs.qsize()
+        }
+
+
+QUEUE = WriteQueue(database.DB_PATH, synchronous=database.SYNCHRONOUS) if ENABLED else None
+
+
+def configure(enabled=None, max_latency=None, max_batch=None, timeout=None):
+    """
+    Turn the queue on or off, set how long and how many writes it batches
+    and how long a caller waits for its commit.
+
+    The queue writes to the database the shared pool points at, with the
+    same synchronous level, so call this after `database.configure`.
+    """
+    global QUEUE, ENABLED, MAX_LATENCY, MAX_BATCH, WRITE_TIMEOUT
+    if timeout is not None:
+        WRITE_TIMEOUT = timeout
+    if enabled is not None:
+        ENABLED = enabled
+    if max_latency is not None:
+        MAX_LATENCY = max_latency
+    if max_batch is not None:
+        MAX_BATCH = max_batch
+
+    old = QUEUE
+    QUEUE = (WriteQueue(database.POOL.path, MAX_LATENCY, MAX_BATCH, database.POOL.synchronous)
+             if ENABLED else None)
+    if old is not None:
+        old.close()
+    return QUEUE
+
+
+def execute_write(sql, params=()):
+    """
+    Run a single-statement write, through the queue when it is enabled.
+
+    Returns a WriteResult with the lastrowid and rowcount of the statement.
+    A queued write runs on the writer thread, so the wait for its commit is
+    what counts as the caller's DB time.
+    """
+    if QUEUE is not None:
+        start = metrics.clock()
+        try:
+            return QUEUE.execute(sql, params)
+        finally:
+            metrics.add_db(metrics.clock() - start)
+
+    with database.get_connection() as conn:
+        cursor = conn.execute(sql, params)
+        return WriteResult(cursor.lastrowid, cursor.rowcount)
+
+
+def _reset_after_fork():
+    # The writer thread does not survive a fork, so a child process gets a
+    # fresh queue that starts its own thread on the first write.
+    global QUEUE
+    if QUEUE is not None:
+        QUEUE = WriteQueue(QUEUE.path, QUEUE.max_latency, QUEUE.max_batch,
+                           QUEUE.synchronous)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)